@@ -0,0 +1,23 @@
+-- Per-ticker rolling indicator state for incremental daily_indicators updates
+-- (Wilder RSI averages, SMA20/50/200 rolling sums, AVWAP anchor with cumulative PV/V,
+--  and the trailing 250-bar close/low/volume tails needed to advance them).
+
+create table if not exists public.daily_indicator_state (
+  code text primary key,
+  last_date date not null,
+  bars integer not null default 0,
+  state jsonb not null default '{}'::jsonb,
+  updated_at timestamptz not null default now()
+);
+
+create index if not exists daily_indicator_state_last_date_idx
+  on public.daily_indicator_state (last_date desc);
+
+alter table public.daily_indicator_state enable row level security;
+
+drop policy if exists "daily_indicator_state_service_write" on public.daily_indicator_state;
+create policy "daily_indicator_state_service_write"
+  on public.daily_indicator_state for all
+  to service_role
+  using (true)
+  with check (true);
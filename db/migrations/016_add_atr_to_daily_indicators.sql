@@ -0,0 +1,3 @@
+alter table if exists public.daily_indicators
+  add column if not exists atr14 numeric,
+  add column if not exists atr_pct numeric;
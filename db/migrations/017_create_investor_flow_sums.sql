@@ -0,0 +1,59 @@
+-- Server-side institution/foreign net-buy sums over a date window so the batch
+-- pulls one row per ticker (or sector) instead of every investor_daily row.
+
+create index if not exists investor_daily_date_ticker_idx
+  on public.investor_daily (date, ticker);
+
+create or replace function public.investor_flow_sums(
+  p_start date,
+  p_end date,
+  p_tickers text[] default null
+)
+returns table (
+  ticker text,
+  institution_sum bigint,
+  foreign_sum bigint,
+  days integer
+)
+language sql
+stable
+as $$
+  select
+    d.ticker::text,
+    coalesce(sum(d.institution_amount), 0)::bigint,
+    coalesce(sum(d.foreign_amount), 0)::bigint,
+    count(*)::integer
+  from public.investor_daily d
+  where d.date between p_start and p_end
+    and (p_tickers is null or d.ticker = any(p_tickers))
+  group by d.ticker
+$$;
+
+create or replace function public.sector_investor_flow_sums(
+  p_start date,
+  p_end date
+)
+returns table (
+  sector_id text,
+  institution_sum bigint,
+  foreign_sum bigint,
+  tickers integer
+)
+language sql
+stable
+as $$
+  select
+    s.sector_id::text,
+    coalesce(sum(d.institution_amount), 0)::bigint,
+    coalesce(sum(d.foreign_amount), 0)::bigint,
+    count(distinct d.ticker)::integer
+  from public.investor_daily d
+  join public.stocks s on s.code = d.ticker
+  where d.date between p_start and p_end
+    and s.sector_id is not null
+    and s.is_active
+  group by s.sector_id
+$$;
+
+grant execute on function public.investor_flow_sums(date, date, text[]) to service_role;
+grant execute on function public.sector_investor_flow_sums(date, date) to service_role;
@@ -0,0 +1,57 @@
+-- Sparse bulk partial update: p_rows is a JSON array of {"key": ..., "patch": {...}}.
+-- Only the columns present in each patch are written, so NOT NULL columns the
+-- caller does not mention (stocks.name, ...) are left alone. Restricted to the
+-- tables the batch patches; returns the number of updated rows.
+
+create or replace function public.bulk_patch_rows(
+  p_table text,
+  p_key text,
+  p_rows jsonb
+)
+returns integer
+language plpgsql
+as $$
+declare
+  v_cols text[];
+  v_set text;
+  v_count integer;
+begin
+  if p_table not in ('sectors', 'stocks') then
+    raise exception 'bulk_patch_rows: table % is not allowed', p_table;
+  end if;
+
+  select array_agg(distinct k)
+    into v_cols
+  from jsonb_array_elements(p_rows) e,
+       jsonb_object_keys(e -> 'patch') k;
+  if v_cols is null then
+    return 0;
+  end if;
+
+  select string_agg(
+           format(
+             '%1$I = case when r.patch ? %2$L then (jsonb_populate_record(null::public.%3$I, r.patch)).%1$I else t.%1$I end',
+             c.column_name, c.column_name, p_table
+           ),
+           ', '
+         )
+    into v_set
+  from information_schema.columns c
+  where c.table_schema = 'public'
+    and c.table_name = p_table
+    and c.column_name = any(v_cols)
+    and c.column_name <> p_key;
+  if v_set is null then
+    return 0;
+  end if;
+
+  execute format(
+    'update public.%I t set %s from jsonb_to_recordset($1) as r(key text, patch jsonb) where t.%I::text = r.key',
+    p_table, v_set, p_key
+  ) using p_rows;
+  get diagnostics v_count = row_count;
+  return v_count;
+end;
+$$;
+
+grant execute on function public.bulk_patch_rows(text, text, jsonb) to service_role;
@@ -3,7 +3,7 @@ scripts/backfill_credit_short_daily.py
 =====================================
 공매도 데이터 과거 백필 스크립트
 - KRX MDC_OUT API (인증 불필요 공개 엔드포인트) 사용
-- ISIN 매핑: KRX finder_stkisu API
+- ISIN 매핑: KRX finder_stkisu API (batch_modules.krx, 디스크 캐시)
 - 공매도 거래 비율: MDCSTAT30102_OUT (일별 공매도 수량/비율)
 - 공매도 잔고 비율: MDCSTAT30502_OUT (공매도 순보유잔고)
 - stock_credit_short_daily 테이블에 저장
@@ -17,15 +17,17 @@ from __future__ import annotations
 
 import os
 import sys
-import time
 import argparse
 from datetime import datetime, timedelta
 from typing import Optional
 
-import requests
 from supabase import create_client, Client
 from pykrx import stock as pykrx_stock
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from batch_modules.calendar import trading_days_between
+from batch_modules.krx import get_krx_client
+
 
 # ===== 환경 변수 설정 =====
 def load_env_file(filepath: str = ".env") -> None:
@@ -55,59 +57,17 @@ if not SUPABASE_URL or not SUPABASE_KEY:
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-# KRX API 기본 설정
-KRX_API_URL = "https://data.krx.co.kr/comm/bldAttendant/getJsonData.cmd"
-KRX_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-KRX_HEADERS = {
-    "User-Agent": KRX_UA,
-    "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
-    "X-Requested-With": "XMLHttpRequest",
-    "Referer": "https://data.krx.co.kr/",
-}
-
-
 def to_iso(yyyymmdd: str) -> str:
     return f"{yyyymmdd[:4]}-{yyyymmdd[4:6]}-{yyyymmdd[6:8]}"
 
 
-def get_krx_session() -> requests.Session:
-    """KRX MDC_OUT API 접근용 세션 생성"""
-    sess = requests.Session()
-    sess.headers.update(KRX_HEADERS)
-    try:
-        sess.get("https://data.krx.co.kr/", timeout=10)
-    except Exception:
-        pass
-    return sess
-
-
-def load_isin_map(sess: requests.Session) -> dict:
-    """
-    KRX finder_stkisu API로 전체 종목 코드 to ISIN 매핑.
-    Returns: {"005930": "KR7005930003", "035720": "KR7035720002", ...}
-    """
+def get_trading_dates(start_date: str, end_date: str) -> list:
+    """실제 거래일만 반환 (YYYYMMDD 리스트). KRX 캘린더 캐시 우선, 실패 시 일자별 조회"""
     try:
-        r = sess.post(
-            KRX_API_URL,
-            data={
-                "bld": "dbms/comm/finder/finder_stkisu",
-                "mktsel": "ALL",
-                "typeNo": "0",
-                "pagePath": "/contents/MDC/STAT/srt/MDCSTAT300.cmd",
-                "codeNm": "",
-            },
-            timeout=30,
-        )
-        r.raise_for_status()
-        block = r.json().get("block1", [])
-        return {item["short_code"]: item["full_code"] for item in block}
+        return trading_days_between(start_date, end_date)
     except Exception as e:
-        print(f"  ISIN 매핑 조회 실패: {e}")
-        return {}
-
+        print(f"  거래일 캘린더 조회 실패, 일자별 조회로 대체: {e}")
 
-def get_trading_dates(start_date: str, end_date: str) -> list:
-    """pykrx 기준으로 실제 거래일만 반환 (YYYYMMDD 리스트)"""
     start_dt = datetime.strptime(start_date, "%Y%m%d").date()
     end_dt = datetime.strptime(end_date, "%Y%m%d").date()
     trading_dates = []
@@ -140,76 +100,6 @@ def load_target_codes() -> list:
         return []
 
 
-def fetch_short_trade(sess: requests.Session, isin: str, start_date: str, end_date: str) -> dict:
-    """
-    MDCSTAT30102_OUT: 개별종목 일별 공매도 거래 데이터.
-    Returns: {"20260515": {"short_volume": 136584}, ...}
-    """
-    result = {}
-    try:
-        r = sess.post(
-            KRX_API_URL,
-            data={
-                "bld": "dbms/MDC_OUT/STAT/srt/MDCSTAT30102_OUT",
-                "isuCd": isin,
-                "strtDd": start_date,
-                "endDd": end_date,
-                "money": "1",
-                "csvxls_isNo": "false",
-            },
-            timeout=10,
-        )
-        r.raise_for_status()
-        for row in r.json().get("OutBlock_1", []):
-            date_str = row.get("TRD_DD", "").replace("/", "")
-            if len(date_str) != 8:
-                continue
-            try:
-                volume = int(str(row.get("CVSRTSELL_TRDVOL", "0")).replace(",", "") or "0")
-                result[date_str] = {"short_volume": volume}
-            except (ValueError, TypeError):
-                pass
-    except Exception:
-        pass
-    return result
-
-
-def fetch_short_balance(sess: requests.Session, isin: str, start_date: str, end_date: str) -> dict:
-    """
-    MDCSTAT30502_OUT: 개별종목 공매도 잔고 데이터.
-    Returns: {"20260514": {"short_balance": 316122, "short_ratio": 0.01}, ...}
-    보고의무 기준이므로 일부 날짜만 존재할 수 있음.
-    """
-    result = {}
-    try:
-        r = sess.post(
-            KRX_API_URL,
-            data={
-                "bld": "dbms/MDC_OUT/STAT/srt/MDCSTAT30502_OUT",
-                "isuCd": isin,
-                "strtDd": start_date,
-                "endDd": end_date,
-                "money": "1",
-                "csvxls_isNo": "false",
-            },
-            timeout=10,
-        )
-        r.raise_for_status()
-        for row in r.json().get("OutBlock_1", []):
-            date_str = row.get("RPT_DUTY_OCCR_DD", "").replace("/", "")
-            if len(date_str) != 8:
-                continue
-            try:
-                balance = int(str(row.get("BAL_QTY", "0")).replace(",", "") or "0")
-                ratio = float(str(row.get("BAL_RT") or row.get("STCK_BAL_RT") or row.get("SLVL_RT") or "0").replace(",", "") or "0")
-                result[date_str] = {"short_balance": balance, "short_ratio": ratio}
-            except (ValueError, TypeError):
-                pass
-    except Exception:
-        pass
-    return result
-
-
 def _upsert_batch(rows: list) -> None:
     try:
         supabase.table("stock_credit_short_daily").upsert(
@@ -235,10 +125,10 @@ def backfill_credit_short_daily(
     print(f"\n[공매도 데이터 백필]")
     print(f"  범위: {start_date} ~ {end_date}  dry_run={dry_run}")
 
-    # 1. KRX 세션 및 ISIN 매핑
+    # 1. KRX 클라이언트 및 ISIN 매핑 (디스크 캐시)
     print("\n  [1/4] KRX 세션 초기화 및 ISIN 매핑 조회...")
-    sess = get_krx_session()
-    isin_map = load_isin_map(sess)
+    client = get_krx_client()
+    isin_map = client.isin_map()
     print(f"  ISIN 매핑: {len(isin_map)}개 종목")
     if not isin_map:
         return {"success": 0, "fail": 0, "total": 0}
@@ -264,49 +154,52 @@ def backfill_credit_short_daily(
     fail = 0
     batch_rows = []
     BATCH_SIZE = 500
-
-    for idx, code in enumerate(codes):
-        isin = isin_map.get(code)
-        if not isin:
-            fail += 1
-            continue
-
-        trade_data = fetch_short_trade(sess, isin, start_date, end_date)
-        balance_data = fetch_short_balance(sess, isin, start_date, end_date)
-
-        has_data = False
-        for date_str in trading_dates:
-            trade = trade_data.get(date_str, {})
-            balance = balance_data.get(date_str, {})
-
-            short_volume = trade.get("short_volume")
-            short_ratio = balance.get("short_ratio")
-            short_balance = balance.get("short_balance")
-
-            if short_volume is not None or short_ratio is not None or short_balance is not None:
-                batch_rows.append({
-                    "code": code,
-                    "date": to_iso(date_str),
-                    "credit_ratio": None,
-                    "short_ratio": short_ratio,
-                    "short_balance": short_balance,
-                    "short_volume": short_volume,
-                })
-                has_data = True
-
-        if has_data:
-            success += 1
-        else:
-            fail += 1
+    CODE_CHUNK = 100
+
+    mapped = [c for c in codes if c in isin_map]
+    fail += len(codes) - len(mapped)
+    for chunk_start in range(0, len(mapped), CODE_CHUNK):
+        chunk = mapped[chunk_start:chunk_start + CODE_CHUNK]
+        fetched = client.fetch_short_many(chunk, start_date, end_date, progress_every=0)
+
+        for code in chunk:
+            trade_data = fetched[code].get("trade") or {}
+            balance_data = fetched[code].get("balance") or {}
+
+            has_data = False
+            for date_str in trading_dates:
+                trade = trade_data.get(date_str, {})
+                balance = balance_data.get(date_str, {})
+
+                short_volume = trade.get("short_volume")
+                short_ratio = balance.get("short_ratio")
+                short_balance = balance.get("short_balance")
+
+                if short_volume is not None or short_ratio is not None or short_balance is not None:
+                    batch_rows.append({
+                        "code": code,
+                        "date": to_iso(date_str),
+                        "credit_ratio": None,
+                        "short_ratio": short_ratio,
+                        "short_balance": short_balance,
+                        "short_volume": short_volume,
+                    })
+                    has_data = True
+
+            if has_data:
+                success += 1
+            else:
+                fail += 1
 
         if len(batch_rows) >= BATCH_SIZE and not dry_run:
             _upsert_batch(batch_rows)
             batch_rows = []
 
-        if (idx + 1) % 50 == 0 or (idx + 1) == len(codes):
-            print(f"    진행: {idx+1}/{len(codes)} | 성공: {success} | 실패: {fail} | 대기: {len(batch_rows)}건")
-
-        time.sleep(0.05)
+        done = chunk_start + len(chunk)
+        print(f"    진행: {done}/{len(mapped)} | 성공: {success} | 실패: {fail} | 대기: {len(batch_rows)}건 | KRX: {client.status()}")
+        if client.blocked:
+            print("    KRX 차단 감지 → 조기 종료")
+            break
 
     if batch_rows and not dry_run:
         _upsert_batch(batch_rows)
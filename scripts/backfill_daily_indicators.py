@@ -9,14 +9,20 @@ from __future__ import annotations
 
 import argparse
 import os
+import queue
 import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from datetime import datetime, timedelta
-from typing import Optional
 
 import pandas as pd
 import numpy as np
+from pathlib import Path
 from supabase import create_client, Client
 
+sys.path.insert(0, str(Path(__file__).parent))
+from batch_modules.utils import rolling_anchored_avwap
+
 # ===== 환경 변수 설정 =====
 def load_env_file(filepath=".env"):
     try:
@@ -33,17 +39,6 @@ def load_env_file(filepath=".env"):
     except FileNotFoundError:
         pass
 
-load_env_file()
-
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-
-if not SUPABASE_URL or not SUPABASE_KEY:
-    print("🚨 [Error] SUPABASE_URL or SERVICE_ROLE_KEY missing", file=sys.stderr)
-    sys.exit(1)
-
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
 # ===== 유틸리티 =====
 def safe_float(x, default=0.0):
     try:
@@ -74,22 +69,13 @@ def calculate_rsi(series: pd.Series, period: int = 14) -> pd.Series:
     return 100 - (100 / (1 + rs))
 
 
-def calculate_avwap(df: pd.DataFrame, anchor_idx: int) -> Optional[float]:
-    """최저가 이후 VWAP 계산"""
-    if len(df) == 0 or anchor_idx < 0 or anchor_idx >= len(df):
-        return None
-    subset = df.iloc[anchor_idx:].copy()
-    v_cumsum = subset["volume"].cumsum()
-    if v_cumsum.iloc[-1] == 0:
-        return None
-    pv = (subset["close"] * subset["volume"]).cumsum()
-    return float((pv / v_cumsum).iloc[-1])
-
-
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="daily_indicators historical backfill")
     parser.add_argument("--start", default="", help="start date (YYYYMMDD or YYYY-MM-DD)")
     parser.add_argument("--end", default="", help="end date (YYYYMMDD or YYYY-MM-DD)")
+    parser.add_argument("--workers", type=int, default=1, help="indicator worker processes (1 = serial)")
+    parser.add_argument("--writers", type=int, default=2, help="concurrent upsert threads")
+    parser.add_argument("--ticker-chunk", type=int, default=50, help="tickers loaded/computed per streaming chunk (bounds peak memory)")
     return parser.parse_args()
 
 
@@ -119,53 +105,76 @@ def normalize_int(v):
 
 
 # =============================================
-# STEP 1: stock_daily 데이터 로드
+# STEP 1: stock_daily 데이터 로드 (종목 구간 단위 스트리밍)
 # =============================================
-def fetch_all_stock_daily() -> pd.DataFrame:
-    """stock_daily의 전체 데이터 조회 (2025-04-11 ~ 현재)"""
-    print("\n[1/3] stock_daily 데이터 로드...")
-    
-    try:
-        # 전체 데이터 조회 (pagination)
-        all_rows = []
-        offset = 0
-        page_size = 1000
-        
-        while True:
-            res = supabase.table("stock_daily") \
-                .select("*") \
-                .range(offset, offset + page_size - 1) \
-                .order("date", desc=False) \
-                .execute()
-            
-            if not res.data:
-                break
-            
-            all_rows.extend(res.data)
-            offset += page_size
-            
-            if len(res.data) < page_size:
-                break
-            
-            if offset % (page_size * 10) == 0:
-                print(f"  -> 로드 중: {offset}행...")
-        
-        if not all_rows:
-            print("  ⚠️ stock_daily 데이터가 없습니다.")
-            return pd.DataFrame()
-        
-        df = pd.DataFrame(all_rows)
-        df["date"] = pd.to_datetime(df["date"])
-        df = df.sort_values(["ticker", "date"])
-        
-        print(f"  ✅ {len(df):,}행 로드 완료")
-        print(f"     범위: {df['date'].min().date()} ~ {df['date'].max().date()}")
-        print(f"     종목: {df['ticker'].nunique()}개")
-        
-        return df
-    except Exception as e:
-        print(f"  ❌ 로드 실패: {e}")
+def fetch_ticker_ranges(supabase: Client, ticker_chunk: int) -> list[tuple[str | None, str | None]]:
+    """stocks 코드 목록을 ticker_chunk개 단위로 잘라 [lo, hi) 종목 구간 목록 반환.
+
+    양 끝 구간은 열려 있어 stocks에 없는 종목(상장폐지 등)의 stock_daily도 포함된다.
+    """
+    codes: list[str] = []
+    offset = 0
+    page_size = 1000
+    while True:
+        res = supabase.table("stocks") \
+            .select("code") \
+            .order("code", desc=False) \
+            .range(offset, offset + page_size - 1) \
+            .execute()
+        page = res.data or []
+        codes.extend(str(r["code"]) for r in page if r.get("code"))
+        if len(page) < page_size:
+            break
+        offset += page_size
+
+    bounds = sorted(set(codes))[ticker_chunk::ticker_chunk]
+    edges: list[str | None] = [None, *bounds, None]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def fetch_stock_daily_range(supabase: Client, lo: str | None, hi: str | None, end_date: str = "") -> pd.DataFrame:
+    """[lo, hi) 종목 구간의 stock_daily 전체 이력 조회 (end_date 이후 행은 지표에 영향이 없어 제외)"""
+    rows = []
+    offset = 0
+    page_size = 1000
+    while True:
+        query = supabase.table("stock_daily").select("ticker, date, low, close, volume, value")
+        if lo:
+            query = query.gte("ticker", lo)
+        if hi:
+            query = query.lt("ticker", hi)
+        if end_date:
+            query = query.lte("date", end_date)
+        res = query.order("ticker").order("date") \
+            .range(offset, offset + page_size - 1).execute()
+        page = res.data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            break
+        offset += page_size
+
+    if not rows:
         return pd.DataFrame()
+    df = pd.DataFrame(rows)
+    df["date"] = pd.to_datetime(df["date"])
+    return df.sort_values(["ticker", "date"])
+
+
+def iter_stock_daily_chunks(supabase: Client, ticker_chunk: int, end_date: str = ""):
+    """종목 구간별 stock_daily DataFrame을 순차적으로 yield (동시에 한 구간만 메모리에 유지)"""
+    print(f"\n[1/3] stock_daily 종목 구간 준비 (구간당 {ticker_chunk}개 종목)...")
+    ranges = fetch_ticker_ranges(supabase, ticker_chunk)
+    print(f"  -> {len(ranges)}개 구간")
+    for idx, (lo, hi) in enumerate(ranges, start=1):
+        try:
+            df = fetch_stock_daily_range(supabase, lo, hi, end_date)
+        except Exception as e:
+            print(f"  ❌ 구간 {idx}/{len(ranges)} ({lo or 'MIN'} ~ {hi or 'MAX'}) 로드 실패: {e}")
+            continue
+        if df.empty:
+            continue
+        print(f"  -> 구간 {idx}/{len(ranges)} ({lo or 'MIN'} ~ {hi or 'MAX'}): {len(df):,}행, {df['ticker'].nunique()}개 종목")
+        yield df
 
 
 # =============================================
@@ -195,30 +204,22 @@ def process_ticker_indicators(ticker: str, df_ticker: pd.DataFrame) -> list:
         df["sma200"] = close.rolling(200).mean()
         df["slope200"] = df["sma200"].diff(5)
         
+        # AVWAP: 최근 250봉 최저가 이후 (행별 재계산 대신 선형 시간 롤링 계산)
+        avwap = rolling_anchored_avwap(
+            close.to_numpy(),
+            df["low"].astype(float).to_numpy(),
+            df["volume"].astype(float).to_numpy(),
+            window=250,
+        )
+        df["avwap_breakout"] = avwap
+        now_iso = datetime.now().isoformat()
+
         # 모든 행에 대해 daily_indicators 생성
-        for idx, row in df.iterrows():
-            date_str = row["date"].strftime("%Y-%m-%d")
-            
-            # AVWAP: 최저가 이후
-            avwap_val = None
-            try:
-                window = min(250, len(df[:df.index.get_loc(idx) + 1]))
-                df_subset = df[:df.index.get_loc(idx) + 1].tail(window)
-                low_idx = df_subset["low"].astype(float).idxmin()
-                idx_loc = df_subset.index.get_loc(low_idx)
-                avwap_val = calculate_avwap(
-                    df_subset.assign(
-                        close=df_subset["close"].astype(float),
-                        volume=df_subset["volume"].astype(float)
-                    ),
-                    idx_loc
-                )
-            except:
-                pass
-            
+        for row in df.to_dict("records"):
+            avwap_val = row.get("avwap_breakout")
             rows.append({
                 "code": ticker,
-                "trade_date": date_str,
+                "trade_date": row["date"].strftime("%Y-%m-%d"),
                 "close": normalize_numeric(row["close"]),
                 "volume": normalize_int(row.get("volume")),
                 "value_traded": normalize_numeric(row.get("value")),
@@ -229,8 +230,8 @@ def process_ticker_indicators(ticker: str, df_ticker: pd.DataFrame) -> list:
                 "rsi14": normalize_numeric(row.get("rsi14")),
                 "roc14": normalize_numeric(row.get("roc14")),
                 "roc21": normalize_numeric(row.get("roc21")),
-                "avwap_breakout": avwap_val,
-                "updated_at": datetime.now().isoformat(),
+                "avwap_breakout": None if pd.isna(avwap_val) else float(avwap_val),
+                "updated_at": now_iso,
             })
     except Exception as e:
         print(f"  ⚠️ {ticker} 계산 실패: {e}")
@@ -250,18 +251,17 @@ def dedupe_indicator_rows(rows: list) -> list:
 # =============================================
 # STEP 3: DB에 적재
 # =============================================
-def upsert_daily_indicators(all_rows: list, batch_size: int = 100, start_date: str = "", end_date: str = ""):
-    """2026-02-09 이전 데이터만 insert (기존 데이터와 충돌 방지)"""
-    print(f"\n[3/3] daily_indicators 적재 ({len(all_rows):,}행)...")
-    
-    cutoff_date = datetime.strptime("2026-02-09", "%Y-%m-%d").date()
+BACKFILL_CUTOFF_DATE = "2026-02-09"
+
 
+def filter_indicator_rows(rows: list, start_date: str = "", end_date: str = "") -> list:
+    """2026-02-09 이전 + 선택된 범위의 행만 남기고 (code, trade_date) 중복 제거"""
+    cutoff_date = datetime.strptime(BACKFILL_CUTOFF_DATE, "%Y-%m-%d").date()
     start_dt = datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else None
     end_dt = datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None
 
-    # 2026-02-09 이전 데이터 + 선택된 범위만 필터링
     filtered_rows = []
-    for r in all_rows:
+    for r in rows:
         row_dt = datetime.strptime(r["trade_date"], "%Y-%m-%d").date()
         if row_dt >= cutoff_date:
             continue
@@ -271,87 +271,183 @@ def upsert_daily_indicators(all_rows: list, batch_size: int = 100, start_date: s
             continue
         filtered_rows.append(r)
 
-    filtered_rows = dedupe_indicator_rows(filtered_rows)
-    
-    print(f"  -> 필터링 결과: {len(filtered_rows):,}행")
+    return dedupe_indicator_rows(filtered_rows)
+
+
+def upsert_indicator_batch(supabase: Client, batch: list, batch_label: str = "") -> int:
+    """단일 배치 upsert, 실패 시 행 단위 재시도. 적재된 행 수 반환"""
+    try:
+        # 작은 배치로 나눠서 충돌 최소화
+        supabase.table("daily_indicators").upsert(batch, on_conflict="code,trade_date").execute()
+        return len(batch)
+    except Exception as e:
+        print(f"  ⚠️ 배치 {batch_label} upsert 실패 ({len(batch)}행): {str(e)[:80]}")
+    # 배치 크기 더 줄여서 재시도
+    success = 0
+    for j, row in enumerate(batch):
+        try:
+            supabase.table("daily_indicators").upsert([row], on_conflict="code,trade_date").execute()
+            success += 1
+        except Exception as row_err:
+            if j == 0:  # 첫 행만 로깅
+                print(f"    ↳ 개별 insert도 실패: {str(row_err)[:60]}")
+    return success
+
+
+# =============================================
+# 스트리밍 파이프라인: 구간별 계산(직렬 또는 프로세스 풀) + 제한 큐 기반 동시 적재
+# =============================================
+def run_backfill_pipeline(
+    supabase: Client,
+    chunks,
+    workers: int = 1,
+    writers: int = 2,
+    batch_size: int = 100,
+    start_date: str = "",
+    end_date: str = "",
+) -> tuple[int, int]:
+    """종목 구간 DataFrame을 받아 지표를 계산하고 완료되는 대로 writer 스레드로 적재.
+
+    workers > 1이면 종목별 계산을 프로세스 풀로 분산한다. 계산 결과는 제한 큐를 거치므로
+    적재가 밀리면 계산 쪽이 대기하고, 메모리는 구간 크기 + 큐 크기로 제한된다.
+    Returns (계산된 행 수, 적재된 행 수).
+    """
+    print(f"\n[2/3] 지표 계산 + 적재 (workers={workers}, writers={writers})...")
     if start_date or end_date:
         print(f"  -> 범위 필터: {start_date or 'MIN'} ~ {end_date or 'MAX'}")
     else:
-        print(f"  -> 기준: 2026-02-09 이전 데이터만 대상")
-    
-    if not filtered_rows:
-        print(f"  ⚠️ 2026-02-09 이전 데이터 없음 (역계산 대상 없음)")
-        return
-    
-    total = len(filtered_rows)
-    success = 0
-    
-    for i in range(0, total, batch_size):
-        batch = filtered_rows[i:i+batch_size]
-        batch_num = i // batch_size + 1
-        total_batches = (total + batch_size - 1) // batch_size
-        
-        try:
-            # 작은 배치로 나눠서 충돌 최소화
-            supabase.table("daily_indicators").upsert(batch, on_conflict="code,trade_date").execute()
-            success += len(batch)
-            
-            if batch_num % 50 == 0 or batch_num == total_batches:
-                print(f"  -> 진행: [{batch_num}/{total_batches}] {success:,}행 적재됨")
-        except Exception as e:
-            print(f"  ⚠️ 배치 #{batch_num} upsert 실패 ({len(batch)}행): {str(e)[:80]}")
-            # 배치 크기 더 줄여서 재시도
-            for j, row in enumerate(batch):
-                try:
-                    supabase.table("daily_indicators").upsert([row], on_conflict="code,trade_date").execute()
-                    success += 1
-                except Exception as row_err:
-                    if j == 0:  # 첫 행만 로깅
-                        print(f"    ↳ 개별 insert도 실패: {str(row_err)[:60]}")
-    
-    print(f"  ✅ {success:,}행 적재 완료")
+        print(f"  -> 기준: {BACKFILL_CUTOFF_DATE} 이전 데이터만 대상")
+
+    write_queue: queue.Queue = queue.Queue(maxsize=max(2, writers * 4))
+    upserted = [0]
+    upserted_lock = threading.Lock()
+
+    def writer_loop():
+        while True:
+            batch = write_queue.get()
+            try:
+                if batch is None:
+                    return
+                ok = upsert_indicator_batch(supabase, batch)
+                with upserted_lock:
+                    upserted[0] += ok
+            finally:
+                write_queue.task_done()
+
+    writer_threads = [threading.Thread(target=writer_loop, daemon=True) for _ in range(max(1, writers))]
+    for t in writer_threads:
+        t.start()
+
+    computed = 0
+    done_tickers = 0
+    pending_rows: list = []
+
+    def collect(rows: list):
+        nonlocal computed, done_tickers, pending_rows
+        rows = filter_indicator_rows(rows, start_date, end_date)
+        computed += len(rows)
+        pending_rows.extend(rows)
+        done_tickers += 1
+        while len(pending_rows) >= batch_size:
+            write_queue.put(pending_rows[:batch_size])  # 큐가 가득 차면 계산 쪽이 대기
+            pending_rows = pending_rows[batch_size:]
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for df_chunk in chunks:
+            groups = df_chunk.groupby("ticker", sort=False)
+            if executor is None:
+                for ticker, df_ticker in groups:
+                    collect(process_ticker_indicators(ticker, df_ticker))
+            else:
+                group_iter = iter(groups)
+                in_flight = set()
+                while True:
+                    while len(in_flight) < workers * 2:
+                        nxt = next(group_iter, None)
+                        if nxt is None:
+                            break
+                        in_flight.add(executor.submit(process_ticker_indicators, *nxt))
+                    if not in_flight:
+                        break
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for fut in finished:
+                        collect(fut.result())
+            print(f"  -> 진행: {done_tickers}개 종목 ({computed:,}행 계산, {upserted[0]:,}행 적재)")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if pending_rows:
+            write_queue.put(pending_rows)
+            pending_rows = []
+        for _ in writer_threads:
+            write_queue.put(None)
+        for t in writer_threads:
+            t.join()
+
+    print(f"\n[3/3] daily_indicators 적재 결과")
+    print(f"  ✅ {upserted[0]:,}/{computed:,}행 적재 완료")
+    return computed, upserted[0]
 
 
 # =============================================
 # 메인 실행
 # =============================================
-def main():
-    args = parse_args()
+def backfill_daily_indicators(
+    supabase: Client,
+    start: str = "",
+    end: str = "",
+    workers: int = 1,
+    writers: int = 2,
+    ticker_chunk: int = 50,
+) -> dict:
+    """기존 클라이언트로 daily_indicators 백필 (daily_batch에서 in-process 호출).
+
+    Returns {"ok", "computed", "upserted"}.
+    """
     print("="*60)
     print("daily_indicators 역계산 및 적재")
     print("="*60)
-    
-    # STEP 1: stock_daily 로드
-    df_all = fetch_all_stock_daily()
-    if df_all.empty:
-        print("❌ 종료 (데이터 없음)")
-        return
-    
-    # STEP 2: 지표 계산
-    print(f"\n[2/3] 지표 계산 ({df_all['ticker'].nunique()}개 종목)...")
-    all_rows = []
-    
-    tickers = df_all["ticker"].unique()
-    for idx, ticker in enumerate(tickers):
-        df_ticker = df_all[df_all["ticker"] == ticker]
-        rows = process_ticker_indicators(ticker, df_ticker)
-        all_rows.extend(rows)
-        
-        if (idx + 1) % 100 == 0 or idx + 1 == len(tickers):
-            print(f"  -> 진행: {idx + 1}/{len(tickers)} ({len(all_rows):,}행 누적)")
-    
-    if not all_rows:
-        print("❌ 지표 계산 결과 없음")
-        return
-    
-    # STEP 3: DB 적재
-    start_date = normalize_date(args.start) if args.start else ""
-    end_date = normalize_date(args.end) if args.end else ""
-    upsert_daily_indicators(all_rows, start_date=start_date, end_date=end_date)
-    
+
+    start_date = normalize_date(start) if start else ""
+    end_date = normalize_date(end) if end else ""
+
+    computed, upserted = run_backfill_pipeline(
+        supabase,
+        iter_stock_daily_chunks(supabase, max(1, ticker_chunk), end_date),
+        workers=max(1, workers),
+        writers=max(1, writers),
+        start_date=start_date,
+        end_date=end_date,
+    )
+    if computed == 0:
+        print("⚠️ 적재 대상 지표 없음")
+
     print("\n" + "="*60)
     print("✅ 완료!")
     print("="*60)
+    return {"ok": True, "computed": computed, "upserted": upserted}
+
+
+def main():
+    args = parse_args()
+    load_env_file()
+
+    supabase_url = os.environ.get("SUPABASE_URL")
+    supabase_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+    if not supabase_url or not supabase_key:
+        print("🚨 [Error] SUPABASE_URL or SERVICE_ROLE_KEY missing", file=sys.stderr)
+        sys.exit(1)
+
+    supabase: Client = create_client(supabase_url, supabase_key)
+    backfill_daily_indicators(
+        supabase,
+        start=args.start,
+        end=args.end,
+        workers=args.workers,
+        writers=args.writers,
+        ticker_chunk=args.ticker_chunk,
+    )
 
 
 if __name__ == "__main__":
@@ -11,6 +11,7 @@ from pykrx import stock
 from supabase import create_client
 
 from _price_adjustment import adjust_ohlcv_for_splits
+from batch_modules.ohlcv_cache import invalidate_tickers
 
 
 ROOT_DIR = Path(__file__).resolve().parents[1]
@@ -115,6 +116,7 @@ def backfill_code(code: str, start_date: str, end_date: str):
         )
 
     flush_upserts("stock_daily", stock_daily_rows)
+    invalidate_tickers([code])
 
     close = adjusted["종가"].astype(float)
     adjusted = adjusted.copy()
@@ -20,6 +20,16 @@ from supabase import Client, create_client
 
 from _price_adjustment import adjust_ohlcv_for_splits
 
+sys.path.insert(0, str(Path(__file__).parent))
+from batch_modules.calendar import last_trading_day
+from batch_modules.instrument import span
+from batch_modules.ohlcv import (
+    OHLCV_SNAPSHOT_MAX_DAYS,
+    fetch_market_snapshots,
+    ohlcv_rows_from_frame,
+    snapshot_dates,
+)
+
 
 def load_env_file(filepath: str = ".env") -> None:
     p = Path(filepath)
@@ -54,14 +64,12 @@ def safe_int(value: object, default: int = 0) -> int:
         return default
 
 
-def safe_float(value: object, default: float = 0.0) -> float:
+def detect_last_trading_date() -> str:
     try:
-        return float(value)
-    except Exception:
-        return default
-
+        return last_trading_day()
+    except Exception as e:
+        print(f"[WARN] trading calendar unavailable, probing sentinel codes: {str(e)[:120]}")
 
-def detect_last_trading_date() -> str:
     today = datetime.now().date()
     test_codes = ["005930", "000660", "035420"]
 
@@ -71,7 +79,8 @@ def detect_last_trading_date() -> str:
         ok = 0
         for code in test_codes:
             try:
-                df = stock.get_market_ohlcv(d_str, d_str, code)
+                with span("pykrx.ohlcv_probe", requests=1):
+                    df = stock.get_market_ohlcv(d_str, d_str, code)
                 if not df.empty and safe_int(df.iloc[0].get("거래량", 0), 0) > 0:
                     ok += 1
             except Exception:
@@ -136,100 +145,72 @@ def flush_stock_daily(supabase: Client, rows: list[dict], batch_size: int, dry_r
     return ok
 
 
-def collect_rows_for_code(code: str, start: str, end: str) -> list[dict]:
-    rows: list[dict] = []
-
-    df = stock.get_market_ohlcv(start, end, code)
+def collect_rows_for_code(code: str, start: str, end: str, df: pd.DataFrame | None = None) -> list[dict]:
+    """Build stock_daily rows for one code; ``df`` skips the fetch (snapshot mode)."""
+    if df is None:
+        with span("pykrx.ohlcv_ticker", requests=1):
+            df = stock.get_market_ohlcv(start, end, code)
     if df is None or df.empty:
-        return rows
+        return []
 
     df, _ = adjust_ohlcv_for_splits(df)
-
-    for dt_idx, row in df.iterrows():
-        volume = safe_int(row.get("거래량", 0), 0)
-        if volume <= 0:
-            continue
-
-        close_val = safe_int(row.get("종가", 0), 0)
-        value = row.get("거래대금")
-        if pd.isna(value) or value in (None, "", 0):
-            value = volume * close_val
-
-        dt_str = dt_idx.strftime("%Y-%m-%d") if hasattr(dt_idx, "strftime") else str(dt_idx)[:10]
-        rows.append(
-            {
-                "ticker": code,
-                "date": dt_str,
-                "open": safe_int(row.get("시가", 0), 0),
-                "high": safe_int(row.get("고가", 0), 0),
-                "low": safe_int(row.get("저가", 0), 0),
-                "close": close_val,
-                "volume": volume,
-                "value": safe_float(value, 0.0),
-            }
-        )
-
-    return rows
-
-
-def parse_args() -> argparse.Namespace:
-    default_end = detect_last_trading_date()
-    default_start = (datetime.strptime(default_end, "%Y%m%d") - timedelta(days=420)).strftime("%Y%m%d")
-
-    parser = argparse.ArgumentParser(description="stock_daily historical backfill")
-    parser.add_argument("--start", default=default_start, help="start date (YYYYMMDD or YYYY-MM-DD)")
-    parser.add_argument("--end", default=default_end, help="end date (YYYYMMDD or YYYY-MM-DD)")
-    parser.add_argument(
-        "--universe",
-        default="active",
-        choices=["active", "core-extended", "all"],
-        help="target universe",
-    )
-    parser.add_argument("--codes", default="", help="comma separated codes (optional)")
-    parser.add_argument("--max-codes", type=int, default=0, help="limit number of codes")
-    parser.add_argument("--sleep", type=float, default=0.12, help="delay seconds per code")
-    parser.add_argument("--batch-size", type=int, default=500, help="upsert batch size")
-    parser.add_argument("--dry-run", action="store_true", help="collect only, do not write DB")
-    return parser.parse_args()
-
-
-def main() -> None:
-    args = parse_args()
-    load_env_file()
-
-    supabase_url = os.environ.get("SUPABASE_URL")
-    supabase_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-    if not supabase_url or not supabase_key:
-        print("[ERROR] SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY missing", file=sys.stderr)
-        sys.exit(1)
-
-    start = to_yyyymmdd(args.start)
-    end = to_yyyymmdd(args.end)
+    return ohlcv_rows_from_frame(code, df)
+
+
+def backfill_stock_daily(
+    supabase: Client,
+    start: str,
+    end: str,
+    universe: str = "active",
+    codes: Iterable[str] | None = None,
+    max_codes: int = 0,
+    sleep: float = 0.12,
+    mode: str = "auto",
+    batch_size: int = 500,
+    dry_run: bool = False,
+) -> dict:
+    """Backfill stock_daily for [start, end] with an existing client.
+
+    Returns {"ok", "targets", "success_codes", "fail_codes", "rows", "upserted"};
+    ``ok`` is False only when every code failed.
+    """
+    start = to_yyyymmdd(start)
+    end = to_yyyymmdd(end)
     if start > end:
         raise ValueError("start must be <= end")
 
-    supabase: Client = create_client(supabase_url, supabase_key)
-
-    targets = fetch_target_codes(supabase, args.universe)
+    targets = fetch_target_codes(supabase, universe)
 
-    if args.codes.strip():
-        picked = {x.strip() for x in args.codes.split(",") if x.strip()}
+    picked = {str(x).strip() for x in (codes or []) if str(x).strip()}
+    if picked:
         targets = [x for x in targets if x[0] in picked]
 
-    if args.max_codes > 0:
-        targets = targets[: args.max_codes]
+    if max_codes > 0:
+        targets = targets[:max_codes]
 
     print("=" * 64)
     print("stock_daily backfill")
     print("=" * 64)
     print(f"range: {to_iso(start)} ~ {to_iso(end)}")
-    print(f"universe: {args.universe}")
+    print(f"universe: {universe}")
     print(f"targets: {len(targets)}")
-    print(f"dry_run: {args.dry_run}")
+    print(f"dry_run: {dry_run}")
 
+    result = {"ok": True, "targets": len(targets), "success_codes": 0, "fail_codes": 0, "rows": 0, "upserted": 0}
     if not targets:
         print("no target codes")
-        return
+        return result
+
+    snapshots: dict | None = None
+    days = len(snapshot_dates(start, end))
+    if mode == "snapshot" or (mode == "auto" and days <= OHLCV_SNAPSHOT_MAX_DAYS):
+        try:
+            snapshots = fetch_market_snapshots(start, end, [code for code, _ in targets])
+            print(f"mode: snapshot ({days} day(s), {len(snapshots)} codes matched)")
+        except Exception as e:
+            print(f"  [WARN] snapshot fetch failed, using per-ticker mode: {str(e)[:120]}")
+    if snapshots is None:
+        print("mode: per-ticker")
 
     success_codes = 0
     fail_codes = 0
@@ -238,9 +219,12 @@ def main() -> None:
 
     for idx, (code, name) in enumerate(targets, start=1):
         try:
-            rows = collect_rows_for_code(code, start, end)
+            if snapshots is not None:
+                rows = collect_rows_for_code(code, start, end, snapshots.get(code, pd.DataFrame()))
+            else:
+                rows = collect_rows_for_code(code, start, end)
             if rows:
-                upserted = flush_stock_daily(supabase, rows, args.batch_size, args.dry_run)
+                upserted = flush_stock_daily(supabase, rows, batch_size, dry_run)
                 total_rows += len(rows)
                 upserted_rows += upserted
                 success_codes += 1
@@ -249,12 +233,13 @@ def main() -> None:
                     f"  -> {idx}/{len(targets)} codes | success={success_codes} fail={fail_codes} "
                     f"rows={total_rows:,} upserted={upserted_rows:,}"
                 )
-            time.sleep(max(0.0, args.sleep))
+            if snapshots is None:
+                time.sleep(max(0.0, sleep))
         except Exception as e:
             fail_codes += 1
             if fail_codes <= 10:
                 print(f"  [WARN] {code} ({name}) failed: {str(e)[:120]}")
-            time.sleep(max(0.0, args.sleep * 2))
+            time.sleep(max(0.0, sleep * 2))
 
     print("-" * 64)
     print(
@@ -262,7 +247,69 @@ def main() -> None:
         f"rows={total_rows:,} upserted={upserted_rows:,}"
     )
 
-    if success_codes == 0 and fail_codes > 0:
+    result.update(
+        ok=not (success_codes == 0 and fail_codes > 0),
+        success_codes=success_codes,
+        fail_codes=fail_codes,
+        rows=total_rows,
+        upserted=upserted_rows,
+    )
+    return result
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="stock_daily historical backfill")
+    parser.add_argument("--start", default="", help="start date (YYYYMMDD or YYYY-MM-DD, default: end - 420d)")
+    parser.add_argument("--end", default="", help="end date (YYYYMMDD or YYYY-MM-DD, default: last trading day)")
+    parser.add_argument(
+        "--universe",
+        default="active",
+        choices=["active", "core-extended", "all"],
+        help="target universe",
+    )
+    parser.add_argument("--codes", default="", help="comma separated codes (optional)")
+    parser.add_argument("--max-codes", type=int, default=0, help="limit number of codes")
+    parser.add_argument("--sleep", type=float, default=0.12, help="delay seconds per code")
+    parser.add_argument(
+        "--mode",
+        default="auto",
+        choices=["auto", "snapshot", "per-ticker"],
+        help="snapshot = one whole-market call per date; auto picks it for short ranges",
+    )
+    parser.add_argument("--batch-size", type=int, default=500, help="upsert batch size")
+    parser.add_argument("--dry-run", action="store_true", help="collect only, do not write DB")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    load_env_file()
+
+    supabase_url = os.environ.get("SUPABASE_URL")
+    supabase_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+    if not supabase_url or not supabase_key:
+        print("[ERROR] SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY missing", file=sys.stderr)
+        sys.exit(1)
+
+    # the calendar lookup only runs when the CLI actually needs a default range
+    end = args.end or detect_last_trading_date()
+    start = args.start or (datetime.strptime(to_yyyymmdd(end), "%Y%m%d") - timedelta(days=420)).strftime("%Y%m%d")
+
+    supabase: Client = create_client(supabase_url, supabase_key)
+    result = backfill_stock_daily(
+        supabase,
+        start,
+        end,
+        universe=args.universe,
+        codes=args.codes.split(","),
+        max_codes=args.max_codes,
+        sleep=args.sleep,
+        mode=args.mode,
+        batch_size=args.batch_size,
+        dry_run=args.dry_run,
+    )
+
+    if not result["ok"]:
         print("[ERROR] all codes failed — treating as fatal so caller does not mistake this for a completed backfill", file=sys.stderr)
         sys.exit(1)
 
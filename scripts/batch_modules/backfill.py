@@ -8,7 +8,10 @@ import os
 from datetime import datetime, timedelta, date
 from typing import Optional
 from supabase import Client
-from .utils import safe_int, run_python_script
+from .utils import safe_int, to_iso
+from .ohlcv_cache import invalidate_range
+from .calendar import trading_days_between
+from .instrument import span, traced
 
 
 DEFAULT_SENTINEL_TICKERS = ["005930", "000660", "035420"]
@@ -41,16 +44,11 @@ def get_trading_dates_between(start_dt: date, end_dt: date) -> list[str]:
     if start_dt > end_dt:
         return []
 
-    start = start_dt.strftime("%Y%m%d")
-    end = end_dt.strftime("%Y%m%d")
-
-    # Fast path: single index call for trading calendar.
+    # Fast path: cached KRX calendar (no network call when already current).
     try:
-        from pykrx import stock as pykrx_stock
-
-        df = pykrx_stock.get_index_ohlcv(start, end, "1001")
-        if df is not None and not df.empty:
-            return [idx.strftime("%Y%m%d") for idx in df.index]
+        days = trading_days_between(start_dt, end_dt)
+        if days:
+            return days
     except Exception:
         pass
 
@@ -63,7 +61,8 @@ def get_trading_dates_between(start_dt: date, end_dt: date) -> list[str]:
         while cur <= end_dt:
             yyyymmdd = cur.strftime("%Y%m%d")
             try:
-                df = pykrx_stock.get_market_ohlcv(yyyymmdd, yyyymmdd, "005930")
+                with span("pykrx.ohlcv_probe", requests=1):
+                    df = pykrx_stock.get_market_ohlcv(yyyymmdd, yyyymmdd, "005930")
                 if df is not None and not df.empty:
                     out.append(yyyymmdd)
             except Exception:
@@ -137,6 +136,39 @@ def group_consecutive_dates(dates_yyyymmdd: list[str]) -> list[tuple[str, str]]:
     return out
 
 
+@traced()
+def backfill_range_in_process(supabase: Client, start_date: str, end_date: str, label: str) -> bool:
+    """stock_daily + daily_indicators backfill for one range, reusing the batch's client.
+
+    Same steps as backfill_stock_daily_universe.py / backfill_daily_indicators.py,
+    called in-process instead of re-launching an interpreter per script.
+    """
+    # top-level scripts (scripts/ is on sys.path when run from daily_batch)
+    from backfill_stock_daily_universe import backfill_stock_daily
+    from backfill_daily_indicators import backfill_daily_indicators
+
+    print(f"  -> stock_daily {label} backfill: {start_date} ~ {end_date}")
+    try:
+        stock_status = backfill_stock_daily(
+            supabase, start_date, end_date, universe="core-extended", sleep=0.08
+        )
+    except Exception as e:
+        print(f"   stock_daily {label} backfill execution error: {e}")
+        return False
+    if not stock_status.get("ok"):
+        print(f"   stock_daily {label} backfill failed")
+        return False
+
+    print(f"  -> daily_indicators {label} backfill: {start_date} ~ {end_date}")
+    try:
+        backfill_daily_indicators(supabase, start_date, end_date)
+    except Exception as e:
+        print(f"   daily_indicators {label} backfill execution error: {e}")
+        return False
+    return True
+
+
+@traced()
 def auto_backfill_missing_dates(supabase: Client, trading_date: str) -> bool:
     """Auto-backfill forward/history gaps for stock_daily and indicators."""
     latest_date = get_latest_stock_daily_date(supabase)
@@ -157,20 +189,7 @@ def auto_backfill_missing_dates(supabase: Client, trading_date: str) -> bool:
         )
         print(f"   Forward backfill range: {start_date} ~ {trading_date}")
 
-        ok_stock = run_python_script(
-            "scripts/backfill_stock_daily_universe.py",
-            ["--start", start_date, "--end", trading_date, "--universe", "core-extended", "--sleep", "0.08"],
-            "stock_daily backfill",
-        )
-        if not ok_stock:
-            return False
-
-        ok_indicators = run_python_script(
-            "scripts/backfill_daily_indicators.py",
-            ["--start", start_date, "--end", trading_date],
-            "daily_indicators backfill",
-        )
-        if not ok_indicators:
+        if not backfill_range_in_process(supabase, start_date, trading_date, "forward"):
             return False
 
         backfilled = True
@@ -202,22 +221,10 @@ def auto_backfill_missing_dates(supabase: Client, trading_date: str) -> bool:
             for start_date, end_date in group_consecutive_dates(missing_days):
                 print(f"   Internal backfill range: {start_date} ~ {end_date}")
 
-                ok_stock_gap = run_python_script(
-                    "scripts/backfill_stock_daily_universe.py",
-                    ["--start", start_date, "--end", end_date, "--universe", "core-extended", "--sleep", "0.08"],
-                    "stock_daily internal-gap backfill",
-                )
-                if not ok_stock_gap:
-                    return backfilled
-
-                ok_indicators_gap = run_python_script(
-                    "scripts/backfill_daily_indicators.py",
-                    ["--start", start_date, "--end", end_date],
-                    "daily_indicators internal-gap backfill",
-                )
-                if not ok_indicators_gap:
+                if not backfill_range_in_process(supabase, start_date, end_date, "internal-gap"):
                     return backfilled
 
+                invalidate_range(to_iso(start_date), to_iso(end_date))
                 backfilled = True
         else:
             print(f"   Internal gap check OK: no missing trading dates in last {gap_window_days}d")
@@ -244,22 +251,10 @@ def auto_backfill_missing_dates(supabase: Client, trading_date: str) -> bool:
         )
         print(f"   Historical backfill range: {hist_start} ~ {hist_end}")
 
-        ok_stock_hist = run_python_script(
-            "scripts/backfill_stock_daily_universe.py",
-            ["--start", hist_start, "--end", hist_end, "--universe", "core-extended", "--sleep", "0.08"],
-            "stock_daily historical backfill",
-        )
-        if not ok_stock_hist:
-            return backfilled
-
-        ok_indicators_hist = run_python_script(
-            "scripts/backfill_daily_indicators.py",
-            ["--start", hist_start, "--end", hist_end],
-            "daily_indicators historical backfill",
-        )
-        if not ok_indicators_hist:
+        if not backfill_range_in_process(supabase, hist_start, hist_end, "historical"):
             return backfilled
 
+        invalidate_range(to_iso(hist_start), to_iso(hist_end))
         backfilled = True
     else:
         print(
@@ -0,0 +1,194 @@
+"""
+batch_modules/calendar.py
+========================
+KRX trading calendar shared by the batch and backfill scripts
+- built from one KOSPI index OHLCV call (every session has an index bar)
+- persisted to .cache/calendar and extended incrementally on later runs
+- last_trading_day / trading_days_between / shift_business_days answer by
+  bisect over the sorted session list instead of probing pykrx per day
+"""
+
+import bisect
+import json
+import os
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+
+CALENDAR_INDEX_TICKER = "1001"  # KOSPI composite
+CALENDAR_START = "20180101"
+CALENDAR_FILE = "krx_trading_days.json"
+
+_calendar: Optional["TradingCalendar"] = None
+_checked_on: Optional[str] = None
+
+
+def _ymd(value) -> str:
+    """Normalize date / datetime / 'YYYY-MM-DD' / 'YYYYMMDD' to YYYYMMDD."""
+    if isinstance(value, (date, datetime)):
+        return value.strftime("%Y%m%d")
+    return str(value).strip().replace("-", "")[:8]
+
+
+def _kst_today() -> str:
+    return datetime.now(ZoneInfo("Asia/Seoul")).strftime("%Y%m%d")
+
+
+def _shift_weekdays(day: str, n: int) -> str:
+    dt = datetime.strptime(day, "%Y%m%d").date()
+    step = 1 if n > 0 else -1
+    remaining = abs(n)
+    while remaining:
+        dt += timedelta(days=step)
+        if dt.weekday() < 5:
+            remaining -= 1
+    return dt.strftime("%Y%m%d")
+
+
+def _next_day(day: str) -> str:
+    return (datetime.strptime(day, "%Y%m%d").date() + timedelta(days=1)).strftime("%Y%m%d")
+
+
+def calendar_path() -> Path:
+    default = Path(__file__).resolve().parents[2] / ".cache" / "calendar"
+    return Path(os.environ.get("TRADING_CALENDAR_DIR") or default) / CALENDAR_FILE
+
+
+class TradingCalendar:
+    """Sorted KRX session dates (YYYYMMDD), authoritative through ``covered_through``.
+
+    Shifting past the known range falls back to weekday counting since
+    future holidays are not known yet.
+    """
+
+    def __init__(self, dates: list, covered_through: str):
+        self.dates = sorted(set(dates))
+        self.covered_through = covered_through
+
+    def last_trading_day(self, on=None) -> Optional[str]:
+        """Latest session on or before ``on`` (default: today KST)."""
+        on = _ymd(on or _kst_today())
+        i = bisect.bisect_right(self.dates, on)
+        return self.dates[i - 1] if i else None
+
+    def trading_days_between(self, start, end) -> list:
+        """Known sessions in [start, end], inclusive."""
+        start, end = _ymd(start), _ymd(end)
+        if start > end:
+            return []
+        lo = bisect.bisect_left(self.dates, start)
+        hi = bisect.bisect_right(self.dates, end)
+        return self.dates[lo:hi]
+
+    def shift_business_days(self, day, n: int) -> str:
+        """Session ``n`` sessions after (n > 0) or before (n < 0) ``day``.
+
+        ``day`` itself need not be a session.
+        """
+        day = _ymd(day)
+        if n == 0:
+            return day
+        if not self.dates or day < self.dates[0]:
+            return _shift_weekdays(day, n)
+        if n < 0:
+            i = bisect.bisect_left(self.dates, day) + n
+            return self.dates[i] if i >= 0 else _shift_weekdays(self.dates[0], i)
+
+        first_after = bisect.bisect_right(self.dates, day)
+        known_after = max(0, bisect.bisect_right(self.dates, self.covered_through) - first_after)
+        if n <= known_after:
+            return self.dates[first_after + n - 1]
+        return _shift_weekdays(max(day, self.covered_through), n - known_after)
+
+
+def _fetch_sessions(start: str, end: str) -> list:
+    from pykrx import stock
+
+    from .instrument import span
+
+    with span("pykrx.index_ohlcv", requests=1):
+        df = stock.get_index_ohlcv(start, end, CALENDAR_INDEX_TICKER)
+    if df is None or df.empty:
+        return []
+    return [idx.strftime("%Y%m%d") for idx in df.index]
+
+
+def _load_from_disk() -> Optional[TradingCalendar]:
+    try:
+        with calendar_path().open("r", encoding="utf-8") as f:
+            payload = json.load(f)
+        return TradingCalendar(payload["dates"], payload["covered_through"])
+    except Exception:
+        return None
+
+
+def _save_to_disk(cal: TradingCalendar):
+    path = calendar_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump({
+            "dates": cal.dates,
+            "covered_through": cal.covered_through,
+            "written_at": datetime.now().isoformat(),
+        }, f)
+    os.replace(tmp, path)
+
+
+def get_calendar(refresh: bool = True) -> TradingCalendar:
+    """Process-wide calendar: disk cache extended with one index call per day.
+
+    Today is never marked as covered, so a session whose index bar did not
+    exist yet (run before the open) is picked up by the next refresh.
+    """
+    global _calendar, _checked_on
+    today = _kst_today()
+    if _calendar is not None and (_checked_on == today or not refresh):
+        return _calendar
+
+    cal = _calendar or _load_from_disk()
+    if cal is not None and not refresh:
+        _calendar = cal
+        return cal
+
+    fetch_from = CALENDAR_START
+    known: list = []
+    if cal is not None:
+        fetch_from = _next_day(cal.covered_through)
+        known = [d for d in cal.dates if d <= cal.covered_through]
+
+    try:
+        fresh = _fetch_sessions(fetch_from, today) if fetch_from <= today else []
+    except Exception as e:
+        if cal is None:
+            raise
+        print(f"   trading calendar refresh failed, using cached calendar: {e}")
+        _calendar = cal
+        return cal
+
+    yesterday = (datetime.strptime(today, "%Y%m%d").date() - timedelta(days=1)).strftime("%Y%m%d")
+    cal = TradingCalendar(known + fresh, max(yesterday, cal.covered_through if cal else yesterday))
+    _save_to_disk(cal)
+    _calendar = cal
+    _checked_on = today
+    return cal
+
+
+def last_trading_day(on=None) -> str:
+    """Most recent KRX session on or before ``on`` (YYYYMMDD)."""
+    day = get_calendar().last_trading_day(on)
+    if day is None:
+        raise ValueError(f"no trading day on or before {on or _kst_today()}")
+    return day
+
+
+def trading_days_between(start, end) -> list:
+    """KRX sessions in [start, end] as YYYYMMDD strings."""
+    return get_calendar().trading_days_between(start, end)
+
+
+def shift_business_days(day, n: int) -> str:
+    """Move ``n`` KRX sessions from ``day`` (negative = back in time)."""
+    return get_calendar().shift_business_days(day, n)
@@ -0,0 +1,99 @@
+"""
+batch_modules/checkpoint.py
+==========================
+Durable per-stage checkpoints for daily_batch.py --resume
+- one JSON file next to logs/daily_batch_status.json, rewritten atomically
+  after every successful stage
+- each entry: trading_date, stage, input watermark, output row count, run_id
+- a stage's watermark hashes the trading date, the run config and the
+  checkpoints of its upstream stages, so re-running an upstream stage
+  invalidates everything below it
+"""
+
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+
+class StageCheckpoints:
+    """Checkpoint store for one trading date.
+
+    Without ``resume`` the file is reset for the new run (checkpoints are
+    still written, so a later ``--resume`` can pick them up).
+    """
+
+    def __init__(self, path: Path, trading_date: str, run_id: str, config: dict, resume: bool = False):
+        self.path = Path(path)
+        self.trading_date = trading_date
+        self.run_id = run_id
+        self.config = config
+        self.resume = resume
+        self._lock = threading.Lock()
+        self.entries: dict[str, dict] = {}
+        if resume:
+            self.entries = self._load()
+        else:
+            self._save()
+
+    def _load(self) -> dict:
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        if data.get("trading_date") != self.trading_date:
+            print(f"   [resume] checkpoint is for {data.get('trading_date')}, not {self.trading_date}; starting fresh")
+            return {}
+        return data.get("stages") or {}
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump({"trading_date": self.trading_date, "stages": self.entries}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+    def watermark(self, stage) -> str:
+        """Input fingerprint of a stage whose dependencies have all finished."""
+        upstream = {}
+        for dep in sorted(set(stage.deps) | set(stage.requires)):
+            entry = self.entries.get(dep) or {}
+            upstream[dep] = [entry.get("watermark"), entry.get("run_id"), entry.get("rows")]
+        payload = json.dumps(
+            {"trading_date": self.trading_date, "stage": stage.name, "config": self.config, "upstream": upstream},
+            sort_keys=True, default=str,
+        )
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+    def lookup(self, stage, watermark: str) -> Optional[dict]:
+        """Checkpoint entry to resume from, or None when the stage must run."""
+        if not self.resume:
+            return None
+        entry = self.entries.get(stage.name)
+        if entry and entry.get("watermark") == watermark:
+            return entry
+        return None
+
+    def record(self, stage, watermark: str, result: dict, elapsed: float):
+        with self._lock:
+            self.entries[stage.name] = {
+                "trading_date": self.trading_date,
+                "stage": stage.name,
+                "watermark": watermark,
+                "rows": result.get("rows"),
+                "run_id": self.run_id,
+                "elapsed_seconds": round(float(elapsed), 3),
+                "finished_at": datetime.now().isoformat(),
+                "detail": result.get("detail") or {},
+            }
+            self._save()
+
+    def discard(self, name: str):
+        """Drop a stage that re-ran and failed, so downstream cannot match it."""
+        with self._lock:
+            if self.entries.pop(name, None) is not None:
+                self._save()
@@ -8,8 +8,10 @@ import os
 from datetime import date, timedelta
 from supabase import Client
 from .utils import safe_int
+from .instrument import traced
 
 
+@traced()
 def cleanup_old_data(supabase: Client):
     """Cleanup old rows according to retention policy."""
     print(f"\n[7/7] Cleaning up old data...")
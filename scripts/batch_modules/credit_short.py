@@ -4,33 +4,15 @@ batch_modules/credit_short.py
 STEP 2.6: ???/?? ??? ??
 """
 
-import time
 import os
-import requests
 from datetime import datetime, timedelta
 from supabase import Client
-from .utils import to_iso
-
-
-def post_json_with_retry(sess: requests.Session, url: str, data: dict, timeout: int = 10, retries: int = 3) -> tuple[dict | None, bool]:
-    """POST JSON with small retry/backoff. Returns (json, ok)."""
-    for attempt in range(1, retries + 1):
-        try:
-            r = sess.post(url, data=data, timeout=timeout)
-            r.raise_for_status()
-            return r.json(), True
-        except Exception:
-            if attempt >= retries:
-                break
-            time.sleep(0.2 * attempt)
-    return None, False
-
-
-def build_isin_fallback(code6: str) -> str:
-    """Fallback ISIN pattern used by KRX endpoints for stock code lookup."""
-    return f"KR7{str(code6).zfill(6)}0003"
+from .utils import to_iso, bulk_patch
+from .krx import get_krx_client
+from .instrument import traced
 
 
+@traced()
 def fetch_credit_short_data(supabase: Client, trading_date: str):
     """Collect credit/short-selling data from KRX MDC_OUT APIs."""
     trading_iso = to_iso(trading_date)
@@ -54,35 +36,9 @@ def fetch_credit_short_data(supabase: Client, trading_date: str):
             return
         print(f"  universe size: {len(codes)} tickers")
 
-        krx_ua = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-        krx_headers = {
-            "User-Agent": krx_ua,
-            "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
-            "X-Requested-With": "XMLHttpRequest",
-            "Referer": "https://data.krx.co.kr/",
-        }
-        krx_api = "https://data.krx.co.kr/comm/bldAttendant/getJsonData.cmd"
-        sess = requests.Session()
-        sess.headers.update(krx_headers)
-        try:
-            sess.get("https://data.krx.co.kr/", timeout=10)
-        except Exception:
-            pass
-
-        # Build ISIN map
-        isin_map = {}
-        try:
-            payload, ok = post_json_with_retry(
-                sess,
-                krx_api,
-                {"bld": "dbms/comm/finder/finder_stkisu", "mktsel": "ALL", "typeNo": "0", "pagePath": "/contents/MDC/STAT/srt/MDCSTAT300.cmd", "codeNm": ""},
-                timeout=30,
-                retries=3,
-            )
-            block = (payload or {}).get("block1", []) if ok else []
-            isin_map = {item["short_code"]: item["full_code"] for item in block}
-        except Exception as e:
-            print(f"  ISIN mapping failed: {e}")
+        client = get_krx_client()
+        isin_map = client.isin_map()
+        print(f"  ISIN map: {len(isin_map)} codes")
 
         cs_rows = []
         success_count = 0
@@ -93,63 +49,34 @@ def fetch_credit_short_data(supabase: Client, trading_date: str):
         start_d = (datetime.strptime(trading_date, "%Y%m%d") - timedelta(days=7)).strftime("%Y%m%d")
         end_d = trading_date
 
-        for idx, code in enumerate(codes):
-            if idx % 50 == 0 and idx > 0:
-                print(f"  progress: {idx}/{len(codes)} (success: {success_count}, fail: {fail_count})")
+        # Both per-code queries for all codes share the client's pool and rate limiter
+        fetched = client.fetch_short_many(codes, start_d, end_d, retries=request_retries)
 
-            isin = isin_map.get(code)
-            if not isin:
+        for code in codes:
+            res_code = fetched[code]
+            if not res_code["isin_from_map"]:
                 # Some valid listed tickers are occasionally absent from finder_stkisu.
-                # Try deterministic fallback ISIN before counting as failure.
+                # The deterministic fallback ISIN was tried before counting as failure.
                 fail_reasons["fallback_isin"] += 1
-                isin = build_isin_fallback(code)
 
             short_volume = None
             short_ratio = None
             short_balance = None
-            vol_query_ok = False
-            bal_query_ok = False
+            vol_query_ok = bool(res_code.get("trade_ok"))
+            bal_query_ok = bool(res_code.get("balance_ok"))
 
             # Short-selling volume only. short_ratio column is reserved for balance ratio.
-            payload, ok = post_json_with_retry(
-                sess,
-                krx_api,
-                {"bld": "dbms/MDC_OUT/STAT/srt/MDCSTAT30102_OUT", "isuCd": isin, "strtDd": start_d, "endDd": end_d, "money": "1", "csvxls_isNo": "false"},
-                timeout=10,
-                retries=request_retries,
-            )
-            if ok:
-                vol_query_ok = True
-                matched = False
-                for row in (payload or {}).get("OutBlock_1", []):
-                    date_str = row.get("TRD_DD", "").replace("/", "")
-                    if date_str == trading_date:
-                        short_volume = int(str(row.get("CVSRTSELL_TRDVOL", "0")).replace(",", "") or "0")
-                        matched = True
-                        break
-                if not matched:
-                    # 정상 응답이지만 해당일 데이터가 없으면 0으로 저장
-                    short_volume = 0
+            if vol_query_ok:
+                # 정상 응답이지만 해당일 데이터가 없으면 0으로 저장
+                short_volume = (res_code["trade"].get(trading_date) or {}).get("short_volume", 0)
 
             # Short balance and balance ratio
-            payload, ok = post_json_with_retry(
-                sess,
-                krx_api,
-                {"bld": "dbms/MDC_OUT/STAT/srt/MDCSTAT30502_OUT", "isuCd": isin, "strtDd": start_d, "endDd": end_d, "money": "1", "csvxls_isNo": "false"},
-                timeout=10,
-                retries=request_retries,
-            )
-            if ok:
-                bal_query_ok = True
-                matched = False
-                for row in (payload or {}).get("OutBlock_1", []):
-                    date_str = row.get("RPT_DUTY_OCCR_DD", "").replace("/", "")
-                    if date_str == trading_date:
-                        short_balance = int(str(row.get("BAL_QTY", "0")).replace(",", "") or "0")
-                        short_ratio = float(str(row.get("BAL_RT") or row.get("STCK_BAL_RT") or row.get("SLVL_RT") or "0").replace(",", "") or "0")
-                        matched = True
-                        break
-                if not matched:
+            if bal_query_ok:
+                balance = res_code["balance"].get(trading_date)
+                if balance:
+                    short_balance = balance["short_balance"]
+                    short_ratio = balance["short_ratio"]
+                else:
                     short_balance = 0
                     short_ratio = 0.0
 
@@ -172,7 +99,7 @@ def fetch_credit_short_data(supabase: Client, trading_date: str):
                 if len(sample_failed_codes) < 10:
                     sample_failed_codes.append(code)
 
-            time.sleep(0.05)
+        print(f"  KRX client: {client.status()}")
 
         if cs_rows:
             for i in range(0, len(cs_rows), 500):
@@ -188,17 +115,11 @@ def fetch_credit_short_data(supabase: Client, trading_date: str):
                             pass
 
             # Sync latest short fields into stocks table
-            for r in cs_rows:
-                try:
-                    upd = {}
-                    if r.get("short_ratio") is not None:
-                        upd["short_ratio"] = r["short_ratio"]
-                    if r.get("short_balance") is not None:
-                        upd["short_balance"] = r["short_balance"]
-                    if upd:
-                        supabase.table("stocks").update(upd).eq("code", r["code"]).execute()
-                except Exception:
-                    pass
+            stock_patches = [
+                {"code": r["code"], **{k: r[k] for k in ("short_ratio", "short_balance") if r.get(k) is not None}}
+                for r in cs_rows
+            ]
+            bulk_patch(supabase, "stocks", "code", stock_patches)
 
             print(f"  Stored {len(cs_rows)} credit/short rows (success: {success_count}, fail: {fail_count})")
             if fail_count > 0:
@@ -0,0 +1,278 @@
+"""
+batch_modules/history.py
+=======================
+Performance analytics over logs/daily_batch_history.ndjson
+- per-stage p50/p95 durations and week-over-week regressions
+- correlation of stage time with universe size and upstream failure counts
+  (KIS failures plus instrumented errors/retries/blocked responses)
+- stages trending toward the 600s batch target printed at the end of main
+- format_summary() renders a compact text for send_telegram_alert
+"""
+
+import json
+import statistics
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+
+TARGET_SECONDS = 600.0
+REGRESSION_PCT = 20.0       # week-over-week p50 increase that counts as a regression
+REGRESSION_MIN_SECONDS = 5.0
+TREND_HORIZON_WEEKS = 4.0   # how far the linear trend is extrapolated
+TREND_WARN_RATIO = 0.8      # flag when the projection reaches 80% of the target
+MIN_RUNS = 3
+
+_FAILURE_COUNTERS = ("errors", "retries", "blocked")
+
+
+def load_history(path: Path, days: int = 28, now: Optional[datetime] = None) -> list[dict]:
+    """Finished runs from the last ``days`` days, oldest first; bad lines are skipped."""
+    path = Path(path)
+    if not path.exists():
+        return []
+    cutoff = (now or datetime.now()) - timedelta(days=days) if days > 0 else None
+    runs = []
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                run = json.loads(line)
+                finished = datetime.fromisoformat(run["finished_at"])
+            except (ValueError, KeyError, TypeError):
+                continue
+            if run.get("status") not in ("success", "failed"):
+                continue
+            if cutoff is not None and finished < cutoff:
+                continue
+            run["_finished"] = finished
+            runs.append(run)
+    runs.sort(key=lambda r: r["_finished"])
+    return runs
+
+
+def percentile(values: list[float], q: float) -> Optional[float]:
+    """Linear-interpolated percentile (q in 0..100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def _round(value: Optional[float], digits: int = 1) -> Optional[float]:
+    return round(value, digits) if value is not None else None
+
+
+def universe_size(run: dict) -> Optional[int]:
+    """Codes the run worked on, from the investor stage (the whole active universe)."""
+    detail = (run.get("stages") or {}).get("InvestorData", {}).get("detail") or {}
+    if detail.get("target_count"):
+        return int(detail["target_count"])
+    total = int(detail.get("success_count") or 0) + int(detail.get("fail_count") or 0)
+    return total or None
+
+
+def failure_counts(run: dict) -> dict[str, int]:
+    """Upstream failures per stage: instrumented errors/retries/blocked, KIS fails."""
+    out: dict[str, int] = {}
+    for stage, spans in ((run.get("instrumentation") or {}).get("stages") or {}).items():
+        out[stage] = sum(int(agg.get(k) or 0) for agg in spans.values() for k in _FAILURE_COUNTERS)
+    investor = (run.get("stages") or {}).get("InvestorData", {}).get("detail") or {}
+    kis_fail = int(investor.get("fail_count") or 0)
+    if kis_fail:
+        out["InvestorData"] = out.get("InvestorData", 0) + kis_fail
+    return out
+
+
+def stage_samples(run: dict) -> dict[str, float]:
+    """Durations of stages that actually ran (skipped and resumed stages excluded)."""
+    out = {}
+    for name, entry in (run.get("stages") or {}).items():
+        detail = entry.get("detail") or {}
+        if detail.get("reason") in ("dependency_failed", "dependency_timed_out") or "resumed_from" in detail:
+            continue
+        out[name] = float(entry.get("elapsed_seconds") or 0.0)
+    return out
+
+
+def total_seconds(run: dict) -> Optional[float]:
+    """Batch wall time, only for complete runs (resumed or aborted runs are not comparable)."""
+    summary = run.get("summary") or {}
+    if run.get("status") != "success" or summary.get("resumed_stages"):
+        return None
+    value = summary.get("total_time_seconds", run.get("duration_seconds"))
+    return float(value) if value is not None else None
+
+
+def _correlation(xs: list, ys: list) -> Optional[float]:
+    pairs = [(x, y) for x, y in zip(xs, ys) if x is not None and y is not None]
+    if len(pairs) < MIN_RUNS:
+        return None
+    try:
+        return round(statistics.correlation([p[0] for p in pairs], [p[1] for p in pairs]), 2)
+    except statistics.StatisticsError:   # constant input
+        return None
+
+
+def _slope_per_week(points: list[tuple[datetime, float]]) -> Optional[float]:
+    if len(points) < MIN_RUNS:
+        return None
+    t0 = points[0][0]
+    days = [(t - t0).total_seconds() / 86400.0 for t, _ in points]
+    try:
+        return statistics.linear_regression(days, [v for _, v in points]).slope * 7.0
+    except statistics.StatisticsError:
+        return None
+
+
+def _week_over_week(points: list[tuple[datetime, float]], end: datetime) -> dict:
+    this_week = [v for t, v in points if t > end - timedelta(days=7)]
+    prev_week = [v for t, v in points if end - timedelta(days=14) < t <= end - timedelta(days=7)]
+    out = {"this_week_p50": None, "prev_week_p50": None, "change_pct": None, "regression": False}
+    if len(this_week) < 2 or len(prev_week) < 2:
+        return out
+    cur, prev = statistics.median(this_week), statistics.median(prev_week)
+    out["this_week_p50"], out["prev_week_p50"] = round(cur, 1), round(prev, 1)
+    if prev > 0:
+        out["change_pct"] = round((cur - prev) / prev * 100.0, 1)
+        out["regression"] = out["change_pct"] >= REGRESSION_PCT and cur - prev >= REGRESSION_MIN_SECONDS
+    return out
+
+
+def analyze(runs: list[dict], target_seconds: float = TARGET_SECONDS) -> dict:
+    """Aggregate a run list (as returned by load_history) into a report dict."""
+    report = {
+        "runs": len(runs),
+        "from": runs[0]["finished_at"][:10] if runs else None,
+        "to": runs[-1]["finished_at"][:10] if runs else None,
+        "target_seconds": target_seconds,
+        "failed_runs": sum(1 for r in runs if r.get("status") != "success"),
+        "total": {},
+        "stages": {},
+        "regressions": [],
+        "trending": [],
+    }
+    if not runs:
+        return report
+    end = runs[-1]["_finished"]
+
+    totals = [(r["_finished"], t) for r in runs if (t := total_seconds(r)) is not None]
+    total_values = [v for _, v in totals]
+    recent_total = [v for t, v in totals if t > end - timedelta(days=7)] or total_values
+    total_slope = _slope_per_week(totals)
+    total_p95_recent = percentile(recent_total, 95)
+    total = {
+        "n": len(totals),
+        "p50": _round(percentile(total_values, 50)),
+        "p95": _round(percentile(total_values, 95)),
+        "recent_p95": _round(total_p95_recent),
+        "last": _round(total_values[-1]) if total_values else None,
+        "over_target": sum(1 for v in total_values if v > target_seconds),
+        "slope_per_week": _round(total_slope),
+        "weeks_to_target": None,
+        **_week_over_week(totals, end),
+    }
+    if total_slope and total_slope > 0 and total_p95_recent is not None and total_p95_recent < target_seconds:
+        total["weeks_to_target"] = round((target_seconds - total_p95_recent) / total_slope, 1)
+    report["total"] = total
+
+    sizes = [universe_size(r) for r in runs]
+    failures = [failure_counts(r) for r in runs]
+    samples = [stage_samples(r) for r in runs]
+    names = sorted({name for s in samples for name in s})
+    for name in names:
+        idx = [i for i, s in enumerate(samples) if name in s]
+        points = [(runs[i]["_finished"], samples[i][name]) for i in idx]
+        values = [v for _, v in points]
+        recent = [v for t, v in points if t > end - timedelta(days=7)] or values
+        slope = _slope_per_week(points)
+        p50 = percentile(values, 50)
+        entry = {
+            "n": len(values),
+            "p50": _round(p50),
+            "p95": _round(percentile(values, 95)),
+            "recent_p95": _round(percentile(recent, 95)),
+            "last": _round(values[-1]),
+            "slope_per_week": _round(slope),
+            "corr_universe": _correlation([sizes[i] for i in idx], values),
+            "corr_failures": _correlation([failures[i].get(name, 0) for i in idx], values),
+            "failures_p50": _round(percentile([failures[i].get(name, 0) for i in idx], 50)),
+            **_week_over_week(points, end),
+        }
+        # A stage trends toward the target when its growth, carried over the
+        # horizon on top of today's batch p95, reaches the warning band.
+        entry["trending"] = bool(
+            slope is not None
+            and slope >= max(1.0, 0.05 * (p50 or 0.0))
+            and total_p95_recent is not None
+            and total_p95_recent + slope * TREND_HORIZON_WEEKS >= target_seconds * TREND_WARN_RATIO
+        )
+        report["stages"][name] = entry
+        if entry["regression"]:
+            report["regressions"].append(name)
+        if entry["trending"]:
+            report["trending"].append(name)
+
+    report["regressions"].sort(key=lambda n: report["stages"][n]["change_pct"] or 0, reverse=True)
+    report["trending"].sort(key=lambda n: report["stages"][n]["slope_per_week"] or 0, reverse=True)
+    return report
+
+
+def has_alerts(report: dict) -> bool:
+    total = report.get("total") or {}
+    return bool(
+        report.get("regressions")
+        or report.get("trending")
+        or total.get("regression")
+        or (total.get("recent_p95") or 0) > report.get("target_seconds", TARGET_SECONDS)
+    )
+
+
+def format_summary(report: dict, top: int = 3) -> str:
+    """Compact multi-line text for Telegram (well under the 4096-char limit)."""
+    if not report.get("runs"):
+        return "📊 [배치 성능] 분석할 실행 기록 없음"
+    target = report["target_seconds"]
+    total = report["total"]
+    lines = [
+        f"📊 [배치 성능] {report['from']} ~ {report['to']} ({report['runs']}회, 실패 {report['failed_runs']})",
+    ]
+    if total.get("n"):
+        lines.append(
+            f"총 소요: p50 {total['p50']:.0f}s / p95 {total['p95']:.0f}s / 최근 {total['last']:.0f}s "
+            f"(목표 {target:.0f}s, 초과 {total['over_target']}회)"
+        )
+        if total.get("change_pct") is not None:
+            lines.append(f"주간 변화: {total['prev_week_p50']:.0f}s → {total['this_week_p50']:.0f}s ({total['change_pct']:+.0f}%)")
+        if total.get("weeks_to_target") is not None:
+            lines.append(f"추세: {total['slope_per_week']:+.1f}s/주 → 약 {total['weeks_to_target']:.1f}주 후 목표 초과")
+
+    stages = report["stages"]
+    if report["regressions"]:
+        items = [
+            f"{n} {stages[n]['prev_week_p50']:.0f}→{stages[n]['this_week_p50']:.0f}s ({stages[n]['change_pct']:+.0f}%)"
+            for n in report["regressions"][:top]
+        ]
+        lines.append("⚠️ 주간 회귀: " + ", ".join(items))
+    if report["trending"]:
+        items = []
+        for n in report["trending"][:top]:
+            s = stages[n]
+            corr = " ".join(
+                f"{label} r={s[key]:+.2f}" for label, key in (("종목수", "corr_universe"), ("실패", "corr_failures"))
+                if s[key] is not None and abs(s[key]) >= 0.5
+            )
+            items.append(f"{n} {s['slope_per_week']:+.1f}s/주" + (f" ({corr})" if corr else ""))
+        lines.append("⚠️ 목표 근접 추세: " + ", ".join(items))
+    if not has_alerts(report):
+        lines.append("✅ 회귀/추세 경고 없음")
+
+    slowest = sorted(stages, key=lambda n: stages[n]["p95"] or 0, reverse=True)[:top]
+    if slowest:
+        lines.append("상위 단계 p95: " + ", ".join(f"{n} {stages[n]['p95']:.0f}s" for n in slowest))
+    return "\n".join(lines)
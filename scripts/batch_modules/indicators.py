@@ -4,22 +4,466 @@ batch_modules/indicators.py
 STEP 2: ??? ?? ??
 """
 
+import os
 import pandas as pd
 import numpy as np
 from datetime import datetime, date, timedelta
+from typing import Optional
 from supabase import Client
-from .utils import safe_float, safe_int, to_iso, calculate_rsi, calculate_avwap
+from .utils import safe_float, safe_int, to_iso, last_anchored_avwap, last_atr, atr_percent
+from .panel import load_stock_daily_frame, build_bar_panel, started_mask
+from .instrument import traced
 
 
-def calculate_indicators(supabase: Client, trading_date: str):
-    """Calculate technical indicators and store daily snapshot."""
+INDICATOR_LOOKBACK_DAYS = 400
+AVWAP_LOW_WINDOW = 250
+ATR_PERIOD = 14
+
+
+def _num(v):
+    try:
+        fv = float(v)
+        return None if (pd.isna(fv) or np.isinf(fv)) else round(fv, 4)
+    except:
+        return None
+
+
+def _num_int(v):
+    try:
+        fv = float(v)
+        return None if (pd.isna(fv) or np.isinf(fv)) else int(fv)
+    except:
+        return None
+
+
+def _last_sma(close: np.ndarray, lengths: np.ndarray, window: int, lag: int = 0) -> np.ndarray:
+    """SMA(window) ending ``lag`` bars before each ticker's last bar."""
+    out = np.full(close.shape[1], np.nan)
+    depth = close.shape[0]
+    if depth < window + lag:
+        return out
+    ok = lengths >= window + lag
+    block = close[depth - lag - window:depth - lag, ok]
+    out[ok] = block.mean(axis=0)
+    return out
+
+
+def _last_roc(close: np.ndarray, lengths: np.ndarray, period: int) -> np.ndarray:
+    out = np.full(close.shape[1], np.nan)
+    if close.shape[0] <= period:
+        return out
+    ok = lengths > period
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out[ok] = (close[-1, ok] / close[-1 - period, ok] - 1) * 100
+    return out
+
+
+def _last_wilder_rsi(close: np.ndarray, started: np.ndarray, lengths: np.ndarray, period: int = 14) -> tuple:
+    """Wilder RSI at the last bar plus the (avg_gain, avg_loss) state.
+
+    Same recursion as ``calculate_rsi`` (ewm alpha=1/period, adjust=False),
+    advanced one bar at a time for every ticker at once.
+    """
+    delta = np.diff(close, axis=0, prepend=np.nan)
+    gain = np.where(delta > 0, delta, 0.0)
+    loss = np.where(delta < 0, -delta, 0.0)
+    alpha = 1.0 / period
+    n_tickers = close.shape[1]
+    avg_gain = np.zeros(n_tickers)
+    avg_loss = np.zeros(n_tickers)
+    seen = np.zeros(n_tickers, dtype=bool)
+    for t in range(close.shape[0]):
+        active = started[t]
+        first = active & ~seen
+        step = active & seen
+        avg_gain = np.where(first, gain[t], np.where(step, (1 - alpha) * avg_gain + alpha * gain[t], avg_gain))
+        avg_loss = np.where(first, loss[t], np.where(step, (1 - alpha) * avg_loss + alpha * loss[t], avg_loss))
+        seen |= active
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = 100 - (100 / (1 + avg_gain / avg_loss))
+    rsi[lengths < period] = np.nan
+    return rsi, avg_gain, avg_loss
+
+
+@traced()
+def compute_indicator_panel(panel: dict, min_bars: int = 20) -> pd.DataFrame:
+    """Compute last-bar indicators for every ticker of a bar panel in one pass.
+
+    Returns one row per ticker with at least ``min_bars`` bars.
+    """
+    tickers = panel["tickers"]
+    if not tickers:
+        return pd.DataFrame()
+
+    lengths = np.asarray(panel["lengths"])
+    close = panel["close"]
+    started = started_mask(panel)
+
+    rsi14, _, _ = _last_wilder_rsi(close, started, lengths, 14)
+    sma200 = _last_sma(close, lengths, 200)
+    atr14 = np.full(len(tickers), np.nan)
+    if "high" in panel:
+        atr14, _ = last_atr(panel["high"], panel["low"], close, ATR_PERIOD)
+        atr14 = np.where(lengths > ATR_PERIOD, atr14, np.nan)
+    frame = pd.DataFrame({
+        "code": tickers,
+        "trade_date": panel["last_dates"],
+        "bars": lengths,
+        "close": close[-1],
+        "volume": panel["volume"][-1],
+        "value_traded": panel["value"][-1],
+        "sma20": _last_sma(close, lengths, 20),
+        "sma50": _last_sma(close, lengths, 50),
+        "sma200": sma200,
+        "slope200": sma200 - _last_sma(close, lengths, 200, lag=5),
+        "rsi14": rsi14,
+        "roc14": _last_roc(close, lengths, 14),
+        "roc21": _last_roc(close, lengths, 21),
+        "avwap_breakout": last_anchored_avwap(close, panel["low"], panel["volume"], AVWAP_LOW_WINDOW)[0],
+        "atr14": atr14,
+        "atr_pct": atr_percent(atr14, close[-1]),
+    })
+    return frame[frame["bars"] >= min_bars].reset_index(drop=True)
+
+
+def _upsert_daily_indicators(supabase: Client, rows: list) -> int:
+    """Upsert daily_indicators rows; returns the number of failed sub-batches."""
+    sub_fail = 0
+    for i in range(0, len(rows), 500):
+        batch = rows[i:i + 500]
+        try:
+            supabase.table("daily_indicators").upsert(batch, on_conflict="code,trade_date").execute()
+            continue
+        except Exception as e:
+            err = e
+        if "atr" in str(err) and "atr14" in batch[0]:
+            # daily_indicators without migration 016: keep writing the other columns
+            print("     daily_indicators has no atr14/atr_pct columns yet (migration 016), writing without them")
+            rows[:] = [{k: v for k, v in r.items() if k not in ("atr14", "atr_pct")} for r in rows]
+            batch = rows[i:i + 500]
+            try:
+                supabase.table("daily_indicators").upsert(batch, on_conflict="code,trade_date").execute()
+                continue
+            except Exception as e:
+                err = e
+        print(f"     upsert error: {err}")
+        for j in range(0, len(batch), 50):
+            try:
+                supabase.table("daily_indicators").upsert(batch[j:j+50], on_conflict="code,trade_date").execute()
+            except Exception:
+                sub_fail += 1
+    return sub_fail
+
+
+def _indicator_rows(frame: pd.DataFrame) -> list:
+    now_iso = datetime.now().isoformat()
+    rows = []
+    for rec in frame.to_dict("records"):
+        avwap_val = _num(rec["avwap_breakout"])
+        rows.append({
+            "code": rec["code"],
+            "trade_date": rec["trade_date"],
+            "close": _num(rec["close"]),
+            "volume": _num_int(rec["volume"]),
+            "value_traded": _num(rec["value_traded"]),
+            "sma20": _num(rec["sma20"]),
+            "sma50": _num(rec["sma50"]),
+            "sma200": _num(rec["sma200"]),
+            "slope200": _num(rec["slope200"]),
+            "rsi14": _num(rec["rsi14"]),
+            "roc14": _num(rec["roc14"]),
+            "roc21": _num(rec["roc21"]),
+            "avwap_breakout": avwap_val if avwap_val else None,
+            "atr14": _num(rec.get("atr14")),
+            "atr_pct": _num(rec.get("atr_pct")),
+            "updated_at": now_iso,
+        })
+    return rows
+
+
+# ---------------------------------------------------------------------------
+# Incremental mode: per-ticker rolling state in daily_indicator_state
+# ---------------------------------------------------------------------------
+
+STATE_TAIL_BARS = AVWAP_LOW_WINDOW  # >= 205 bars needed for sma200/slope200
+STATE_MAX_GAP_DAYS = 30
+RSI_ALPHA = 1.0 / 14
+SMA_WINDOWS = (20, 50, 200)
+
+
+def _clean(v):
+    try:
+        fv = float(v)
+        return fv if np.isfinite(fv) else None
+    except:
+        return None
+
+
+def _clean_list(values) -> list:
+    return [_clean(v) for v in values]
+
+
+def build_indicator_states(panel: dict) -> dict:
+    """Build rolling state (code -> dict) from a bar panel's last bar."""
+    tickers = panel["tickers"]
+    if not tickers:
+        return {}
+
+    lengths = np.asarray(panel["lengths"])
+    close, high, low = panel["close"], panel["high"], panel["low"]
+    volume, value = panel["volume"], panel["value"]
+    depth = panel["depth"]
+    _, avg_gain, avg_loss = _last_wilder_rsi(close, started_mask(panel), lengths, 14)
+    _, anchor, sum_pv, sum_v = last_anchored_avwap(close, low, volume, AVWAP_LOW_WINDOW)
+    sma200_hist = [_last_sma(close, lengths, 200, lag) for lag in (5, 4, 3, 2, 1, 0)]
+
+    states = {}
+    for j, code in enumerate(tickers):
+        bars = int(lengths[j])
+        if bars == 0:
+            continue
+        tail = min(bars, STATE_TAIL_BARS)
+        closes = close[depth - tail:, j]
+        state = {
+            "last_date": panel["last_dates"][j],
+            "bars": bars,
+            "last_close": _clean(close[-1, j]),
+            "last_volume": _clean(volume[-1, j]),
+            "last_value": _clean(value[-1, j]),
+            "avg_gain": _clean(avg_gain[j]),
+            "avg_loss": _clean(avg_loss[j]),
+            "closes": _clean_list(closes),
+            "highs": _clean_list(high[depth - tail:, j]),
+            "lows": _clean_list(low[depth - tail:, j]),
+            "volumes": _clean_list(volume[depth - tail:, j]),
+            "sma200_hist": [_clean(h[j]) for h in sma200_hist],
+            "avwap_age": int(depth - 1 - anchor[j]) if anchor[j] >= 0 else None,
+            "avwap_pv": float(sum_pv[j]),
+            "avwap_v": float(sum_v[j]),
+        }
+        for k in SMA_WINDOWS:
+            state[f"sum{k}"] = float(np.nansum(close[depth - min(bars, k):, j]))
+        states[code] = state
+    return states
+
+
+def _rescan_avwap_anchor(state: dict):
+    lows = np.array([np.inf if v is None else v for v in state["lows"]], dtype=float)
+    lows[np.isnan(lows)] = np.inf
+    if not np.isfinite(lows).any():
+        state["avwap_age"] = None
+        state["avwap_pv"] = 0.0
+        state["avwap_v"] = 0.0
+        return
+    idx = int(lows.argmin())
+    closes = np.nan_to_num(np.array(state["closes"][idx:], dtype=float))
+    vols = np.nan_to_num(np.array(state["volumes"][idx:], dtype=float))
+    state["avwap_age"] = len(lows) - 1 - idx
+    state["avwap_pv"] = float((closes * vols).sum())
+    state["avwap_v"] = float(vols.sum())
+
+
+def advance_indicator_state(state: dict, bar: dict) -> dict:
+    """Advance a rolling state by exactly one new bar (in place)."""
+    c = _clean(bar.get("close"))
+    h = _clean(bar.get("high"))
+    l = _clean(bar.get("low"))
+    v = _clean(bar.get("volume"))
+    prev = state.get("last_close")
+    closes = state["closes"]
+
+    delta = (c - prev) if (c is not None and prev is not None) else 0.0
+    gain = delta if delta > 0 else 0.0
+    loss = -delta if delta < 0 else 0.0
+    state["avg_gain"] = (1 - RSI_ALPHA) * (state.get("avg_gain") or 0.0) + RSI_ALPHA * gain
+    state["avg_loss"] = (1 - RSI_ALPHA) * (state.get("avg_loss") or 0.0) + RSI_ALPHA * loss
+
+    for k in SMA_WINDOWS:
+        key = f"sum{k}"
+        state[key] = (state.get(key) or 0.0) + (c or 0.0)
+        if len(closes) >= k:
+            state[key] -= closes[-k] or 0.0
+
+    state["bars"] += 1
+    for key, val in (("closes", c), ("highs", h), ("lows", l), ("volumes", v)):
+        state[key].append(val)
+        del state[key][:-STATE_TAIL_BARS]
+    state["sma200_hist"] = (state["sma200_hist"] + [state["sum200"] / 200 if state["bars"] >= 200 else None])[-6:]
+
+    age = state.get("avwap_age")
+    anchor_low = state["lows"][-2 - age] if (age is not None and age + 1 < len(state["lows"])) else None
+    if anchor_low is None:
+        _rescan_avwap_anchor(state)
+    elif l is not None and l < anchor_low:
+        state["avwap_age"] = 0
+        state["avwap_pv"] = (c or 0.0) * (v or 0.0)
+        state["avwap_v"] = v or 0.0
+    else:
+        state["avwap_age"] = age + 1
+        state["avwap_pv"] += (c or 0.0) * (v or 0.0)
+        state["avwap_v"] += v or 0.0
+
+    state["last_date"] = str(bar["date"])[:10]
+    state["last_close"] = c
+    state["last_volume"] = v
+    state["last_value"] = _clean(bar.get("value"))
+    return state
+
+
+def indicators_from_state(code: str, state: dict) -> dict:
+    """Indicator values at a state's last bar (same fields as the panel frame)."""
+    bars = state["bars"]
+    closes = state["closes"]
+    out = {
+        "code": code,
+        "trade_date": state["last_date"],
+        "bars": bars,
+        "close": state["last_close"],
+        "volume": state["last_volume"],
+        "value_traded": state["last_value"],
+    }
+    for k in SMA_WINDOWS:
+        out[f"sma{k}"] = state[f"sum{k}"] / k if bars >= k else None
+    hist = state["sma200_hist"]
+    out["slope200"] = hist[-1] - hist[0] if len(hist) == 6 and None not in (hist[0], hist[-1]) else None
+
+    rsi = None
+    if bars >= 14:
+        g, l = state["avg_gain"] or 0.0, state["avg_loss"] or 0.0
+        if l > 0:
+            rsi = 100 - (100 / (1 + g / l))
+        elif g > 0:
+            rsi = 100.0
+    out["rsi14"] = rsi
+    for k in (14, 21):
+        roc = None
+        if bars > k and closes[-1] is not None and closes[-1 - k]:
+            roc = (closes[-1] / closes[-1 - k] - 1) * 100
+        out[f"roc{k}"] = roc
+    out["avwap_breakout"] = (
+        state["avwap_pv"] / state["avwap_v"]
+        if state.get("avwap_age") is not None and state.get("avwap_v") else None
+    )
+    atr = None
+    if bars > ATR_PERIOD:
+        tail = ATR_PERIOD + 1
+        atr, _ = last_atr(
+            np.array(state["highs"][-tail:], dtype=float),
+            np.array(state["lows"][-tail:], dtype=float),
+            np.array(closes[-tail:], dtype=float),
+            ATR_PERIOD,
+        )
+    out["atr14"] = atr
+    out["atr_pct"] = float(atr_percent(atr, state["last_close"] or np.nan)) if atr is not None else None
+    return out
+
+
+def _load_indicator_states(supabase: Client, tickers: list) -> dict | None:
+    """Load persisted states; None when the state table is unavailable."""
+    states = {}
+    try:
+        for i in range(0, len(tickers), 200):
+            res = supabase.table("daily_indicator_state") \
+                .select("code, state") \
+                .in_("code", tickers[i:i + 200]).execute()
+            for row in (res.data or []):
+                if isinstance(row.get("state"), dict):
+                    states[row["code"]] = row["state"]
+    except Exception as e:
+        print(f"  -> indicator state unavailable, using full recomputation: {e}")
+        return None
+    return states
+
+
+def _save_indicator_states(supabase: Client, states: dict):
+    now_iso = datetime.now().isoformat()
+    payload = [{
+        "code": code,
+        "last_date": st["last_date"],
+        "bars": st["bars"],
+        "state": st,
+        "updated_at": now_iso,
+    } for code, st in states.items()]
+    fail = 0
+    for i in range(0, len(payload), 200):
+        try:
+            supabase.table("daily_indicator_state").upsert(payload[i:i + 200], on_conflict="code").execute()
+        except Exception as e:
+            fail += 1
+            if fail <= 3:
+                print(f"     indicator state upsert error: {e}")
+    if fail:
+        print(f"   [WARN] daily_indicator_state upsert failures: {fail}")
+
+
+def _history_invalidated(state: dict, anchor_row: Optional[dict], new_bars: list) -> bool:
+    """True when stored history no longer matches the state (e.g. split adjustment)."""
+    from _price_adjustment import adjust_ohlcv_for_splits
+
+    if anchor_row is None or _clean(anchor_row.get("close")) != state.get("last_close"):
+        return True
+    if not new_bars:
+        return False
+    seq = pd.DataFrame(
+        {"close": [state["last_close"]] + [_clean(b.get("close")) for b in new_bars]},
+        index=[state["last_date"]] + [b["date"] for b in new_bars],
+    )
+    _, split_events = adjust_ohlcv_for_splits(seq, close_col="close")
+    return bool(split_events)
+
+
+def _advance_indicator_states(supabase: Client, states: dict) -> tuple[dict, list]:
+    """Advance loaded states by the bars stored since their last_date.
+
+    Returns ``(advanced_states, fallback_tickers)``.
+    """
+    cutoff = (date.today() - timedelta(days=STATE_MAX_GAP_DAYS)).isoformat()
+    # States written before highs were tracked cannot produce ATR; rebuild them once.
+    fresh = {
+        code: st for code, st in states.items()
+        if st.get("last_date", "") >= cutoff and "highs" in st
+    }
+    fallback = [code for code in states if code not in fresh]
+    if not fresh:
+        return {}, fallback
+
+    from_iso = min(st["last_date"] for st in fresh.values())
+    df = load_stock_daily_frame(
+        supabase, sorted(fresh), from_iso,
+        columns="ticker, date, high, low, close, volume, value",
+    )
+    grouped = {t: g.to_dict("records") for t, g in df.groupby("ticker")} if not df.empty else {}
+
+    advanced = {}
+    for code, st in fresh.items():
+        rows = grouped.get(code, [])
+        anchor_row = next((r for r in rows if r["date"] == st["last_date"]), None)
+        new_bars = [r for r in rows if r["date"] > st["last_date"]]
+        if _history_invalidated(st, anchor_row, new_bars):
+            fallback.append(code)
+            continue
+        for bar in new_bars:
+            advance_indicator_state(st, bar)
+        advanced[code] = st
+    return advanced, fallback
+
+
+@traced()
+def calculate_indicators(supabase: Client, trading_date: str, mode: Optional[str] = None):
+    """Calculate technical indicators and store daily snapshot.
+
+    ``mode`` (or INDICATOR_MODE) is ``incremental`` (default) or ``full``.
+    Incremental mode advances persisted per-ticker state by the new bars and
+    recomputes from the 400-day window only for tickers without usable state.
+    """
     trading_iso = to_iso(trading_date)
-    print(f"\n[2/7] Calculating technical indicators...")
+    mode = (mode or os.environ.get("INDICATOR_MODE", "incremental")).strip().lower()
+    print(f"\n[2/7] Calculating technical indicators (mode: {mode})...")
 
     try:
         res = supabase.table("stock_daily") \
             .select("ticker").eq("date", trading_iso).execute()
-        target_tickers = list(set(r["ticker"] for r in (res.data or [])))
+        target_tickers = sorted(set(r["ticker"] for r in (res.data or [])))
     except Exception as e:
         print(f"  Failed to load target tickers: {e}")
         return
@@ -30,117 +474,50 @@ def calculate_indicators(supabase: Client, trading_date: str):
 
     print(f"  -> target tickers: {len(target_tickers)}")
 
-    total_success = 0
-    total_fail = 0
-    upsert_sub_fail = 0
-    upsert_buffer: list = []
-    from_date = (date.today() - timedelta(days=400)).isoformat()
-
-    def n(v):
+    frames = []
+    states = _load_indicator_states(supabase, target_tickers) if mode == "incremental" else None
+    new_states: dict = {}
+    full_tickers = target_tickers
+    if states:
         try:
-            fv = float(v)
-            return None if (pd.isna(fv) or np.isinf(fv)) else round(fv, 4)
-        except:
-            return None
-
-    def n_int(v):
-        try:
-            fv = float(v)
-            return None if (pd.isna(fv) or np.isinf(fv)) else int(fv)
-        except:
-            return None
-
-    for idx, ticker in enumerate(target_tickers):
-        if idx % 100 == 0:
-            print(f"  -> progress: {idx}/{len(target_tickers)}")
-            if upsert_buffer:
-                try:
-                    supabase.table("daily_indicators").upsert(upsert_buffer, on_conflict="code,trade_date").execute()
-                except Exception as e:
-                    print(f"     upsert error: {e}")
-                    for j in range(0, len(upsert_buffer), 50):
-                        try:
-                            supabase.table("daily_indicators").upsert(upsert_buffer[j:j+50], on_conflict="code,trade_date").execute()
-                        except Exception:
-                            upsert_sub_fail += 1
-                upsert_buffer = []
+            advanced, fallback = _advance_indicator_states(supabase, states)
+        except Exception as e:
+            print(f"  -> incremental update failed, using full recomputation: {e}")
+            advanced, fallback = {}, list(states)
+        new_states.update(advanced)
+        full_tickers = [t for t in target_tickers if t not in advanced]
+        if advanced:
+            frames.append(pd.DataFrame([indicators_from_state(c, st) for c, st in advanced.items()]))
+        print(f"  -> incremental: {len(advanced)} advanced, {len(fallback)} invalidated, "
+              f"{len(full_tickers)} full recomputation")
 
+    if full_tickers:
+        from_date = (date.today() - timedelta(days=INDICATOR_LOOKBACK_DAYS)).isoformat()
         try:
-            h_res = supabase.table("stock_daily") \
-                .select("*") \
-                .eq("ticker", ticker) \
-                .gte("date", from_date) \
-                .order("date", desc=False) \
-                .limit(500).execute()
-
-            if not h_res.data or len(h_res.data) < 20:
-                continue
+            df = load_stock_daily_frame(
+                supabase, full_tickers, from_date,
+                columns="ticker, date, high, low, close, volume, value",
+            )
+        except Exception as e:
+            print(f"  Failed to load stock_daily window: {e}")
+            return
+        print(f"  -> loaded {len(df):,} stock_daily rows (from {from_date})")
+        panel = build_bar_panel(df, ("close", "high", "low", "volume", "value"))
+        frames.append(compute_indicator_panel(panel))
+        if states is not None:
+            new_states.update(build_indicator_states(panel))
 
-            df = pd.DataFrame(h_res.data)
-            df["date"] = pd.to_datetime(df["date"])
-            df = df.sort_values("date")
-
-            close = df["close"].astype(float)
-            df = df.copy()
-            df["rsi14"] = calculate_rsi(close, 14)
-            df["roc14"] = close.pct_change(14) * 100
-            df["roc21"] = close.pct_change(21) * 100
-            df["sma20"] = close.rolling(20).mean()
-            df["sma50"] = close.rolling(50).mean()
-            df["sma200"] = close.rolling(200).mean()
-            df["slope200"] = df["sma200"].diff(5)
-
-            avwap_val = None
-            try:
-                window = min(250, len(df))
-                low_idx = df["low"].astype(float).tail(window).idxmin()
-                idx_loc = df.index.get_loc(low_idx)
-                avwap_val = calculate_avwap(
-                    df.assign(close=df["close"].astype(float), volume=df["volume"].astype(float)),
-                    idx_loc,
-                )
-            except:
-                pass
-
-            last = df.iloc[-1]
-            last_date_str = last["date"].strftime("%Y-%m-%d")
-
-            upsert_buffer.append({
-                "code": ticker,
-                "trade_date": last_date_str,
-                "close": n(last["close"]),
-                "volume": n_int(last.get("volume")),
-                "value_traded": n(last.get("value")),
-                "sma20": n(last.get("sma20")),
-                "sma50": n(last.get("sma50")),
-                "sma200": n(last.get("sma200")),
-                "slope200": n(last.get("slope200")),
-                "rsi14": n(last.get("rsi14")),
-                "roc14": n(last.get("roc14")),
-                "roc21": n(last.get("roc21")),
-                "avwap_breakout": n(avwap_val) if avwap_val else None,
-                "updated_at": datetime.now().isoformat(),
-            })
-            total_success += 1
+    frame = pd.concat([f for f in frames if not f.empty], ignore_index=True) if any(not f.empty for f in frames) else pd.DataFrame()
+    if not frame.empty:
+        frame = frame[frame["bars"] >= 20]
+    rows = _indicator_rows(frame) if not frame.empty else []
+    total_skip = len(target_tickers) - len(rows)
 
-        except Exception as e:
-            total_fail += 1
-            if total_fail <= 5:
-                print(f"     {ticker}: {e}")
-            continue
+    upsert_sub_fail = _upsert_daily_indicators(supabase, rows) if rows else 0
+    if states is not None and new_states:
+        _save_indicator_states(supabase, new_states)
 
-    if upsert_buffer:
-        try:
-            supabase.table("daily_indicators").upsert(upsert_buffer, on_conflict="code,trade_date").execute()
-        except Exception as e:
-            print(f"     final upsert error: {e}")
-            for j in range(0, len(upsert_buffer), 50):
-                try:
-                    supabase.table("daily_indicators").upsert(upsert_buffer[j:j+50], on_conflict="code,trade_date").execute()
-                except Exception:
-                    upsert_sub_fail += 1
-
-    print(f"   indicator calculation complete: {total_success} success (fail: {total_fail})")
+    print(f"   indicator calculation complete: {len(rows)} success (skipped: {total_skip})")
     if upsert_sub_fail > 0:
         print(f"   [WARN] daily_indicators sub-batch upsert failures: {upsert_sub_fail}")
     _sync_stocks_indicators(supabase, trading_date)
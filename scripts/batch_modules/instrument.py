@@ -0,0 +1,347 @@
+"""
+batch_modules/instrument.py
+==========================
+Lightweight spans and counters for daily_batch runs
+- span(name) / @traced: wall time plus counters (requests, rows, bytes,
+  retries, errors), aggregated per (stage, span name)
+- the current stage is thread-local; bind() carries it into worker pools
+- instrument_supabase(client) makes every .execute() a "supabase.<table>" span
+- start_profiling/stop_profiling wrap a --profile run; profiled(stage) and
+  bind() attribute work to stages where the interpreter allows it (see below)
+- snapshot() is stored in the run status JSON
+"""
+
+import functools
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+
+NO_STAGE = "-"
+
+_local = threading.local()
+_lock = threading.Lock()
+_spans: dict[tuple[str, str], dict] = {}
+_profiles: dict[str, list[str]] = {}
+
+
+def current_stage() -> str:
+    return getattr(_local, "stage", None) or NO_STAGE
+
+
+@contextmanager
+def stage_scope(stage: str):
+    """Attribute spans recorded on this thread to ``stage``."""
+    prev = getattr(_local, "stage", None)
+    _local.stage = stage
+    try:
+        yield
+    finally:
+        _local.stage = prev
+
+
+def bind(fn):
+    """Wrap ``fn`` so it records (and, under --profile, profiles) under the
+    caller's stage when run on a pool thread."""
+    stage = current_stage()
+
+    @functools.wraps(fn)
+    def wrapped(*args, **kwargs):
+        with stage_scope(stage), _thread_cprofile(stage):
+            return fn(*args, **kwargs)
+    return wrapped
+
+
+def record(name: str, seconds: float = 0.0, **counters):
+    """Add one call of ``name`` (and its counters) to the current stage."""
+    key = (current_stage(), name)
+    with _lock:
+        agg = _spans.get(key)
+        if agg is None:
+            agg = _spans[key] = {"calls": 0, "seconds": 0.0, "max_seconds": 0.0}
+        agg["calls"] += 1
+        agg["seconds"] += seconds
+        agg["max_seconds"] = max(agg["max_seconds"], seconds)
+        for k, v in counters.items():
+            if v:
+                agg[k] = agg.get(k, 0) + v
+
+
+class Span:
+    __slots__ = ("name", "counters")
+
+    def __init__(self, name: str, counters: dict):
+        self.name = name
+        self.counters = dict(counters)
+
+    def add(self, key: str, n: int = 1):
+        self.counters[key] = self.counters.get(key, 0) + n
+
+
+@contextmanager
+def span(name: str, **counters):
+    """Time a block; ``yield``s a Span whose ``add()`` feeds its counters."""
+    s = Span(name, counters)
+    start = time.perf_counter()
+    try:
+        yield s
+    except BaseException:
+        s.add("errors")
+        raise
+    finally:
+        record(name, time.perf_counter() - start, **s.counters)
+
+
+def traced(name: Optional[str] = None):
+    """Decorator form of span(); defaults to ``module.function``."""
+    def deco(fn):
+        label = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        def wrapped(*args, **kwargs):
+            with span(label):
+                return fn(*args, **kwargs)
+        return wrapped
+    return deco
+
+
+def response_bytes(resp) -> int:
+    try:
+        return len(resp.content or b"")
+    except Exception:
+        return 0
+
+
+# ── Supabase ──
+
+class _QueryProxy:
+    """Forwards a postgrest builder chain and times the final execute()."""
+
+    __slots__ = ("_target", "_label")
+
+    def __init__(self, target, label: str):
+        self._target = target
+        self._label = label
+
+    def __getattr__(self, attr):
+        value = getattr(self._target, attr)
+        if not callable(value):
+            return _QueryProxy(value, self._label) if hasattr(value, "execute") else value
+
+        def call(*args, **kwargs):
+            result = value(*args, **kwargs)
+            return _QueryProxy(result, self._label) if hasattr(result, "execute") else result
+        return call
+
+    def execute(self):
+        with span(self._label, requests=1) as s:
+            res = self._target.execute()
+            data = getattr(res, "data", None)
+            if isinstance(data, list):
+                s.add("rows", len(data))
+            return res
+
+
+class InstrumentedClient:
+    """Supabase client wrapper: table()/rpc() calls report as spans."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name: str):
+        return _QueryProxy(self._client.table(name), f"supabase.{name}")
+
+    from_ = table
+
+    def rpc(self, fn: str, params: Optional[dict] = None, *args, **kwargs):
+        return _QueryProxy(self._client.rpc(fn, params or {}, *args, **kwargs), f"supabase.rpc.{fn}")
+
+    def __getattr__(self, attr):
+        return getattr(self._client, attr)
+
+
+def instrument_supabase(client):
+    return client if isinstance(client, InstrumentedClient) else InstrumentedClient(client)
+
+
+# ── profiling ──
+#
+# One session per --profile run. cProfile on 3.12+ is process-global (only
+# one profiler may be active), so a single profiler covers every thread and
+# the output is one batch.prof for the run. Before 3.12 cProfile only hooks
+# the thread that enables it, so each stage thread and every bind()-wrapped
+# pool task profiles into a per-(thread, stage) profiler, merged per stage
+# at the end. pyinstrument (BATCH_PROFILER=pyinstrument) samples the stage
+# thread only, so pool-thread work shows up as waits there.
+# Profiler failures are reported and ignored; they never fail a stage.
+
+_CPROFILE_GLOBAL = sys.version_info >= (3, 12)
+_profiling: Optional[dict] = None
+
+
+def start_profiling(out_dir: Path):
+    """Begin the process-wide profiling session (no-op if one is running)."""
+    global _profiling
+    if _profiling is not None:
+        return
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    mode = os.environ.get("BATCH_PROFILER", "cprofile").lower()
+    if mode == "pyinstrument":
+        try:
+            import pyinstrument  # noqa: F401
+        except ImportError:
+            print("   [profile] pyinstrument not installed, using cProfile")
+            mode = "cprofile"
+    session = {"dir": out_dir, "mode": mode, "global": None, "threads": []}
+    if mode == "cprofile" and _CPROFILE_GLOBAL:
+        import cProfile
+
+        try:
+            session["global"] = cProfile.Profile()
+            session["global"].enable()
+        except ValueError as e:   # another profiler (coverage, debugger) holds the hook
+            print(f"   [profile] cProfile unavailable, profiling disabled: {e}")
+            return
+    _profiling = session
+
+
+def stop_profiling():
+    """Stop the session and write its output under the session directory."""
+    global _profiling
+    session, _profiling = _profiling, None
+    if session is None:
+        return
+    try:
+        if session["global"] is not None:
+            session["global"].disable()
+            _dump_cprofile("batch", session["dir"], [session["global"]])
+        elif session["threads"]:
+            by_stage: dict[str, list] = {}
+            for stage, prof in session["threads"]:
+                by_stage.setdefault(stage, []).append(prof)
+            for stage, profs in by_stage.items():
+                _dump_cprofile(stage, session["dir"], profs)
+            _dump_cprofile("batch", session["dir"], [p for _, p in session["threads"]])
+    except Exception as e:
+        print(f"   [profile] writing profiles failed: {e}")
+
+
+def _dump_cprofile(name: str, out_dir: Path, profs: list):
+    import io
+    import pstats
+
+    stats = None
+    for prof in profs:
+        try:
+            if stats is None:
+                stats = pstats.Stats(prof)
+            else:
+                stats.add(prof)
+        except TypeError:         # profiler that never saw a call
+            continue
+    if stats is None:
+        return
+    path = out_dir / f"{name}.prof"
+    stats.dump_stats(str(path))
+    buf = io.StringIO()
+    stats.stream = buf
+    stats.sort_stats("cumulative").print_stats(40)
+    (out_dir / f"{name}.txt").write_text(buf.getvalue(), encoding="utf-8")
+    _add_profile(name, [str(path), str(out_dir / f"{name}.txt")])
+
+
+@contextmanager
+def _thread_cprofile(stage: str):
+    """Per-thread cProfile (before 3.12) for the current block; re-entrant."""
+    session = _profiling
+    if session is None or session["mode"] != "cprofile" or _CPROFILE_GLOBAL or getattr(_local, "profiling", False):
+        yield
+        return
+    profs = getattr(_local, "profs", None)
+    if profs is None:
+        profs = _local.profs = {}
+    prof = profs.get(stage)
+    if prof is None:
+        import cProfile
+
+        prof = profs[stage] = cProfile.Profile()
+        with _lock:
+            session["threads"].append((stage, prof))
+    try:
+        prof.enable()
+    except Exception as e:
+        print(f"   [profile] {stage}: {e}")
+        yield
+        return
+    _local.profiling = True
+    try:
+        yield
+    finally:
+        _local.profiling = False
+        prof.disable()
+
+
+@contextmanager
+def profiled(stage: str):
+    """Profile a stage's thread within the active session (no-op without one)."""
+    session = _profiling
+    if session is None:
+        yield
+        return
+    if session["mode"] != "pyinstrument":
+        with _thread_cprofile(stage):
+            yield
+        return
+
+    try:
+        from pyinstrument import Profiler
+
+        profiler = Profiler(async_mode="disabled")
+        profiler.start()
+    except Exception as e:
+        print(f"   [profile] {stage}: pyinstrument failed to start: {e}")
+        yield
+        return
+    try:
+        yield
+    finally:
+        try:
+            profiler.stop()
+            out_dir = session["dir"]
+            path = out_dir / f"{stage}.html"
+            path.write_text(profiler.output_html(), encoding="utf-8")
+            (out_dir / f"{stage}.txt").write_text(profiler.output_text(unicode=True), encoding="utf-8")
+            _add_profile(stage, [str(path)])
+        except Exception as e:
+            print(f"   [profile] {stage}: writing pyinstrument output failed: {e}")
+
+
+def _add_profile(stage: str, paths: list[str]):
+    with _lock:
+        _profiles.setdefault(stage, []).extend(paths)
+
+
+# ── export ──
+
+def snapshot() -> dict:
+    """{"stages": {stage: {span: {calls, seconds, max_seconds, counters...}}}, "profiles"}."""
+    with _lock:
+        stages: dict[str, dict] = {}
+        for (stage, name), agg in sorted(_spans.items()):
+            stages.setdefault(stage, {})[name] = {
+                **agg,
+                "seconds": round(agg["seconds"], 3),
+                "max_seconds": round(agg["max_seconds"], 3),
+            }
+        return {"stages": stages, "profiles": {k: list(v) for k, v in _profiles.items()}}
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _profiles.clear()
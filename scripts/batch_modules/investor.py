@@ -10,18 +10,29 @@ STEP 2.5: KIS Open API 기반 투자자 수급 수집
 import os
 import time
 import json
-import subprocess
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
 from typing import Optional
+from requests.adapters import HTTPAdapter
 from supabase import Client
 from .utils import to_iso, safe_int
+from .instrument import bind, record, response_bytes, span, traced
+from .ratelimit import TokenBucket
 
 
 KIS_BASE = "https://openapi.koreainvestment.com:9443"
 KIS_TOKEN_CACHE = os.path.join(os.path.dirname(__file__), ".._kis_token.json")
 _token_cache: dict = {}
 
+# KIS allows 20 req/s per app key on real accounts; stay below it by default
+INVESTOR_KIS_RPS = float(os.environ.get("INVESTOR_KIS_RPS", "15"))
+INVESTOR_KIS_WORKERS = int(os.environ.get("INVESTOR_KIS_WORKERS", "8"))
+KIS_TOKEN_ATTEMPTS = 3
+KIS_TOKEN_RETRY_WAIT = 65  # token issuance is limited to once per minute
+KIS_AUTH_ERROR_CODES = ("EGW00121", "EGW00123")  # invalid / expired token
+
 
 def _business_days_between(start_iso: str, end_iso: str) -> Optional[int]:
     """Return business-day lag between two ISO dates (Mon-Fri only)."""
@@ -65,12 +76,13 @@ def _get_kis_token(app_key: str, app_secret: str) -> Optional[str]:
 
     # 신규 발급 (1분에 1회 제한)
     try:
-        resp = requests.post(
-            f"{KIS_BASE}/oauth2/tokenP",
-            headers={"content-type": "application/json"},
-            json={"grant_type": "client_credentials", "appkey": app_key, "appsecret": app_secret},
-            timeout=15,
-        )
+        with span("kis.token", requests=1):
+            resp = requests.post(
+                f"{KIS_BASE}/oauth2/tokenP",
+                headers={"content-type": "application/json"},
+                json={"grant_type": "client_credentials", "appkey": app_key, "appsecret": app_secret},
+                timeout=15,
+            )
         body = resp.json()
         if "access_token" not in body:
             print(f"   KIS 토큰 발급 실패: {body}")
@@ -103,28 +115,31 @@ def _compact_kis_error(body: dict, status_code: int) -> str:
     return " | ".join(parts)
 
 
-def _fetch_stock_investor(app_key: str, app_secret: str, token: str, code: str) -> tuple[Optional[dict], Optional[str]]:
+def _fetch_stock_investor(app_key: str, app_secret: str, token: str, code: str,
+                          session: Optional[requests.Session] = None) -> tuple[Optional[dict], Optional[str]]:
     """종목별 투자자 순매수 금액 (오늘 기준) 반환.
     Returns: {"institution": int, "foreign": int} (단위: 원)
     """
     try:
         timeout_sec = float(os.environ.get("INVESTOR_KIS_TIMEOUT_SEC", "4"))
-        resp = requests.get(
-            f"{KIS_BASE}/uapi/domestic-stock/v1/quotations/inquire-investor",
-            headers={
-                "content-type": "application/json",
-                "authorization": f"Bearer {token}",
-                "appkey": app_key,
-                "appsecret": app_secret,
-                "tr_id": "FHKST01010900",
-            },
-            params={
-                "FID_COND_MRKT_DIV_CODE": "J",
-                "FID_INPUT_ISCD": code,
-                "FID_DIV_CLS_CODE": "0",
-            },
-            timeout=timeout_sec,
-        )
+        with span("kis.inquire_investor", requests=1) as sp:
+            resp = (session or requests).get(
+                f"{KIS_BASE}/uapi/domestic-stock/v1/quotations/inquire-investor",
+                headers={
+                    "content-type": "application/json",
+                    "authorization": f"Bearer {token}",
+                    "appkey": app_key,
+                    "appsecret": app_secret,
+                    "tr_id": "FHKST01010900",
+                },
+                params={
+                    "FID_COND_MRKT_DIV_CODE": "J",
+                    "FID_INPUT_ISCD": code,
+                    "FID_DIV_CLS_CODE": "0",
+                },
+                timeout=timeout_sec,
+            )
+            sp.add("bytes", response_bytes(resp))
         body = resp.json()
         if body.get("rt_cd") != "0":
             return None, _compact_kis_error(body if isinstance(body, dict) else {}, resp.status_code)
@@ -163,43 +178,178 @@ def _fetch_stock_investor(app_key: str, app_secret: str, token: str, code: str)
         return None, f"exception={type(e).__name__}: {e}"
 
 
-def _run_naver_fallback(trading_iso: str) -> tuple[bool, str]:
-    """Run Naver-based investor backfill for recent window as fallback."""
+def _is_auth_error(reason: Optional[str]) -> bool:
+    return bool(reason) and ("http=401" in reason or any(c in reason for c in KIS_AUTH_ERROR_CODES))
+
+
+def _reset_kis_token_cache():
+    global _token_cache
+    _token_cache = {}
+    try:
+        os.remove(os.path.join(os.path.dirname(__file__), "_kis_token_cache.json"))
+    except Exception:
+        pass
+
+
+class KisInvestorCollector:
+    """Pooled KIS inquire-investor client.
+
+    Workers share one keep-alive session and one token bucket. When a
+    request fails with an auth error, a background thread re-issues the
+    token (retrying once a minute, the KIS issuance limit) while workers
+    only wait for the new token before retrying that code.
+    """
+
+    def __init__(self, app_key: str, app_secret: str, token: str,
+                 rps: float = INVESTOR_KIS_RPS, workers: int = INVESTOR_KIS_WORKERS):
+        self.app_key = app_key
+        self.app_secret = app_secret
+        self.workers = max(1, workers)
+        self.limiter = TokenBucket(rps)
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=self.workers))
+        self._token = token
+        self._lock = threading.Lock()
+        self._token_ready = threading.Event()
+        self._token_ready.set()
+        self._refresher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.counters = {"requests": 0, "success": 0, "fail": 0, "auth_errors": 0,
+                         "auth_retries": 0, "token_refreshes": 0}
+        self.fail_reason_count: dict[str, int] = {}
+        self.fail_reason_samples: list[str] = []
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self.counters[key] += n
+
+    def _current_token(self) -> Optional[str]:
+        self._token_ready.wait()
+        return self._token
+
+    def _request_refresh(self, stale_token: Optional[str]):
+        with self._lock:
+            if stale_token != self._token or (self._refresher and self._refresher.is_alive()):
+                return
+            self._token_ready.clear()
+            self._refresher = threading.Thread(target=self._refresh_token, daemon=True)
+            self._refresher.start()
+
+    def _refresh_token(self):
+        print("  -> KIS 인증 오류, 토큰 재발급 시도...")
+        token = None
+        for attempt in range(KIS_TOKEN_ATTEMPTS):
+            _reset_kis_token_cache()
+            token = _get_kis_token(self.app_key, self.app_secret)
+            if token or attempt == KIS_TOKEN_ATTEMPTS - 1:
+                break
+            time.sleep(KIS_TOKEN_RETRY_WAIT)
+        with self._lock:
+            self._token = token
+            self.counters["token_refreshes"] += 1
+        if not token:
+            print("  -> 재발급 실패, 중단")
+            self._stop.set()
+        self._token_ready.set()
+
+    def _fetch(self, code: str) -> tuple[Optional[dict], Optional[str]]:
+        for attempt in range(2):
+            token = self._current_token()
+            if not token or self._stop.is_set():
+                return None, "stopped"
+            self.limiter.acquire()
+            self._count("requests")
+            result, reason = _fetch_stock_investor(self.app_key, self.app_secret, token, code, self.session)
+            if result is not None or not _is_auth_error(reason):
+                return result, reason
+            self._count("auth_errors")
+            if attempt == 0:
+                self._count("auth_retries")
+                record("kis.auth_retry", retries=1)
+                self._request_refresh(token)
+        return None, reason
+
+    def _record_fail(self, code: str, reason: Optional[str]):
+        with self._lock:
+            self.counters["fail"] += 1
+            if reason:
+                self.fail_reason_count[reason] = self.fail_reason_count.get(reason, 0) + 1
+                if len(self.fail_reason_samples) < 5:
+                    self.fail_reason_samples.append(f"{code}: {reason}")
+                    if len(self.fail_reason_samples) == 1:
+                        print(f"  [DEBUG] first KIS fail: {self.fail_reason_samples[0]}")
+
+    def collect(self, codes: list[str]) -> list[dict]:
+        """Fetch all codes; returns investor_daily rows for the successful ones."""
+        max_initial_fail = int(os.environ.get("INVESTOR_KIS_MAX_INITIAL_FAIL", "40"))
+        rows: list[dict] = []
+
+        def work(code: str):
+            if self._stop.is_set():
+                return
+            result, reason = self._fetch(code)
+            if result is None:
+                if reason == "stopped":
+                    return
+                self._record_fail(code, reason)
+                with self._lock:
+                    if self.counters["success"] == 0 and self.counters["fail"] >= max_initial_fail \
+                            and not self._stop.is_set():
+                        print(f"  -> 초기 구간 연속 실패({self.counters['fail']}건)로 KIS 수집을 조기 중단합니다.")
+                        self._stop.set()
+                return
+            with self._lock:
+                self.counters["success"] += 1
+                rows.append({
+                    "date": result["date"],
+                    "ticker": code,
+                    "institution": result["institution"],
+                    "institution_amount": result["institution"],
+                    "foreign": result["foreign"],
+                    "foreign_amount": result["foreign"],
+                    "personal": result["personal"],
+                    "personal_amount": result["personal"],
+                })
+                done = self.counters["success"] + self.counters["fail"]
+                if done % 100 == 0:
+                    print(f"  -> {done}/{len(codes)} (success={self.counters['success']}, fail={self.counters['fail']})")
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="kis-investor") as pool:
+                list(pool.map(bind(work), codes))
+        finally:
+            self.session.close()
+        return rows
+
+
+def _run_naver_fallback(supabase: Client, trading_iso: str, codes: list[str]) -> tuple[bool, str]:
+    """Naver-based investor backfill for the recent window, run in-process."""
+    from .naver_investor import NAVER_RPS, NAVER_WORKERS, collect_naver_investor_rows
+
     target = date.fromisoformat(trading_iso)
     lookback_days = int(os.environ.get("INVESTOR_FALLBACK_DAYS", "45"))
-    start = (target - timedelta(days=max(1, lookback_days))).strftime("%Y%m%d")
-    end = target.strftime("%Y%m%d")
-    cmd = [
-        "python",
-        "scripts/backfill_investor_daily.py",
-        "--start",
-        start,
-        "--end",
-        end,
-        "--max-pages",
-        os.environ.get("INVESTOR_FALLBACK_MAX_PAGES", "20"),
-        "--sleep",
-        os.environ.get("INVESTOR_FALLBACK_SLEEP", "0.01"),
-    ]
+    start_dt = target - timedelta(days=max(1, lookback_days))
+    max_pages = int(os.environ.get("INVESTOR_FALLBACK_MAX_PAGES", "20"))
+    workers = int(os.environ.get("INVESTOR_FALLBACK_WORKERS", str(NAVER_WORKERS)))
+    rps = float(os.environ.get("INVESTOR_FALLBACK_RPS", str(NAVER_RPS)))
     try:
-        result = subprocess.run(
-            cmd,
-            check=True,
-            capture_output=True,
-            text=True,
-            encoding="utf-8",
-            errors="replace",
-        )
-        tail = ""
-        if result.stdout:
-            lines = [ln for ln in result.stdout.splitlines() if ln.strip()]
-            if lines:
-                tail = lines[-1]
-        return True, tail or "fallback_ok"
+        rows, stats = collect_naver_investor_rows(codes, start_dt, target, max_pages, workers=workers, rps=rps)
+        upserted = 0
+        for i in range(0, len(rows), 500):
+            batch = rows[i:i + 500]
+            try:
+                supabase.table("investor_daily").upsert(batch, on_conflict="date,ticker").execute()
+                upserted += len(batch)
+            except Exception as e:
+                print(f"  fallback investor_daily 저장 에러: {e}")
+        note = (f"success_codes={stats['success_codes']} fail_codes={stats['fail_codes']} "
+                f"pages={stats['pages']} rows={stats['rows']} upserted={upserted}")
+        return True, note
     except Exception as e:
         return False, str(e)
 
 
+@traced()
 def fetch_investor_data(supabase: Client, trading_date: str) -> dict:
     """KIS Open API로 투자자 수급 수집 → investor_daily 저장.
 
@@ -261,64 +411,24 @@ def fetch_investor_data(supabase: Client, trading_date: str) -> dict:
         return status
 
     print(f"  대상 종목: {len(codes)}개")
-
-    rows: list[dict] = []
-    success = fail = token_err = 0
-    fail_reason_count: dict[str, int] = {}
-    fail_reason_samples: list[str] = []
-
-    for idx, code in enumerate(codes):
-        if idx % 100 == 0 and idx > 0:
-            print(f"  -> {idx}/{len(codes)} (success={success}, fail={fail})")
-
-        result, fail_reason = _fetch_stock_investor(app_key, app_secret, token, code)
-
-        if result is None:
-            fail += 1
-            if fail_reason:
-                fail_reason_count[fail_reason] = fail_reason_count.get(fail_reason, 0) + 1
-                if len(fail_reason_samples) < 5:
-                    fail_reason_samples.append(f"{code}: {fail_reason}")
-                if len(fail_reason_samples) == 1:
-                    print(f"  [DEBUG] first KIS fail: {fail_reason_samples[0]}")
-            # 토큰 만료 감지: 연속 실패 50개면 토큰 재발급 시도
-            token_err += 1
-            if token_err >= 50 and success == 0:
-                print("  -> 연속 실패, 토큰 재발급 시도...")
-                # 캐시 삭제 후 재발급
-                cache_path = os.path.join(os.path.dirname(__file__), "_kis_token_cache.json")
-                try:
-                    os.remove(cache_path)
-                except Exception:
-                    pass
-                global _token_cache
-                _token_cache = {}
-                time.sleep(65)  # 1분 대기 (KIS 1분 1회 제한)
-                token = _get_kis_token(app_key, app_secret)
-                if not token:
-                    print("  -> 재발급 실패, 중단")
-                    break
-                token_err = 0
-            max_initial_fail = int(os.environ.get("INVESTOR_KIS_MAX_INITIAL_FAIL", "40"))
-            if success == 0 and fail >= max_initial_fail:
-                print(f"  -> 초기 구간 연속 실패({fail}건)로 KIS 수집을 조기 중단합니다.")
-                break
-        else:
-            token_err = 0
-            success += 1
-            rows.append({
-                "date": result["date"],
-                "ticker": code,
-                "institution": result["institution"],
-                "institution_amount": result["institution"],
-                "foreign": result["foreign"],
-                "foreign_amount": result["foreign"],
-                "personal": result["personal"],
-                "personal_amount": result["personal"],
-            })
-
-        time.sleep(0.12)  # ~8 req/sec (KIS 제한 여유있게)
-
+    status["target_count"] = len(codes)
+
+    collector = KisInvestorCollector(app_key, app_secret, token)
+    started = time.perf_counter()
+    rows = collector.collect(codes)
+    elapsed = time.perf_counter() - started
+    counters = collector.counters
+    success, fail = counters["success"], counters["fail"]
+    fail_reason_count = collector.fail_reason_count
+    fail_reason_samples = collector.fail_reason_samples
+
+    status["kis"] = {
+        **counters,
+        "workers": collector.workers,
+        "rps_limit": collector.limiter.rate,
+        "elapsed_sec": round(elapsed, 2),
+        "effective_rps": round(counters["requests"] / elapsed, 2) if elapsed > 0 else None,
+    }
     print(f"  -> 수집 완료: success={success}, fail={fail}")
     status["success_count"] = success
     status["fail_count"] = fail
@@ -337,7 +447,7 @@ def fetch_investor_data(supabase: Client, trading_date: str) -> dict:
         fallback_enabled = os.environ.get("INVESTOR_ENABLE_NAVER_FALLBACK", "true").lower() in ("1", "true", "yes")
         if fallback_enabled:
             print("  -> Naver fallback 실행...")
-            fb_ok, fb_note = _run_naver_fallback(trading_iso)
+            fb_ok, fb_note = _run_naver_fallback(supabase, trading_iso, codes)
             print(f"  -> fallback result: ok={fb_ok} note={fb_note}")
             if fb_ok:
                 try:
@@ -397,3 +507,101 @@ def fetch_investor_data(supabase: Client, trading_date: str) -> dict:
 
     status["ok"] = True
     return status
+
+
+FLOW_PAGE_SIZE = 1000
+
+
+def _paged_rpc(supabase: Client, fn: str, params: dict, order: str) -> list:
+    rows: list = []
+    offset = 0
+    while True:
+        page = supabase.rpc(fn, params).order(order) \
+            .range(offset, offset + FLOW_PAGE_SIZE - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < FLOW_PAGE_SIZE:
+            return rows
+        offset += FLOW_PAGE_SIZE
+
+
+def _raw_flow_rows(supabase: Client, start_iso: str, end_iso: str) -> list:
+    """investor_daily rows in [start, end] for DBs without migration 017."""
+    rows: list = []
+    offset = 0
+    while True:
+        page = supabase.table("investor_daily") \
+            .select("ticker, date, institution_amount, foreign_amount") \
+            .gte("date", start_iso).lte("date", end_iso) \
+            .order("ticker").order("date") \
+            .range(offset, offset + FLOW_PAGE_SIZE - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < FLOW_PAGE_SIZE:
+            return rows
+        offset += FLOW_PAGE_SIZE
+
+
+@traced()
+def investor_flow_sums(supabase: Client, start_iso: str, end_iso: str,
+                       tickers: Optional[list] = None) -> dict:
+    """Per-ticker institution/foreign net-buy sums over [start, end].
+
+    Returns {ticker: {"institution": int, "foreign": int}}. Uses the
+    investor_flow_sums() SQL function and falls back to summing raw rows
+    when the function does not exist yet.
+    """
+    params = {"p_start": start_iso, "p_end": end_iso, "p_tickers": tickers}
+    try:
+        rows = _paged_rpc(supabase, "investor_flow_sums", params, "ticker")
+        return {
+            r["ticker"]: {"institution": safe_int(r.get("institution_sum")),
+                          "foreign": safe_int(r.get("foreign_sum"))}
+            for r in rows
+        }
+    except Exception as e:
+        print(f"   investor_flow_sums rpc unavailable, summing rows: {e}")
+
+    wanted = set(tickers) if tickers is not None else None
+    sums: dict = {}
+    for r in _raw_flow_rows(supabase, start_iso, end_iso):
+        t = r["ticker"]
+        if wanted is not None and t not in wanted:
+            continue
+        acc = sums.setdefault(t, {"institution": 0, "foreign": 0})
+        acc["institution"] += safe_int(r.get("institution_amount"))
+        acc["foreign"] += safe_int(r.get("foreign_amount"))
+    return sums
+
+
+@traced()
+def sector_investor_flow_sums(supabase: Client, start_iso: str, end_iso: str) -> dict:
+    """Per-sector institution/foreign net-buy sums over [start, end].
+
+    Only active stocks with a sector count. Returns
+    {sector_id: {"institution": int, "foreign": int}}.
+    """
+    try:
+        rows = _paged_rpc(supabase, "sector_investor_flow_sums",
+                          {"p_start": start_iso, "p_end": end_iso}, "sector_id")
+        return {
+            r["sector_id"]: {"institution": safe_int(r.get("institution_sum")),
+                             "foreign": safe_int(r.get("foreign_sum"))}
+            for r in rows
+        }
+    except Exception as e:
+        print(f"   sector_investor_flow_sums rpc unavailable, summing rows: {e}")
+
+    stocks_res = supabase.table("stocks") \
+        .select("code, sector_id") \
+        .not_.is_("sector_id", "null") \
+        .eq("is_active", True).execute()
+    code_to_sector = {r["code"]: r["sector_id"] for r in (stocks_res.data or [])}
+
+    sums: dict = {}
+    for r in _raw_flow_rows(supabase, start_iso, end_iso):
+        sid = code_to_sector.get(r["ticker"])
+        if not sid:
+            continue
+        acc = sums.setdefault(sid, {"institution": 0, "foreign": 0})
+        acc["institution"] += safe_int(r.get("institution_amount"))
+        acc["foreign"] += safe_int(r.get("foreign_amount"))
+    return sums
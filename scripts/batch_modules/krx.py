@@ -0,0 +1,286 @@
+"""
+batch_modules/krx.py
+===================
+Shared data.krx.co.kr client for the credit/short collectors
+- one warmed-up, pooled session per process
+- finder_stkisu ISIN map cached on disk (.cache/krx) with a TTL
+- every POST goes through one TokenBucket; LOGOUT / 4xx responses halve the
+  rate (adaptive backoff) and successes slowly restore it
+- per-code short-volume / short-balance queries run concurrently
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .instrument import bind, response_bytes, span
+from .ratelimit import TokenBucket
+
+
+KRX_MAIN_PAGE = "https://data.krx.co.kr/"
+KRX_API_URL = "https://data.krx.co.kr/comm/bldAttendant/getJsonData.cmd"
+KRX_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+KRX_HEADERS = {
+    "User-Agent": KRX_UA,
+    "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+    "X-Requested-With": "XMLHttpRequest",
+    "Referer": "https://data.krx.co.kr/",
+}
+ISIN_CACHE_FILE = "isin_map.json"
+
+KRX_RPS = float(os.environ.get("KRX_RPS", "5"))
+KRX_WORKERS = int(os.environ.get("KRX_WORKERS", "4"))
+KRX_ISIN_TTL_HOURS = float(os.environ.get("KRX_ISIN_TTL_HOURS", "24"))
+KRX_MIN_RPS = 0.5
+KRX_BLOCK_LIMIT = 3        # consecutive blocked backoff rounds before giving up
+KRX_RECOVER_EVERY = 50     # successes between rate increases
+
+_client: Optional["KrxClient"] = None
+_client_lock = threading.Lock()
+
+
+def build_isin_fallback(code6: str) -> str:
+    """Fallback ISIN pattern used by KRX endpoints for stock code lookup."""
+    return f"KR7{str(code6).zfill(6)}0003"
+
+
+def isin_cache_path() -> Path:
+    default = Path(__file__).resolve().parents[2] / ".cache" / "krx"
+    return Path(os.environ.get("KRX_CACHE_DIR") or default) / ISIN_CACHE_FILE
+
+
+def _to_int(value) -> int:
+    return int(str(value or "0").replace(",", "") or "0")
+
+
+class KrxClient:
+    """Rate-limited data.krx.co.kr client shared by all KRX collectors."""
+
+    def __init__(self, rps: float = KRX_RPS, workers: int = KRX_WORKERS):
+        self.workers = max(1, workers)
+        self.base_rate = max(rps, KRX_MIN_RPS)
+        self.limiter = TokenBucket(self.base_rate)
+        self.session = self._new_session()
+        self.blocked = False
+        self._isin_map: Optional[dict] = None
+        self._lock = threading.Lock()
+        self._block_streak = 0
+        self._since_backoff = 0
+        self._epoch = 0            # bumped on every backoff
+        self.counters = {"requests": 0, "errors": 0, "blocked_responses": 0, "backoffs": 0}
+
+    def _new_session(self) -> requests.Session:
+        sess = requests.Session()
+        sess.headers.update(KRX_HEADERS)
+        sess.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=self.workers * 2))
+        try:
+            sess.get(KRX_MAIN_PAGE, timeout=10)
+        except Exception:
+            pass
+        return sess
+
+    def _on_blocked(self, epoch: int):
+        """Back off once per round: responses to requests sent before the last
+        backoff (other workers in flight) are counted but do not extend the streak."""
+        with self._lock:
+            self.counters["blocked_responses"] += 1
+            streak = self._block_streak
+            stale = epoch != self._epoch
+            if not stale:
+                self._epoch += 1
+                self.counters["backoffs"] += 1
+                self._block_streak += 1
+                self._since_backoff = 0
+                new_rate = max(KRX_MIN_RPS, self.limiter.rate / 2)
+                self.limiter.set_rate(new_rate)
+                streak = self._block_streak
+                if streak >= KRX_BLOCK_LIMIT and not self.blocked:
+                    self.blocked = True
+                    print("  [BLOCKED] KRX API 차단됨 (LOGOUT 연속) — KRX 수집 중단")
+        if not stale and streak == 1:
+            print(f"  [KRX] 차단 응답 감지 → {new_rate:.2f} req/s 로 감속, 세션 재발급")
+            self.session = self._new_session()
+        time.sleep(min(10.0, 2.0 * max(1, streak)))
+
+    def _on_success(self):
+        with self._lock:
+            self._block_streak = 0
+            self._since_backoff += 1
+            if self._since_backoff >= KRX_RECOVER_EVERY and self.limiter.rate < self.base_rate:
+                self.limiter.set_rate(min(self.base_rate, self.limiter.rate * 1.25))
+                self._since_backoff = 0
+
+    def post(self, form: dict, timeout: int = 10, retries: int = 3) -> tuple[Optional[dict], bool]:
+        """POST a getJsonData form. Returns (json, ok); never raises."""
+        for attempt in range(1, retries + 1):
+            if self.blocked:
+                return None, False
+            self.limiter.acquire()
+            with self._lock:
+                self.counters["requests"] += 1
+                epoch = self._epoch
+            try:
+                with span("krx.post", requests=1, retries=int(attempt > 1)) as sp:
+                    r = self.session.post(KRX_API_URL, data=form, timeout=timeout)
+                    sp.add("bytes", response_bytes(r))
+                    blocked = "LOGOUT" in r.text[:300] or r.status_code in (400, 401, 403, 429)
+                    if blocked:
+                        sp.add("blocked")
+                    else:
+                        r.raise_for_status()
+                        data = r.json()
+                if blocked:
+                    self._on_blocked(epoch)
+                    continue
+                self._on_success()
+                return data, True
+            except Exception:
+                with self._lock:
+                    self.counters["errors"] += 1
+                if attempt < retries:
+                    time.sleep(0.2 * attempt)
+        return None, False
+
+    # ── ISIN map ──
+
+    def isin_map(self, refresh: bool = False) -> dict:
+        """short_code → full ISIN from finder_stkisu, cached on disk for KRX_ISIN_TTL_HOURS."""
+        if self._isin_map is not None and not refresh:
+            return self._isin_map
+        path = isin_cache_path()
+        if not refresh:
+            try:
+                with path.open("r", encoding="utf-8") as f:
+                    cached = json.load(f)
+                age_h = (time.time() - float(cached.get("fetched_at", 0))) / 3600
+                if age_h < KRX_ISIN_TTL_HOURS and cached.get("map"):
+                    self._isin_map = cached["map"]
+                    return self._isin_map
+            except Exception:
+                pass
+
+        payload, ok = self.post(
+            {"bld": "dbms/comm/finder/finder_stkisu", "mktsel": "ALL", "typeNo": "0",
+             "pagePath": "/contents/MDC/STAT/srt/MDCSTAT300.cmd", "codeNm": ""},
+            timeout=30,
+        )
+        block = (payload or {}).get("block1", []) if ok else []
+        mapping = {item["short_code"]: item["full_code"] for item in block
+                   if item.get("short_code") and item.get("full_code")}
+        if not mapping:
+            print("  ISIN 매핑 조회 실패")
+            self._isin_map = {}
+            return self._isin_map
+
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            with tmp.open("w", encoding="utf-8") as f:
+                json.dump({"fetched_at": time.time(), "written_at": datetime.now().isoformat(), "map": mapping}, f)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"  ISIN 매핑 캐시 저장 실패: {e}")
+        self._isin_map = mapping
+        return mapping
+
+    def resolve_isin(self, code6: str) -> tuple[str, bool]:
+        """(ISIN, from_map). Falls back to the KR7xxxxxx0003 pattern."""
+        isin = self.isin_map().get(code6)
+        if isin:
+            return isin, True
+        return build_isin_fallback(code6), False
+
+    # ── short selling queries ──
+
+    def fetch_short_trade(self, isin: str, start_date: str, end_date: str, retries: int = 3) -> tuple[dict, bool]:
+        """MDCSTAT30102_OUT → ({YYYYMMDD: {"short_volume"}}, ok)."""
+        payload, ok = self.post(
+            {"bld": "dbms/MDC_OUT/STAT/srt/MDCSTAT30102_OUT", "isuCd": isin, "strtDd": start_date,
+             "endDd": end_date, "money": "1", "csvxls_isNo": "false"},
+            retries=retries,
+        )
+        result = {}
+        for row in (payload or {}).get("OutBlock_1", []) if ok else []:
+            date_str = row.get("TRD_DD", "").replace("/", "")
+            if len(date_str) != 8:
+                continue
+            try:
+                result[date_str] = {"short_volume": _to_int(row.get("CVSRTSELL_TRDVOL"))}
+            except (ValueError, TypeError):
+                pass
+        return result, ok
+
+    def fetch_short_balance(self, isin: str, start_date: str, end_date: str, retries: int = 3) -> tuple[dict, bool]:
+        """MDCSTAT30502_OUT → ({YYYYMMDD: {"short_balance", "short_ratio"}}, ok).
+
+        Reporting-duty based, so only some dates may be present.
+        """
+        payload, ok = self.post(
+            {"bld": "dbms/MDC_OUT/STAT/srt/MDCSTAT30502_OUT", "isuCd": isin, "strtDd": start_date,
+             "endDd": end_date, "money": "1", "csvxls_isNo": "false"},
+            retries=retries,
+        )
+        result = {}
+        for row in (payload or {}).get("OutBlock_1", []) if ok else []:
+            date_str = row.get("RPT_DUTY_OCCR_DD", "").replace("/", "")
+            if len(date_str) != 8:
+                continue
+            try:
+                ratio = row.get("BAL_RT") or row.get("STCK_BAL_RT") or row.get("SLVL_RT") or "0"
+                result[date_str] = {
+                    "short_balance": _to_int(row.get("BAL_QTY")),
+                    "short_ratio": float(str(ratio).replace(",", "") or "0"),
+                }
+            except (ValueError, TypeError):
+                pass
+        return result, ok
+
+    def fetch_short_many(self, codes: list[str], start_date: str, end_date: str,
+                         retries: int = 3, progress_every: int = 200) -> dict:
+        """Run both short queries for every code concurrently.
+
+        Returns {code: {"isin_from_map", "trade", "trade_ok", "balance", "balance_ok"}}.
+        """
+        results: dict = {}
+        for code in codes:
+            isin, from_map = self.resolve_isin(code)
+            results[code] = {"isin": isin, "isin_from_map": from_map}
+
+        tasks = [(code, kind) for code in codes for kind in ("trade", "balance")]
+        done = {"n": 0}
+        lock = threading.Lock()
+
+        def work(task):
+            code, kind = task
+            fetch = self.fetch_short_trade if kind == "trade" else self.fetch_short_balance
+            data, ok = fetch(results[code]["isin"], start_date, end_date, retries=retries)
+            with lock:
+                results[code][kind] = data
+                results[code][f"{kind}_ok"] = ok
+                done["n"] += 1
+                if progress_every and done["n"] % (progress_every * 2) == 0:
+                    print(f"  progress: {done['n'] // 2}/{len(codes)} codes")
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="krx") as pool:
+            list(pool.map(bind(work), tasks))
+        return results
+
+    def status(self) -> dict:
+        return {**self.counters, "blocked": self.blocked, "rps": round(self.limiter.rate, 2)}
+
+
+def get_krx_client() -> KrxClient:
+    """Process-wide client so the rate limit and block state are global."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = KrxClient()
+        return _client
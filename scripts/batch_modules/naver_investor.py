@@ -0,0 +1,214 @@
+"""
+batch_modules/naver_investor.py
+==============================
+Naver Finance (item/frgn) investor-flow scraper
+- used by backfill_investor_daily.py and, in-process, as the KIS fallback
+- only <table> elements are parsed (bs4 html.parser, no lxml needed) and
+  only the 날짜/기관/외국인 순매매 table is read
+- per-code paging stops once a page reaches dates before the start
+- codes run concurrently over one pooled session under a shared TokenBucket
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Optional
+
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+
+from .instrument import bind, response_bytes, span
+from .ratelimit import TokenBucket
+
+
+NAVER_FRGN_URL = "https://finance.naver.com/item/frgn.naver"
+NAVER_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Referer": "https://finance.naver.com/",
+    "Accept-Language": "ko-KR,ko;q=0.9,en-US;q=0.8,en;q=0.7",
+}
+NAVER_WORKERS = 8
+NAVER_RPS = 10.0
+NAVER_TIMEOUT = 8
+
+
+def parse_signed_int(value) -> int:
+    s = str(value or "").strip()
+    if not s or s.lower() == "nan":
+        return 0
+    s = s.replace(",", "").replace("\u2212", "-")
+    s = "".join(ch for ch in s if ch.isdigit() or ch in ("-", "+"))
+    if not s or s in ("-", "+"):
+        return 0
+    try:
+        return int(s)
+    except Exception:
+        return 0
+
+
+def _parse_dot_date(raw: str) -> Optional[date]:
+    try:
+        return datetime.strptime(raw.strip().replace(".", "-").replace(" ", ""), "%Y-%m-%d").date()
+    except Exception:
+        return None
+
+
+_TABLES = SoupStrainer("table")
+
+
+def _group_columns(header_row) -> dict[str, int]:
+    """First column of each top-level header group (기관 / 외국인 span sub-columns)."""
+    out: dict[str, int] = {}
+    col = 0
+    for cell in header_row.find_all(["th", "td"], recursive=False):
+        out.setdefault(cell.get_text(strip=True), col)
+        col += int(cell.get("colspan") or 1)
+    return out
+
+
+def extract_frgn_rows(html: str, start_dt: date, end_dt: date, code: str) -> tuple[list[dict], Optional[date]]:
+    """investor rows in [start, end] from one frgn page, plus the page's oldest date.
+
+    Only the 날짜/기관/외국인 순매매 table is used; in it the net-buy volume is
+    the first sub-column under both the 기관 and 외국인 headers.
+    """
+    rows: list[dict] = []
+    earliest: Optional[date] = None
+    soup = BeautifulSoup(html, "html.parser", parse_only=_TABLES)
+    for table in soup.find_all("table"):
+        text = table.get_text()
+        if "날짜" not in text or "순매매" not in text:
+            continue
+        header = next((tr for tr in table.find_all("tr") if tr.find("th")), None)
+        if header is None:
+            continue
+        groups = _group_columns(header)
+        date_idx = next((i for n, i in groups.items() if "날짜" in n), None)
+        inst_idx = next((i for n, i in groups.items() if "기관" in n), None)
+        foreign_idx = next((i for n, i in groups.items() if "외국인" in n), None)
+        if date_idx is None or inst_idx is None or foreign_idx is None:
+            continue
+
+        for tr in table.find_all("tr"):
+            if tr.find("th"):
+                continue
+            texts = [td.get_text(strip=True) for td in tr.find_all("td", recursive=False)]
+            if len(texts) <= max(date_idx, inst_idx, foreign_idx):
+                continue
+            row_dt = _parse_dot_date(texts[date_idx])
+            if row_dt is None:
+                continue
+            if earliest is None or row_dt < earliest:
+                earliest = row_dt
+            if row_dt < start_dt or row_dt > end_dt:
+                continue
+            institution = parse_signed_int(texts[inst_idx])
+            foreign = parse_signed_int(texts[foreign_idx])
+            if institution == 0 and foreign == 0:
+                continue
+            rows.append({
+                "date": row_dt.isoformat(),
+                "ticker": code,
+                "institution": institution,
+                "foreign": foreign,
+            })
+    return rows, earliest
+
+
+def make_session(pool_size: int = NAVER_WORKERS) -> requests.Session:
+    session = requests.Session()
+    session.headers.update(NAVER_HEADERS)
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size)))
+    return session
+
+
+def fetch_rows_for_code(
+    session: requests.Session,
+    code: str,
+    start_dt: date,
+    end_dt: date,
+    max_pages: int,
+    sleep_seconds: float = 0.0,
+    limiter: Optional[TokenBucket] = None,
+) -> tuple[list[dict], int]:
+    """Walk frgn pages newest-first until a page reaches before ``start_dt``.
+
+    Returns (rows, pages_fetched).
+    """
+    collected: dict[tuple[str, str], dict] = {}
+    pages = 0
+    for page in range(1, max_pages + 1):
+        if limiter is not None:
+            limiter.acquire()
+        with span("naver.frgn", requests=1) as sp:
+            resp = session.get(NAVER_FRGN_URL, params={"code": code, "page": page}, timeout=NAVER_TIMEOUT)
+            resp.raise_for_status()
+            sp.add("bytes", response_bytes(resp))
+        pages += 1
+        with span("naver.parse") as sp:
+            page_rows, earliest = extract_frgn_rows(resp.text, start_dt, end_dt, code)
+            sp.add("rows", len(page_rows))
+        for row in page_rows:
+            collected[(row["ticker"], row["date"])] = row
+
+        # no parsable dates (past the last page) or already older than the window
+        if earliest is None or earliest < start_dt:
+            break
+        if sleep_seconds > 0:
+            time.sleep(sleep_seconds)
+    return list(collected.values()), pages
+
+
+def collect_naver_investor_rows(
+    codes: list[str],
+    start_dt: date,
+    end_dt: date,
+    max_pages: int,
+    workers: int = NAVER_WORKERS,
+    rps: float = NAVER_RPS,
+    on_rows=None,
+) -> tuple[list[dict], dict]:
+    """Fetch many codes concurrently.
+
+    ``on_rows(rows)`` is called per successful code (e.g. to upsert as it
+    goes); rows are also returned unless a callback is given. Returns
+    (rows, stats) with success/fail code counts, pages and row totals.
+    """
+    session = make_session(workers)
+    limiter = TokenBucket(rps)
+    lock = threading.Lock()
+    stats = {"codes": len(codes), "success_codes": 0, "fail_codes": 0, "pages": 0, "rows": 0}
+    out: list[dict] = []
+
+    def work(code: str):
+        try:
+            rows, pages = fetch_rows_for_code(session, code, start_dt, end_dt, max(1, max_pages), limiter=limiter)
+        except Exception:
+            rows, pages = [], 0
+        with lock:
+            stats["pages"] += pages
+            if rows:
+                stats["success_codes"] += 1
+                stats["rows"] += len(rows)
+            else:
+                stats["fail_codes"] += 1
+            done = stats["success_codes"] + stats["fail_codes"]
+            if done % 100 == 0:
+                print(f"  progress {done}/{len(codes)} success={stats['success_codes']} "
+                      f"fail={stats['fail_codes']} rows={stats['rows']}")
+            if rows and on_rows is None:
+                out.extend(rows)
+        if rows and on_rows is not None:
+            on_rows(rows)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="naver-investor") as pool:
+            list(pool.map(bind(work), codes))
+    finally:
+        session.close()
+    return out, stats
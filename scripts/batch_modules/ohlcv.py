@@ -4,18 +4,189 @@ batch_modules/ohlcv.py
 STEP 1: DB ?? ?? OHLCV ??
 """
 
-import time
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, date
 from typing import Optional
+import numpy as np
+import pandas as pd
 from supabase import Client
 from pykrx import stock
-from .utils import safe_float, safe_int, to_iso
+from .utils import safe_int, to_iso
+from .ohlcv_cache import stage_fresh_rows, invalidate_tickers
+from .instrument import bind, traced
+from .calendar import get_calendar
+from .ratelimit import TokenBucket, call_with_retry
 
 
+# Upstream throughput knobs (overridable via env)
+OHLCV_FETCH_WORKERS = 4
+OHLCV_FETCH_RPS = 6.0
+OHLCV_FETCH_TIMEOUT = 20.0
+OHLCV_FETCH_ATTEMPTS = 3
+
+# pykrx column names -> stock_daily columns
+OHLCV_COLUMN_MAP = {
+    "시가": "open",
+    "고가": "high",
+    "저가": "low",
+    "종가": "close",
+    "거래량": "volume",
+    "거래대금": "value",
+}
+
+# Date-major mode: whole-market snapshots when the gap is short
+OHLCV_SNAPSHOT_MAX_DAYS = 10
+SNAPSHOT_MARKETS = ("KOSPI", "KOSDAQ")
+
+
+def _numeric_column(frame: pd.DataFrame, col: str) -> pd.Series:
+    """Column as float, tolerating comma strings; missing/inf -> NaN."""
+    if col not in frame.columns:
+        return pd.Series(np.nan, index=frame.index)
+    values = frame[col]
+    if values.dtype == object:
+        values = values.astype(str).str.replace(",", "", regex=False).str.strip()
+    return pd.to_numeric(values, errors="coerce").replace([np.inf, -np.inf], np.nan)
+
+
+def ohlcv_rows_from_frame(code: str, df: pd.DataFrame) -> list[dict]:
+    """Convert a pykrx OHLCV frame (date index, Korean columns) to stock_daily rows.
+
+    Works column-wise (no iterrows): prices/volume are truncated to int like
+    safe_int, zero-volume rows are dropped and a missing or zero 거래대금
+    falls back to volume * close.
+    """
+    if df is None or df.empty:
+        return []
+
+    frame = pd.DataFrame(
+        {col: _numeric_column(df, src) for src, col in OHLCV_COLUMN_MAP.items()},
+        index=df.index,
+    )
+    ints = ["open", "high", "low", "close", "volume"]
+    frame[ints] = np.trunc(frame[ints].fillna(0)).astype("int64")
+    frame = frame[frame["volume"] > 0]
+    if frame.empty:
+        return []
+
+    fallback = (frame["volume"] * frame["close"]).astype(float)
+    frame["value"] = frame["value"].where(frame["value"].notna() & (frame["value"] != 0), fallback)
+    index = frame.index
+    if isinstance(index, pd.DatetimeIndex):
+        dates = index.strftime("%Y-%m-%d")
+    else:
+        dates = index.astype(str).str[:10]
+    frame.insert(0, "date", dates)
+    frame.insert(0, "ticker", code)
+    return frame.to_dict("records")
+
+
+def _ticker_rows(code: str, df):
+    """Split-adjust one ticker's pykrx frame and build stock_daily rows.
+
+    Returns (rows | None when empty, split_events).
+    """
+    from _price_adjustment import adjust_ohlcv_for_splits
+
+    if df is None or df.empty:
+        return None, []
+
+    df, split_events = adjust_ohlcv_for_splits(df)
+    return ohlcv_rows_from_frame(code, df), split_events
+
+
+def _fetch_ticker_rows(code: str, from_str: str, trading_date: str, limiter: TokenBucket):
+    """Fetch one ticker's OHLCV range and build stock_daily rows.
+
+    Returns (rows | None when empty, split_events, retries).
+    """
+    df, retries = call_with_retry(
+        lambda: stock.get_market_ohlcv(from_str, trading_date, code),
+        limiter=limiter,
+        label="pykrx.ohlcv_ticker",
+        attempts=OHLCV_FETCH_ATTEMPTS,
+        wait=0.3,
+        timeout=float(os.environ.get("OHLCV_FETCH_TIMEOUT", OHLCV_FETCH_TIMEOUT)),
+    )
+    rows, split_events = _ticker_rows(code, df)
+    return rows, split_events, retries
+
+
+def _weekdays(from_str: str, to_str: str) -> list:
+    start = datetime.strptime(from_str, "%Y%m%d").date()
+    end = datetime.strptime(to_str, "%Y%m%d").date()
+    days = (start + timedelta(days=i) for i in range((end - start).days + 1))
+    return [d.strftime("%Y%m%d") for d in days if d.weekday() < 5]
+
+
+def snapshot_dates(from_str: str, to_str: str) -> list:
+    """Dates to snapshot in [from_str, to_str] (YYYYMMDD).
+
+    KRX sessions from the trading calendar; weekdays past its covered range
+    (or when the calendar is unavailable), since those may still be sessions.
+    """
+    try:
+        cal = get_calendar()
+    except Exception as e:
+        print(f"   trading calendar unavailable, snapshotting weekdays: {e}")
+        return _weekdays(from_str, to_str)
+    days = set(cal.trading_days_between(from_str, to_str))
+    days.update(d for d in _weekdays(from_str, to_str) if d > cal.covered_through)
+    return sorted(days)
+
+
+def fetch_market_snapshots(
+    from_str: str,
+    to_str: str,
+    codes,
+    limiter: Optional[TokenBucket] = None,
+) -> dict:
+    """Collect whole-market OHLCV snapshots per date and regroup them per ticker.
+
+    One pykrx call per (date, market) instead of one per ticker. Returns
+    {code: frame} in the per-ticker API layout (date index, Korean columns),
+    restricted to ``codes``. Raises if a snapshot call keeps failing so the
+    caller can fall back to per-ticker mode.
+    """
+    wanted = set(codes)
+    frames = []
+    for day_str in snapshot_dates(from_str, to_str):
+        for market in SNAPSHOT_MARKETS:
+            df, _ = call_with_retry(
+                lambda d=day_str, m=market: stock.get_market_ohlcv(d, market=m),
+                limiter=limiter,
+                label="pykrx.ohlcv_snapshot",
+                attempts=OHLCV_FETCH_ATTEMPTS,
+                wait=0.5,
+                timeout=float(os.environ.get("OHLCV_FETCH_TIMEOUT", OHLCV_FETCH_TIMEOUT)),
+            )
+            if df is None or df.empty:
+                continue
+            df = df[df.index.astype(str).isin(wanted)]
+            if df.empty:
+                continue
+            frames.append(df.rename_axis("티커").reset_index().assign(날짜=pd.Timestamp(day_str)))
+
+    if not frames:
+        return {}
+    merged = pd.concat(frames, ignore_index=True)
+    merged["티커"] = merged["티커"].astype(str)
+    return {
+        code: group.drop(columns="티커").set_index("날짜").sort_index()
+        for code, group in merged.groupby("티커", sort=False)
+    }
+
+
+@traced()
 def fetch_ohlcv_per_ticker(supabase: Client, trading_date: str) -> bool:
-    """Fetch OHLCV for core/extended universe using per-ticker API."""
+    """Fetch OHLCV for core/extended universe.
+
+    Short gaps (<= OHLCV_SNAPSHOT_MAX_DAYS weekdays) use whole-market
+    snapshots per date; longer ranges use the per-ticker API.
+    """
     trading_iso = to_iso(trading_date)
-    print(f"\n[1/7] OHLCV collection (per-ticker API, target: {trading_date})...")
+    print(f"\n[1/7] OHLCV collection (target: {trading_date})...")
 
     # Current latest stock_daily date in DB
     latest_res = supabase.table("stock_daily") \
@@ -69,60 +240,77 @@ def fetch_ohlcv_per_ticker(supabase: Client, trading_date: str) -> bool:
 
     success = 0
     fail = 0
+    retries = 0
     upsert_buffer: list = []
     date_range_found = set()
+    split_codes: list = []
 
-    for idx, (code, name) in enumerate(tickers):
-        if idx % 50 == 0 and idx > 0:
-            print(f"  -> Progress: {idx}/{len(tickers)} (success: {success}, fail: {fail})")
+    def _collect(done: int, code: str, name: str, result):
+        nonlocal success, fail, retries, upsert_buffer
+        if isinstance(result, Exception):
+            fail += 1
+            if fail <= 5:
+                print(f"     {code} ({name}): {result}")
+            return
+        rows, split_events, ticker_retries = result
+        retries += ticker_retries
+        if split_events:
+            print(f"    ? {code} split-adjust: {', '.join(split_events[:2])}")
+            split_codes.append(code)
+        if rows is not None:
+            success += 1
+            upsert_buffer.extend(rows)
+            date_range_found.update(r["date"] for r in rows)
+        if done % 50 == 0:
+            print(f"  -> Progress: {done}/{len(tickers)} (success: {success}, fail: {fail})")
             if upsert_buffer:
                 _flush_stock_daily(supabase, upsert_buffer)
                 upsert_buffer = []
 
+    limiter = TokenBucket(float(os.environ.get("OHLCV_FETCH_RPS", OHLCV_FETCH_RPS)))
+    snapshot_days = len(snapshot_dates(from_str, trading_date))
+    max_snapshot_days = int(os.environ.get("OHLCV_SNAPSHOT_MAX_DAYS", OHLCV_SNAPSHOT_MAX_DAYS))
+    snapshots = None
+    if snapshot_days <= max_snapshot_days:
         try:
-            from _price_adjustment import adjust_ohlcv_for_splits
-            df = stock.get_market_ohlcv(from_str, trading_date, code)
-            if df.empty:
-                continue
-
-            df, split_events = adjust_ohlcv_for_splits(df)
-            if split_events:
-                print(f"    ? {code} split-adjust: {', '.join(split_events[:2])}")
-
-            for dt_idx, row in df.iterrows():
-                vol = safe_int(row.get("거래량", 0))
-                if vol == 0:
-                    continue
-                dt_str = dt_idx.strftime("%Y-%m-%d") if hasattr(dt_idx, "strftime") else str(dt_idx)[:10]
-                date_range_found.add(dt_str)
-                close_val = safe_int(row.get("종가"))
-                value = row.get("거래대금")
-                if value == 0 or value == '' or (hasattr(value, '__iter__') and len(str(value)) == 0):
-                    value = vol * close_val
-                upsert_buffer.append({
-                    "ticker": code,
-                    "date": dt_str,
-                    "open": safe_int(row.get("시가")),
-                    "high": safe_int(row.get("고가")),
-                    "low": safe_int(row.get("저가")),
-                    "close": close_val,
-                    "volume": vol,
-                    "value": safe_float(value),
-                })
-
-            success += 1
-            time.sleep(0.15)
-
+            snapshots = fetch_market_snapshots(from_str, trading_date, [code for code, _ in tickers], limiter)
+            print(f"  Snapshot mode: {snapshot_days} day(s) x {len(SNAPSHOT_MARKETS)} markets, "
+                  f"{len(snapshots)} tickers matched")
         except Exception as e:
-            fail += 1
-            if fail <= 5:
-                print(f"     {code} ({name}): {e}")
-            time.sleep(0.3)
+            print(f"   Snapshot fetch failed ({e}), falling back to per-ticker mode")
+            snapshots = None
+
+    if snapshots is not None:
+        for done, (code, name) in enumerate(tickers, start=1):
+            try:
+                rows, split_events = _ticker_rows(code, snapshots.get(code))
+                result = (rows, split_events, 0)
+            except Exception as e:
+                result = e
+            _collect(done, code, name, result)
+    else:
+        workers = max(1, int(os.environ.get("OHLCV_FETCH_WORKERS", OHLCV_FETCH_WORKERS)))
+        print(f"  Per-ticker mode: {workers} workers, {limiter.rate:g} req/s")
+        fetch_rows = bind(_fetch_ticker_rows)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ohlcv") as pool:
+            futures = {
+                pool.submit(fetch_rows, code, from_str, trading_date, limiter): (code, name)
+                for code, name in tickers
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                code, name = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = e
+                _collect(done, code, name, result)
 
     if upsert_buffer:
         _flush_stock_daily(supabase, upsert_buffer)
 
-    print(f"   OHLCV collection done: {success} success, {fail} fail")
+    print(f"   OHLCV collection done: {success} success, {fail} fail, {retries} retries")
+    if split_codes:
+        invalidate_tickers(split_codes)
     
     if date_range_found:
         min_date = min(date_range_found)
@@ -160,6 +348,7 @@ def _flush_stock_daily(supabase: Client, rows: list):
                     sub_batch_fail += 1
     if sub_batch_fail > 0:
         print(f"     [WARN] stock_daily sub-batch upsert failures: {sub_batch_fail}")
+    stage_fresh_rows(rows)
 
 
 def _update_stocks_close(supabase: Client, trading_date: str):
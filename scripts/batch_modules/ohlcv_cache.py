@@ -0,0 +1,341 @@
+"""
+batch_modules/ohlcv_cache.py
+===========================
+Local columnar stock_daily cache shared by all batch stages
+- one Arrow IPC file sorted by (ticker, date) + manifest.json with per-ticker
+  row offsets, so reads are memory-mapped and sliced without a scan
+- daily_batch refreshes it once per run from the freshly collected OHLCV plus
+  a delta read from Supabase; stages read it through panel.load_stock_daily_frame
+- freshness watermark (max_date) and invalidation for split-adjusted tickers
+  or re-backfilled date ranges
+- history rewritten outside the batch (manual split backfills, a restored CI
+  cache) is caught by a row-count check against stock_daily and by a cold
+  rebuild once the cache is older than OHLCV_CACHE_MAX_AGE_DAYS
+"""
+
+import json
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+from supabase import Client
+
+from .utils import safe_int, to_iso
+from .instrument import traced
+
+
+CACHE_COLUMNS = ("ticker", "date", "open", "high", "low", "close", "volume", "value")
+CACHE_LOOKBACK_DAYS = 420
+CACHE_MAX_AGE_DAYS = 7
+DATA_FILE = "stock_daily.arrow"
+MANIFEST_FILE = "manifest.json"
+
+_staged_rows: list[dict] = []
+_active = False
+
+
+def cache_enabled() -> bool:
+    if os.environ.get("OHLCV_CACHE_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return False
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def cache_dir() -> Path:
+    default = Path(__file__).resolve().parents[2] / ".cache" / "ohlcv"
+    return Path(os.environ.get("OHLCV_CACHE_DIR") or default)
+
+
+def cache_max_age_days() -> int:
+    return safe_int(os.environ.get("OHLCV_CACHE_MAX_AGE_DAYS", CACHE_MAX_AGE_DAYS), CACHE_MAX_AGE_DAYS)
+
+
+def is_active() -> bool:
+    """True once the cache was refreshed in this process and may serve reads."""
+    return _active
+
+
+def activate_existing(watermark: Optional[str], rows: Optional[int] = None) -> bool:
+    """Serve reads from the cache on disk without refreshing it (daily_batch --resume).
+
+    Only when the manifest still matches the refresh being resumed.
+    """
+    global _active
+    manifest = load_manifest()
+    if not cache_enabled() or not watermark or manifest.get("max_date") != watermark:
+        return False
+    if rows is not None and manifest.get("rows") != rows:
+        return False
+    if not (cache_dir() / DATA_FILE).exists():
+        return False
+    _active = True
+    print(f"   ohlcv cache: reusing {manifest.get('rows', 0):,} rows, watermark {watermark}")
+    return True
+
+
+def load_manifest() -> dict:
+    try:
+        with (cache_dir() / MANIFEST_FILE).open("r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        return manifest if isinstance(manifest, dict) else {}
+    except Exception:
+        return {}
+
+
+def _save_manifest(manifest: dict):
+    path = cache_dir() / MANIFEST_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def invalidate_tickers(tickers, reason: str = "split_adjusted"):
+    """Mark tickers whose stored history changed; the next refresh reloads them."""
+    tickers = sorted({str(t) for t in tickers if t})
+    if not tickers:
+        return
+    manifest = load_manifest()
+    pending = set(manifest.get("invalid_tickers") or [])
+    pending.update(tickers)
+    manifest["invalid_tickers"] = sorted(pending)
+    _save_manifest(manifest)
+    print(f"   ohlcv cache: invalidated {len(tickers)} ticker(s) ({reason})")
+
+
+def invalidate_range(start_iso: str, end_iso: str):
+    """Mark a date range rewritten outside the cache (e.g. gap backfill)."""
+    manifest = load_manifest()
+    ranges = list(manifest.get("invalid_ranges") or [])
+    ranges.append([start_iso, end_iso])
+    manifest["invalid_ranges"] = ranges
+    _save_manifest(manifest)
+
+
+def reset_cache(reason: str = "reset"):
+    """Drop the cache files so the next refresh is a cold build."""
+    global _active
+    for name in (DATA_FILE, MANIFEST_FILE):
+        (cache_dir() / name).unlink(missing_ok=True)
+    _staged_rows.clear()
+    _active = False
+    print(f"   ohlcv cache: cleared ({reason})")
+
+
+def stage_fresh_rows(rows: list):
+    """Keep rows just written to stock_daily so the refresh can reuse them."""
+    _staged_rows.extend(rows)
+
+
+def _read_table():
+    import pyarrow as pa
+
+    path = cache_dir() / DATA_FILE
+    if not path.exists():
+        return None
+    with pa.memory_map(str(path), "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def _write_table(df: pd.DataFrame) -> dict:
+    import pyarrow as pa
+
+    df = df.sort_values(["ticker", "date"]).reset_index(drop=True)
+    table = pa.Table.from_pandas(df[list(CACHE_COLUMNS)], preserve_index=False)
+    path = cache_dir() / DATA_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with pa.OSFile(str(tmp), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, path)
+
+    offsets: dict = {}
+    if len(df):
+        bounds = df.reset_index().groupby("ticker", sort=False)["index"].agg(["min", "count"])
+        offsets = {t: [int(r["min"]), int(r["count"])] for t, r in bounds.iterrows()}
+    return offsets
+
+
+def _normalize(rows_or_df) -> pd.DataFrame:
+    df = pd.DataFrame(rows_or_df) if not isinstance(rows_or_df, pd.DataFrame) else rows_or_df.copy()
+    if df.empty:
+        return pd.DataFrame(columns=list(CACHE_COLUMNS))
+    for col in CACHE_COLUMNS:
+        if col not in df.columns:
+            df[col] = None
+    df["ticker"] = df["ticker"].astype(str)
+    df["date"] = df["date"].astype(str).str[:10]
+    for col in CACHE_COLUMNS[2:]:
+        df[col] = pd.to_numeric(df[col], errors="coerce").astype(float)
+    return df[list(CACHE_COLUMNS)]
+
+
+def _fetch_dates(supabase: Client, start_iso: str, end_iso: Optional[str] = None, page_size: int = 1000) -> list:
+    """Page stock_daily by date range (all tickers)."""
+    rows: list = []
+    offset = 0
+    while True:
+        query = supabase.table("stock_daily").select(", ".join(CACHE_COLUMNS)).gte("date", start_iso)
+        if end_iso:
+            query = query.lte("date", end_iso)
+        res = query.order("date").order("ticker").range(offset, offset + page_size - 1).execute()
+        page = res.data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            break
+        offset += page_size
+    return rows
+
+
+def _remote_row_count(supabase: Client, start_iso: str) -> Optional[int]:
+    try:
+        res = supabase.table("stock_daily").select("ticker", count="exact").gte("date", start_iso).limit(1).execute()
+        return res.count
+    except Exception as e:
+        print(f"   ohlcv cache: stock_daily row count failed, skipping drift check: {e}")
+        return None
+
+
+def _is_expired(manifest: dict) -> bool:
+    max_age = cache_max_age_days()
+    if max_age <= 0:
+        return False
+    try:
+        built_at = datetime.fromisoformat(manifest["built_at"])
+    except (KeyError, TypeError, ValueError):
+        return True
+    return datetime.now() - built_at > timedelta(days=max_age)
+
+
+@traced()
+def refresh_ohlcv_cache(supabase: Client, trading_date: str, lookback_days: int = CACHE_LOOKBACK_DAYS) -> dict:
+    """Bring the cache up to date and activate it for this process.
+
+    Returns a status dict (ok, rows, watermark, delta_rows, reloaded_tickers).
+    """
+    global _active
+    from .panel import fetch_stock_daily_frame
+
+    status = {"ok": False, "rows": 0, "watermark": None, "delta_rows": 0, "reloaded_tickers": 0, "reason": ""}
+    if not cache_enabled():
+        status["reason"] = "disabled"
+        return status
+
+    trading_iso = to_iso(trading_date)
+    window_start = (datetime.strptime(trading_iso, "%Y-%m-%d").date() - timedelta(days=lookback_days)).isoformat()
+    manifest = load_manifest()
+
+    try:
+        table = _read_table() if manifest.get("max_date") else None
+        cached = _normalize(table.to_pandas()) if table is not None else _normalize([])
+    except Exception as e:
+        print(f"   ohlcv cache unreadable, rebuilding: {e}")
+        cached = _normalize([])
+
+    cold = cached.empty or str(manifest.get("min_date") or "9999") > window_start
+    if not cold and _is_expired(manifest):
+        print(f"   ohlcv cache: older than {cache_max_age_days()} day(s), cold rebuild")
+        cold = True
+    built_at = manifest.get("built_at")
+    invalid_tickers = set(manifest.get("invalid_tickers") or [])
+    invalid_ranges = [tuple(r) for r in (manifest.get("invalid_ranges") or [])]
+
+    try:
+        if cold:
+            fetched = _normalize(_fetch_dates(supabase, window_start))
+            parts = [fetched]
+        else:
+            cached = cached[(cached["date"] >= window_start) & ~cached["ticker"].isin(invalid_tickers)]
+            for start_iso, end_iso in invalid_ranges:
+                cached = cached[(cached["date"] < start_iso) | (cached["date"] > end_iso)]
+            parts = [cached, _normalize(_staged_rows)]
+            delta = _normalize(_fetch_dates(supabase, manifest["max_date"]))
+            status["delta_rows"] = len(delta)
+            parts.append(delta)
+            for start_iso, end_iso in invalid_ranges:
+                parts.append(_normalize(_fetch_dates(supabase, max(start_iso, window_start), end_iso)))
+            if invalid_tickers:
+                parts.append(_normalize(fetch_stock_daily_frame(
+                    supabase, sorted(invalid_tickers), window_start, columns=", ".join(CACHE_COLUMNS),
+                )))
+                status["reloaded_tickers"] = len(invalid_tickers)
+        df = pd.concat([p for p in parts if not p.empty], ignore_index=True) if any(not p.empty for p in parts) else _normalize([])
+        df = df[df["date"] >= window_start].drop_duplicates(subset=["ticker", "date"], keep="last")
+        if not cold:
+            # history rewritten outside the batch never reaches the manifest
+            remote_rows = _remote_row_count(supabase, window_start)
+            if remote_rows is not None and remote_rows != len(df):
+                print(f"   ohlcv cache: {len(df):,} rows vs {remote_rows:,} in stock_daily, cold rebuild")
+                status["drift_rows"] = remote_rows - len(df)
+                cold = True
+                df = _normalize(_fetch_dates(supabase, window_start)).drop_duplicates(subset=["ticker", "date"], keep="last")
+        offsets = _write_table(df)
+    except Exception as e:
+        print(f"   ohlcv cache refresh failed, stages will read Supabase: {e}")
+        status["reason"] = f"refresh_failed: {e}"
+        _active = False
+        return status
+
+    manifest = {
+        "min_date": window_start,
+        "max_date": str(df["date"].max()) if len(df) else None,
+        "rows": int(len(df)),
+        "tickers": len(offsets),
+        "offsets": offsets,
+        "invalid_tickers": [],
+        "invalid_ranges": [],
+        "written_at": datetime.now().isoformat(),
+        "built_at": datetime.now().isoformat() if cold else built_at,
+        "trading_date": trading_iso,
+    }
+    _save_manifest(manifest)
+    _staged_rows.clear()
+    _active = True
+    status.update({"ok": True, "rows": manifest["rows"], "watermark": manifest["max_date"], "cold": cold})
+    source = "cold build" if cold else f"delta {status['delta_rows']:,} rows"
+    print(f"   ohlcv cache: {manifest['rows']:,} rows, {manifest['tickers']} tickers, "
+          f"watermark {manifest['max_date']} ({source})")
+    return status
+
+
+@traced()
+def read_ohlcv_cache(
+    tickers: Optional[list] = None,
+    from_iso: Optional[str] = None,
+    to_iso_date: Optional[str] = None,
+    columns: Optional[list] = None,
+) -> Optional[pd.DataFrame]:
+    """Read rows from the memory-mapped cache; None when the cache cannot serve the query."""
+    if not _active:
+        return None
+    manifest = load_manifest()
+    if from_iso and str(manifest.get("min_date") or "9999") > from_iso:
+        return None
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        table = _read_table()
+        if table is None:
+            return None
+        if tickers is not None:
+            offsets = manifest.get("offsets") or {}
+            slices = [table.slice(*offsets[t]) for t in sorted(set(tickers)) if t in offsets]
+            table = pa.concat_tables(slices) if slices else table.slice(0, 0)
+        if from_iso:
+            table = table.filter(pc.greater_equal(table["date"], from_iso))
+        if to_iso_date:
+            table = table.filter(pc.less_equal(table["date"], to_iso_date))
+        if columns:
+            table = table.select([c for c in CACHE_COLUMNS if c in columns])
+        return table.to_pandas()
+    except Exception as e:
+        print(f"   ohlcv cache read failed, falling back to Supabase: {e}")
+        return None
@@ -0,0 +1,191 @@
+"""
+batch_modules/panel.py
+=====================
+Bulk stock_daily loading and (bar x ticker) panel helpers
+- stock_daily is read in a few paged bulk queries instead of one query per ticker
+- load_stock_daily_frame serves reads from the local OHLCV cache when it is active
+- panels are right-aligned by bar: the last row holds each ticker's latest bar,
+  so trading halts never create holes and rolling windows match per-ticker math
+"""
+
+import numpy as np
+import pandas as pd
+from supabase import Client
+from .instrument import traced
+
+
+PANEL_TICKER_CHUNK = 100
+PANEL_PAGE_SIZE = 1000
+
+
+@traced()
+def fetch_stock_daily_frame(
+    supabase: Client,
+    tickers: list[str],
+    from_iso: str,
+    to_iso_date: str | None = None,
+    columns: str = "ticker, date, open, high, low, close, volume, value",
+    ticker_chunk: int = PANEL_TICKER_CHUNK,
+    page_size: int = PANEL_PAGE_SIZE,
+) -> pd.DataFrame:
+    """Load stock_daily rows for many tickers with paged bulk reads."""
+    rows: list[dict] = []
+    for i in range(0, len(tickers), ticker_chunk):
+        chunk = tickers[i:i + ticker_chunk]
+        offset = 0
+        while True:
+            query = supabase.table("stock_daily") \
+                .select(columns) \
+                .in_("ticker", chunk) \
+                .gte("date", from_iso)
+            if to_iso_date:
+                query = query.lte("date", to_iso_date)
+            res = query.order("ticker").order("date") \
+                .range(offset, offset + page_size - 1).execute()
+            page = res.data or []
+            rows.extend(page)
+            if len(page) < page_size:
+                break
+            offset += page_size
+
+    if not rows:
+        return pd.DataFrame()
+
+    df = pd.DataFrame(rows)
+    df["date"] = df["date"].astype(str).str[:10]
+    df = df.drop_duplicates(subset=["ticker", "date"], keep="last")
+    return df.sort_values(["ticker", "date"]).reset_index(drop=True)
+
+
+@traced()
+def load_stock_daily_frame(
+    supabase: Client,
+    tickers: list[str],
+    from_iso: str,
+    to_iso_date: str | None = None,
+    columns: str = "ticker, date, open, high, low, close, volume, value",
+) -> pd.DataFrame:
+    """stock_daily rows from the local OHLCV cache when active, else bulk Supabase reads."""
+    from .ohlcv_cache import read_ohlcv_cache
+
+    cols = [c.strip() for c in columns.split(",") if c.strip()]
+    cached = read_ohlcv_cache(tickers, from_iso, to_iso_date, cols)
+    if cached is not None:
+        return cached.sort_values(["ticker", "date"]).reset_index(drop=True)
+    return fetch_stock_daily_frame(supabase, tickers, from_iso, to_iso_date, columns)
+
+
+@traced()
+def load_stock_daily_snapshot(
+    supabase: Client,
+    date_iso: str,
+    columns: str = "ticker, close",
+    page_size: int = PANEL_PAGE_SIZE,
+) -> list[dict]:
+    """All stock_daily rows of one date (cache first, else paged Supabase reads)."""
+    from .ohlcv_cache import read_ohlcv_cache
+
+    cols = [c.strip() for c in columns.split(",") if c.strip()]
+    cached = read_ohlcv_cache(None, date_iso, date_iso, cols)
+    if cached is not None:
+        return cached.to_dict("records")
+
+    rows: list[dict] = []
+    offset = 0
+    while True:
+        res = supabase.table("stock_daily") \
+            .select(columns) \
+            .eq("date", date_iso) \
+            .order("ticker") \
+            .range(offset, offset + page_size - 1).execute()
+        page = res.data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            break
+        offset += page_size
+    return rows
+
+
+@traced()
+def load_stock_daily_range(
+    supabase: Client,
+    from_iso: str,
+    to_iso_date: str | None = None,
+    columns: str = "ticker, date, close",
+    page_size: int = PANEL_PAGE_SIZE,
+) -> pd.DataFrame:
+    """All stock_daily rows of a date range for every ticker (cache first, else paged reads)."""
+    from .ohlcv_cache import read_ohlcv_cache
+
+    cols = [c.strip() for c in columns.split(",") if c.strip()]
+    cached = read_ohlcv_cache(None, from_iso, to_iso_date, cols)
+    if cached is not None:
+        df = cached
+    else:
+        rows: list[dict] = []
+        offset = 0
+        while True:
+            query = supabase.table("stock_daily").select(columns).gte("date", from_iso)
+            if to_iso_date:
+                query = query.lte("date", to_iso_date)
+            page = query.order("date").order("ticker") \
+                .range(offset, offset + page_size - 1).execute().data or []
+            rows.extend(page)
+            if len(page) < page_size:
+                break
+            offset += page_size
+        df = pd.DataFrame(rows, columns=cols)
+
+    if df.empty:
+        return df
+    df["date"] = df["date"].astype(str).str[:10]
+    return df.drop_duplicates(subset=["ticker", "date"], keep="last").reset_index(drop=True)
+
+
+@traced()
+def build_bar_panel(df: pd.DataFrame, fields: tuple[str, ...] = ("close",), max_bars: int = 0) -> dict:
+    """Pivot a long (ticker, date) frame into right-aligned (bar x ticker) matrices.
+
+    Returns a dict with ``tickers``, ``lengths`` (bars per ticker),
+    ``last_dates`` and one float matrix per requested field. Rows above a
+    ticker's first bar are NaN.
+    """
+    if df is None or df.empty:
+        return {"tickers": [], "lengths": np.zeros(0, dtype=int), "last_dates": [], "depth": 0,
+                **{f: np.zeros((0, 0)) for f in fields}}
+
+    df = df.sort_values(["ticker", "date"])
+    tickers = list(pd.unique(df["ticker"]))
+    cols = pd.Categorical(df["ticker"], categories=tickers).codes
+    pos_from_end = df.groupby("ticker", sort=False).cumcount(ascending=False).to_numpy()
+
+    keep = np.ones(len(df), dtype=bool)
+    if max_bars > 0:
+        keep = pos_from_end < max_bars
+    cols = cols[keep]
+    pos_from_end = pos_from_end[keep]
+
+    lengths = np.bincount(cols, minlength=len(tickers))
+    depth = int(lengths.max()) if len(lengths) else 0
+    rows = depth - 1 - pos_from_end
+
+    panel: dict = {
+        "tickers": tickers,
+        "lengths": lengths,
+        "last_dates": df.groupby("ticker", sort=False)["date"].last().reindex(tickers).tolist(),
+        "depth": depth,
+    }
+    for field in fields:
+        mat = np.full((depth, len(tickers)), np.nan)
+        if field in df.columns:
+            values = pd.to_numeric(df[field], errors="coerce").to_numpy(dtype=float)[keep]
+            mat[rows, cols] = values
+        panel[field] = mat
+    return panel
+
+
+def started_mask(panel: dict) -> np.ndarray:
+    """Boolean (bar x ticker) mask of rows that belong to a ticker's history."""
+    depth = panel["depth"]
+    first_row = depth - np.asarray(panel["lengths"])
+    return np.arange(depth)[:, None] >= first_row[None, :]
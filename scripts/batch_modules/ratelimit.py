@@ -0,0 +1,100 @@
+"""
+batch_modules/ratelimit.py
+=========================
+Shared throttling helpers for upstream market-data APIs
+- TokenBucket: thread-safe request-rate limiter shared by all workers
+- call_with_timeout: bound a blocking call that has no timeout of its own
+- call_with_retry: bounded retries with jittered exponential backoff
+  (reported as an instrument span when given a label)
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from .instrument import record
+
+
+class TokenBucket:
+    """Token bucket allowing ``rate`` requests/second with bursts up to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = max(float(rate), 0.01)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0):
+        """Block until ``tokens`` are available, then consume them."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def set_rate(self, rate: float):
+        """Change the sustained rate (used by adaptive backoff)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(float(rate), 0.01)
+
+
+# Calls that exceed their timeout are abandoned here; the worker thread
+# finishes in the background and its result is discarded.
+_timeout_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="timed-call")
+
+
+def call_with_timeout(func, timeout: float | None):
+    if not timeout:
+        return func()
+    future = _timeout_pool.submit(func)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        future.cancel()
+        raise TimeoutError(f"call exceeded {timeout:.0f}s")
+
+
+def call_with_retry(
+    func,
+    limiter: TokenBucket | None = None,
+    attempts: int = 3,
+    wait: float = 0.5,
+    backoff: float = 2.0,
+    timeout: float | None = None,
+    label: str | None = None,
+):
+    """Run ``func`` under the limiter with timeout and jittered exponential backoff.
+
+    Returns ``(result, retries)``; the last exception is re-raised once
+    ``attempts`` are exhausted. ``label`` records the call (limiter wait
+    included) as an instrument span.
+    """
+    delay = wait
+    start = time.perf_counter()
+    for attempt in range(attempts):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            result = call_with_timeout(func, timeout)
+        except Exception:
+            if attempt == attempts - 1:
+                if label:
+                    record(label, time.perf_counter() - start, requests=attempts, retries=attempt, errors=1)
+                raise
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay *= backoff
+            continue
+        if label:
+            record(label, time.perf_counter() - start, requests=attempt + 1, retries=attempt)
+        return result, attempt
@@ -0,0 +1,258 @@
+"""
+batch_modules/scheduler.py
+=========================
+Dependency-graph stage runner for daily_batch.py
+- stages are declared with dependencies, a gate policy and a timeout
+- independent stages (investor / credit-short / indicators) overlap on a
+  small worker pool, so wall time follows the critical path
+- results are reported back on the calling thread, so mark_stage/finalize
+  never race
+- each stage runs under instrument.stage_scope; with a profile directory
+  the run is one instrument profiling session (see instrument.py for what
+  the output covers on each interpreter)
+- with a StageCheckpoints store, stages whose input watermark matches a
+  checkpoint are resumed instead of re-run
+- a stage past its timeout is reported failed but its thread cannot be
+  stopped, so nothing downstream of it (deps or requires, transitively) is
+  started in that run
+"""
+
+import queue
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+
+from . import instrument
+
+
+@dataclass
+class Stage:
+    """One batch stage.
+
+    ``run()`` returns ``{"ok": bool, "detail": dict}``; it may also return
+    ``"reason"`` (refines the gate failure reason) or ``"abort": (reason, code)``
+    to stop the run even when ``ok`` is true.
+
+    - deps: stages that must finish first (any outcome)
+    - requires: stages that must finish *successfully*, otherwise this one is skipped
+    - gate: failure reason that aborts the run when this stage fails (None = soft)
+    - timeout: seconds before the stage is reported as failed (0 = no limit);
+      its dependents are then skipped since the stage may still be writing
+    - on_resume: called with the checkpoint detail before a stage is resumed,
+      to restore in-process state; returning False re-runs the stage instead
+    """
+
+    name: str
+    run: Callable[[], dict]
+    deps: tuple = ()
+    requires: tuple = ()
+    gate: Optional[str] = None
+    exit_code: int = 1
+    timeout: float = 0.0
+    on_resume: Optional[Callable[[dict], bool]] = None
+
+
+def _validate(stages: list[Stage]):
+    names = [s.name for s in stages]
+    if len(set(names)) != len(names):
+        raise ValueError(f"duplicate stage names: {names}")
+    known = set(names)
+    for s in stages:
+        unknown = (set(s.deps) | set(s.requires)) - known
+        if unknown:
+            raise ValueError(f"stage {s.name} depends on unknown stages: {sorted(unknown)}")
+
+    # Kahn's algorithm just to reject cycles up front
+    indeg = {s.name: len(set(s.deps) | set(s.requires)) for s in stages}
+    children: dict[str, list[str]] = {n: [] for n in names}
+    for s in stages:
+        for d in set(s.deps) | set(s.requires):
+            children[d].append(s.name)
+    ready = [n for n, k in indeg.items() if k == 0]
+    seen = 0
+    while ready:
+        n = ready.pop()
+        seen += 1
+        for c in children[n]:
+            indeg[c] -= 1
+            if indeg[c] == 0:
+                ready.append(c)
+    if seen != len(names):
+        raise ValueError("stage graph has a cycle")
+
+
+def _critical_path(stages: list[Stage], timing: dict) -> tuple[list[str], float]:
+    """Chain of last-finishing dependencies ending at the last stage to finish."""
+    by_name = {s.name: s for s in stages}
+    finished = {n: t for n, t in timing.items() if t.get("finished") is not None}
+    if not finished:
+        return [], 0.0
+    node = max(finished, key=lambda n: finished[n]["finished"])
+    path = [node]
+    while True:
+        preds = [d for d in set(by_name[node].deps) | set(by_name[node].requires) if d in finished]
+        if not preds:
+            break
+        node = max(preds, key=lambda n: finished[n]["finished"])
+        path.append(node)
+    path.reverse()
+    return path, round(sum(finished[n]["elapsed"] for n in path), 3)
+
+
+def run_stages(stages: list[Stage], mark_stage: Callable, workers: int = 3, checkpoints=None,
+               profile_dir: Optional[Path] = None) -> dict:
+    """Execute the stage graph.
+
+    Every finished or skipped stage is reported through
+    ``mark_stage(name, ok, elapsed, detail)``. On a gate failure no new
+    stages are started; running ones are allowed to finish (or time out).
+    Successful stages are recorded in ``checkpoints`` (a StageCheckpoints)
+    when given; ``profile_dir`` profiles the run into that directory.
+
+    Returns {"aborted": (reason, code) | None, "results", "stage_times",
+    "critical_path", "critical_path_seconds", "resumed"}.
+    """
+    _validate(stages)
+    by_name = {s.name: s for s in stages}
+    pending = [s.name for s in stages]
+    outcome: dict[str, bool] = {}          # finished or skipped → ok
+    results: dict[str, dict] = {}
+    timing: dict[str, dict] = {}
+    running: dict[str, float] = {}         # name → deadline (monotonic, 0 = none)
+    timed_out: dict[str, str] = {}         # timed out, or skipped below one → stage that timed out
+    watermarks: dict[str, str] = {}
+    resumed: list[str] = []
+    done_q: queue.Queue = queue.Queue()
+    aborted: Optional[tuple] = None
+    t0 = time.monotonic()
+
+    def worker(stage: Stage):
+        start = time.monotonic()
+        try:
+            with instrument.stage_scope(stage.name), instrument.profiled(stage.name):
+                result = stage.run() or {}
+        except Exception as e:
+            traceback.print_exc()
+            result = {"ok": False, "detail": {"reason": "exception", "error": str(e)}}
+        done_q.put((stage.name, result, time.monotonic() - start))
+
+    def skip(name: str, detail: dict):
+        pending.remove(name)
+        outcome[name] = False
+        timing[name] = {"elapsed": 0.0, "finished": time.monotonic() - t0, "skipped": True}
+        mark_stage(name, False, 0.0, detail)
+
+    def complete(name: str, result: dict, elapsed: float):
+        nonlocal aborted
+        stage = by_name[name]
+        ok = bool(result.get("ok"))
+        outcome[name] = ok
+        results[name] = result
+        timing[name] = {"elapsed": elapsed, "finished": time.monotonic() - t0}
+        mark_stage(name, ok, elapsed, result.get("detail") or {})
+        print(f"   [{name}] {'completed' if ok else 'failed'} in {elapsed:.1f}s", flush=True)
+        if checkpoints is not None:
+            if ok:
+                checkpoints.record(stage, watermarks[name], result, elapsed)
+            else:
+                checkpoints.discard(name)
+
+        if aborted is None and result.get("abort"):
+            aborted = tuple(result["abort"])
+        elif aborted is None and not ok and stage.gate:
+            reason = result.get("reason")
+            aborted = (f"{stage.gate}:{reason}" if reason else stage.gate, stage.exit_code)
+
+    if profile_dir is not None:
+        instrument.start_profiling(profile_dir)
+    try:
+        while pending or running:
+            changed = aborted is None
+            while changed:
+                # rescan until stable: a skip can unblock stages listed before it
+                changed = False
+                for name in list(pending):
+                    stage = by_name[name]
+                    upstream = set(stage.deps) | set(stage.requires)
+                    if any(d not in outcome for d in upstream):
+                        continue
+                    stuck_dep = next((d for d in sorted(upstream) if d in timed_out), None)
+                    if stuck_dep is not None:
+                        # the timed-out thread may still be writing what this stage reads
+                        root = timed_out[name] = timed_out[stuck_dep]
+                        print(f"   [{name}] skipped ({root} timed out and may still be running)", flush=True)
+                        skip(name, {"reason": "dependency_timed_out", "dependency": root})
+                        changed = True
+                        continue
+                    failed_dep = next((d for d in stage.requires if not outcome[d]), None)
+                    if failed_dep is not None:
+                        print(f"   [{name}] skipped ({failed_dep} did not succeed)", flush=True)
+                        skip(name, {"reason": "dependency_failed", "dependency": failed_dep})
+                        changed = True
+                        continue
+                    if checkpoints is not None:
+                        watermarks[name] = checkpoints.watermark(stage)
+                        entry = checkpoints.lookup(stage, watermarks[name])
+                        if entry is not None and stage.on_resume is not None and not stage.on_resume(entry.get("detail") or {}):
+                            print(f"   [{name}] checkpoint no longer matches local state, re-running", flush=True)
+                            entry = None
+                        if entry is not None:
+                            pending.remove(name)
+                            outcome[name] = True
+                            results[name] = {"ok": True, "rows": entry.get("rows"), "detail": entry.get("detail") or {}}
+                            timing[name] = {"elapsed": 0.0, "finished": time.monotonic() - t0, "skipped": True}
+                            resumed.append(name)
+                            print(f"   [{name}] resumed from checkpoint ({entry.get('run_id')})", flush=True)
+                            mark_stage(name, True, 0.0, {**(entry.get("detail") or {}), "resumed_from": entry.get("run_id")})
+                            changed = True
+                            continue
+                    if len(running) >= max(1, workers):
+                        break
+                    pending.remove(name)
+                    running[name] = time.monotonic() + stage.timeout if stage.timeout > 0 else 0.0
+                    # daemon threads: a stage past its timeout cannot keep the process alive
+                    threading.Thread(target=worker, args=(stage,), name=f"stage-{name}", daemon=True).start()
+            if aborted is not None:
+                pending.clear()
+
+            if not running:
+                if pending and aborted is None:
+                    raise RuntimeError(f"stage scheduler stalled with pending stages: {pending}")
+                break
+
+            deadlines = [d for d in running.values() if d > 0]
+            wait = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            try:
+                name, result, elapsed = done_q.get(timeout=wait)
+                if name in running:
+                    del running[name]
+                    complete(name, result, elapsed)
+                continue
+            except queue.Empty:
+                pass
+
+            now = time.monotonic()
+            for name, deadline in list(running.items()):
+                if deadline and now >= deadline:
+                    del running[name]
+                    timed_out[name] = name
+                    timeout = by_name[name].timeout
+                    print(f"[WARN] Stage {name} exceeded its {timeout:.0f}s timeout")
+                    complete(name, {"ok": False, "reason": "timeout",
+                                    "detail": {"reason": "timeout", "timeout_seconds": timeout}}, timeout)
+    finally:
+        if profile_dir is not None:
+            instrument.stop_profiling()
+
+    path, path_seconds = _critical_path(stages, timing)
+    return {
+        "aborted": aborted,
+        "results": results,
+        "stage_times": {n: t["elapsed"] for n, t in timing.items() if not t.get("skipped")},
+        "critical_path": path,
+        "critical_path_seconds": path_seconds,
+        "resumed": resumed,
+    }
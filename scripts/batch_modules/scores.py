@@ -8,8 +8,13 @@ import subprocess
 import sys
 import os
 from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
 from supabase import Client
-from .utils import safe_float, safe_int, derive_signal, run_python_script
+from .utils import run_python_script
+from .investor import investor_flow_sums
+from .instrument import traced
 
 
 def run_engine_score_sync(asof: str) -> bool:
@@ -29,6 +34,191 @@ def run_engine_score_sync(asof: str) -> bool:
         return False
 
 
+SCORE_PAGE_SIZE = 1000
+INDICATOR_COLUMNS = "code, close, rsi14, roc14, roc21, sma20, sma50, sma200, volume, value_traded, atr14, atr_pct"
+
+
+def _paged_rows(make_query, page_size: int = SCORE_PAGE_SIZE) -> list:
+    rows: list = []
+    offset = 0
+    while True:
+        page = make_query().range(offset, offset + page_size - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        offset += page_size
+
+
+def _num_col(frame: pd.DataFrame, col: str, default: float = 0.0) -> pd.Series:
+    """Column parsed like safe_float: missing/NaN/inf -> default."""
+    if col not in frame.columns:
+        return pd.Series(default, index=frame.index, dtype=float)
+    values = pd.to_numeric(frame[col], errors="coerce").astype(float)
+    return values.replace([np.inf, -np.inf], np.nan).fillna(default)
+
+
+def _load_legacy_inputs(supabase: Client, trading_iso: str) -> tuple:
+    """Stocks, indicators, 5-day investor flow sums and sectors for the legacy rules."""
+    stocks = supabase.table("stocks") \
+        .select("code, name, sector_id, universe_level, market_cap, close") \
+        .in_("universe_level", ["core", "extended"]).execute().data or []
+
+    columns = INDICATOR_COLUMNS
+    try:
+        indicators = _paged_rows(lambda: supabase.table("daily_indicators")
+                                 .select(columns).eq("trade_date", trading_iso).order("code"))
+    except Exception as e:
+        if "atr" not in str(e):
+            raise
+        # daily_indicators without migration 016
+        columns = INDICATOR_COLUMNS.replace(", atr14, atr_pct", "")
+        indicators = _paged_rows(lambda: supabase.table("daily_indicators")
+                                 .select(columns).eq("trade_date", trading_iso).order("code"))
+
+    five_days_ago = (date.fromisoformat(trading_iso) - timedelta(days=7)).isoformat()
+    try:
+        flows = investor_flow_sums(supabase, five_days_ago, trading_iso,
+                                   tickers=[s["code"] for s in stocks])
+    except Exception as e:
+        print(f"  -> investor flow load skipped: {e}")
+        flows = {}
+
+    sectors = supabase.table("sectors").select("id, score, change_rate").execute().data or []
+    return stocks, indicators, flows, sectors
+
+
+@traced()
+def build_legacy_score_frame(stocks: list, indicators: list, flows: dict, sectors: list) -> pd.DataFrame:
+    """Apply the legacy scoring rules column-wise.
+
+    Joins stocks with their indicator row, 5-day institution/foreign sums
+    and sector change, then derives value/momentum/liquidity/total_score
+    and signal. Pure function of its inputs (no I/O), so it can be
+    benchmarked directly.
+    """
+    frame = pd.DataFrame(stocks)
+    if frame.empty:
+        return frame
+    codes = frame["code"]
+
+    ind = pd.DataFrame(indicators)
+    if not ind.empty:
+        ind = ind.drop_duplicates("code", keep="last").set_index("code").reindex(codes)
+        ind.index = frame.index
+    else:
+        ind = pd.DataFrame(index=frame.index)
+
+    frame["institution_5d"] = codes.map(lambda c: (flows.get(c) or {}).get("institution", 0)).astype("int64")
+    frame["foreign_5d"] = codes.map(lambda c: (flows.get(c) or {}).get("foreign", 0)).astype("int64")
+
+    sec = pd.DataFrame(sectors)
+    sector_change = _num_col(sec, "change_rate").set_axis(sec["id"]) if not sec.empty else pd.Series(dtype=float)
+    sector_change = sector_change[~sector_change.index.duplicated(keep="last")]
+    sector_ids = frame["sector_id"] if "sector_id" in frame.columns else pd.Series(None, index=frame.index)
+    frame["sector_change"] = sector_ids.map(sector_change).fillna(0.0).astype(float).to_numpy()
+
+    level = frame.get("universe_level")
+    frame["value_score"] = np.select([level == "core", level == "extended"], [65, 55], 50)
+
+    rsi = _num_col(ind, "rsi14", 50.0)
+    roc14 = _num_col(ind, "roc14")
+    roc21 = _num_col(ind, "roc21")
+    close_price = _num_col(ind, "close", np.nan).fillna(_num_col(frame, "close"))
+    sma20 = _num_col(ind, "sma20")
+    sma50 = _num_col(ind, "sma50")
+    inst, foreign = frame["institution_5d"], frame["foreign_5d"]
+    sec_change = frame["sector_change"]
+
+    # Terms are added in the original order so float truncation is unchanged
+    momentum = pd.Series(30.0, index=frame.index)
+    momentum += np.select([(rsi >= 45) & (rsi <= 65), (rsi >= 35) & (rsi <= 70)], [20, 10], 0)
+    momentum += np.where(roc14 > 0, np.minimum(15, roc14 * 3), 0)
+    momentum += np.where(roc21 > 0, np.minimum(10, roc21 * 2), 0)
+    trend_ok = (close_price > 0) & (sma20 > 0) & (sma50 > 0)
+    momentum += np.where(trend_ok, np.select([(close_price > sma20) & (sma20 > sma50), close_price > sma20], [15, 8], 0), 0)
+    momentum += np.where(sec_change > 0, np.minimum(10, sec_change * 3), 0)
+    momentum += np.select(
+        [(inst > 0) & (foreign > 0), inst > 0, foreign > 0, (inst < 0) & (foreign < 0)],
+        [12, 8, 5, -8],
+        0,
+    )
+    frame["momentum_score"] = np.trunc(momentum).clip(0, 100).astype(int)
+
+    value_traded = _num_col(ind, "value_traded")
+    frame["liquidity_score"] = np.select(
+        [value_traded > 50_000_000_000, value_traded > 10_000_000_000, value_traded > 1_000_000_000],
+        [90, 70, 50],
+        30,
+    )
+
+    total = frame["value_score"] * 0.3 + frame["momentum_score"] * 0.45 + frame["liquidity_score"] * 0.25
+    frame["total_score"] = np.rint(total).clip(0, 100).astype(int)
+    frame["signal"] = np.select(
+        [frame["total_score"] >= 85, frame["total_score"] >= 70, frame["total_score"] >= 55, frame["total_score"] <= 20],
+        ["STRONG_BUY", "BUY", "WATCH", "SELL"],
+        "HOLD",
+    )
+
+    frame["rsi14"] = rsi
+    frame["roc14"] = roc14
+    frame["roc21"] = roc21
+    for key in ("atr14", "atr_pct"):
+        frame[key] = pd.to_numeric(ind[key], errors="coerce") if key in ind.columns else np.nan
+    return frame
+
+
+def compute_legacy_scores(supabase: Client, trading_date: str) -> pd.DataFrame:
+    """Legacy score frame for ``trading_date`` without writing anything."""
+    from .utils import to_iso
+    return build_legacy_score_frame(*_load_legacy_inputs(supabase, to_iso(trading_date)))
+
+
+def _load_existing_factors(supabase: Client, asof: str, codes: list) -> dict:
+    existing: dict = {}
+    for i in range(0, len(codes), 200):
+        res = supabase.table("scores") \
+            .select("code, factors") \
+            .eq("asof", asof) \
+            .in_("code", codes[i:i+200]).execute()
+        for row in (res.data or []):
+            if isinstance(row.get("factors"), dict):
+                existing[row.get("code")] = row["factors"]
+    return existing
+
+
+def _score_rows(frame: pd.DataFrame, asof: str, existing_factors: dict) -> list:
+    upserts = []
+    for rec in frame.to_dict("records"):
+        merged_factors = dict(existing_factors.get(rec["code"]) or {})
+        merged_factors.update({
+            "score_source": "legacy_fallback",
+            "rsi14": round(rec["rsi14"], 2),
+            "roc14": round(rec["roc14"], 2),
+            "roc21": round(rec["roc21"], 2),
+            "sector_change": round(rec["sector_change"], 2),
+            "institution_5d": int(rec["institution_5d"]),
+            "foreign_5d": int(rec["foreign_5d"]),
+        })
+        # ATR comes precomputed from daily_indicators
+        for key in ("atr14", "atr_pct"):
+            if pd.notna(rec.get(key)):
+                merged_factors[key] = float(rec[key])
+
+        total_score = int(rec["total_score"])
+        upserts.append({
+            "code": rec["code"], "asof": asof,
+            "score": float(total_score),
+            "signal": rec["signal"],
+            "factors": merged_factors,
+            "value_score": int(rec["value_score"]),
+            "momentum_score": int(rec["momentum_score"]),
+            "liquidity_score": int(rec["liquidity_score"]),
+            "total_score": total_score,
+        })
+    return upserts
+
+
+@traced()
 def calculate_stock_scores(supabase: Client, trading_date: str) -> dict:
     """Calculate stock scores (engine first, legacy fallback)."""
     from .utils import to_iso
@@ -44,13 +234,8 @@ def calculate_stock_scores(supabase: Client, trading_date: str) -> dict:
         }
 
     try:
-        trading_iso = asof
-        
-        res = supabase.table("stocks") \
-            .select("code, name, sector_id, universe_level, market_cap, close") \
-            .in_("universe_level", ["core", "extended"]).execute()
-        all_stocks = res.data or []
-        if not all_stocks:
+        stocks, indicators, flows, sectors = _load_legacy_inputs(supabase, asof)
+        if not stocks:
             print("   No stocks found")
             return {
                 "ok": False,
@@ -58,145 +243,12 @@ def calculate_stock_scores(supabase: Client, trading_date: str) -> dict:
                 "reason": "no_stocks",
                 "rows": 0,
             }
+        print(f"  -> indicators loaded for {len(indicators)} stocks, "
+              f"investor flow for {len(flows)} stocks")
 
-        codes = [s["code"] for s in all_stocks]
-        indicators_map: dict = {}
-        for i in range(0, len(codes), 50):
-            batch = codes[i:i+50]
-            ind_res = supabase.table("daily_indicators") \
-                .select("code, close, rsi14, roc14, roc21, sma20, sma50, sma200, volume, value_traded") \
-                .in_("code", batch) \
-                .eq("trade_date", trading_iso).execute()
-            for row in (ind_res.data or []):
-                indicators_map[row["code"]] = row
-
-        existing_scores_map: dict = {}
-        for i in range(0, len(codes), 200):
-            batch = codes[i:i+200]
-            old_res = supabase.table("scores") \
-                .select("code, value_score, momentum_score, liquidity_score, total_score, score, factors") \
-                .eq("asof", asof) \
-                .in_("code", batch).execute()
-            for row in (old_res.data or []):
-                existing_scores_map[row.get("code")] = row
-
-        print(f"  -> indicators loaded for {len(indicators_map)} stocks")
-
-        # 기관/외국인 최근 5일 순매수 합계 로드
-        five_days_ago = (date.fromisoformat(trading_iso) - timedelta(days=7)).isoformat()
-        investor_map: dict = {}
-        try:
-            for i in range(0, len(codes), 200):
-                batch = codes[i:i+200]
-                inv_res = supabase.table("investor_daily") \
-                    .select("ticker, institution_amount, foreign_amount") \
-                    .in_("ticker", batch) \
-                    .gte("date", five_days_ago) \
-                    .lte("date", trading_iso).execute()
-                for row in (inv_res.data or []):
-                    t = row["ticker"]
-                    if t not in investor_map:
-                        investor_map[t] = {"institution_5d": 0, "foreign_5d": 0}
-                    investor_map[t]["institution_5d"] += safe_int(row.get("institution_amount", 0))
-                    investor_map[t]["foreign_5d"] += safe_int(row.get("foreign_amount", 0))
-            print(f"  -> investor flow loaded for {len(investor_map)} stocks")
-        except Exception as e:
-            print(f"  -> investor flow load skipped: {e}")
-
-        sec_res = supabase.table("sectors").select("id, score, change_rate").execute()
-        sector_score_map = {
-            r["id"]: {"score": safe_float(r.get("score")), "change": safe_float(r.get("change_rate"))}
-            for r in (sec_res.data or [])
-        }
-
-        upserts = []
-        for s in all_stocks:
-            code = s["code"]
-            ind = indicators_map.get(code, {})
-            sec_info = sector_score_map.get(s.get("sector_id", ""), {})
-
-            value_score = 50
-            if s.get("universe_level") == "core":
-                value_score += 15
-            elif s.get("universe_level") == "extended":
-                value_score += 5
-
-            rsi = safe_float(ind.get("rsi14"), 50)
-            roc14 = safe_float(ind.get("roc14"))
-            roc21 = safe_float(ind.get("roc21"))
-            close_price = safe_float(ind.get("close"), safe_float(s.get("close")))
-            sma20 = safe_float(ind.get("sma20"))
-            sma50 = safe_float(ind.get("sma50"))
-            sma200 = safe_float(ind.get("sma200"))
-
-            inv = investor_map.get(code, {})
-            institution_5d = inv.get("institution_5d", 0)
-            foreign_5d = inv.get("foreign_5d", 0)
-
-            momentum_score = 30
-            if 45 <= rsi <= 65:
-                momentum_score += 20
-            elif 35 <= rsi <= 70:
-                momentum_score += 10
-            if roc14 > 0:
-                momentum_score += min(15, roc14 * 3)
-            if roc21 > 0:
-                momentum_score += min(10, roc21 * 2)
-            if close_price > 0 and sma20 > 0 and sma50 > 0:
-                if close_price > sma20 > sma50:
-                    momentum_score += 15
-                elif close_price > sma20:
-                    momentum_score += 8
-            sec_change = sec_info.get("change", 0)
-            if sec_change > 0:
-                momentum_score += min(10, sec_change * 3)
-            # 기관/외국인 5일 순매수 가산 (최대 +12점)
-            if institution_5d > 0 and foreign_5d > 0:
-                momentum_score += 12  # 쌍끌이 매수
-            elif institution_5d > 0:
-                momentum_score += 8
-            elif foreign_5d > 0:
-                momentum_score += 5
-            elif institution_5d < 0 and foreign_5d < 0:
-                momentum_score -= 8  # 동반 매도
-            momentum_score = min(100, max(0, int(momentum_score)))
-
-            value_traded = safe_float(ind.get("value_traded"))
-            liquidity_score = 30
-            if value_traded > 50_000_000_000:
-                liquidity_score = 90
-            elif value_traded > 10_000_000_000:
-                liquidity_score = 70
-            elif value_traded > 1_000_000_000:
-                liquidity_score = 50
-
-            total_score = min(100, max(0, int(round(
-                value_score * 0.3 + momentum_score * 0.45 + liquidity_score * 0.25
-            ))))
-
-            existing_score = existing_scores_map.get(code, {})
-            existing_factors = existing_score.get("factors") if isinstance(existing_score.get("factors"), dict) else {}
-            merged_factors = dict(existing_factors)
-            merged_factors.update({
-                "score_source": "legacy_fallback",
-                "rsi14": round(rsi, 2),
-                "roc14": round(roc14, 2),
-                "roc21": round(roc21, 2),
-                "sector_change": round(sec_change, 2),
-                "institution_5d": institution_5d,
-                "foreign_5d": foreign_5d,
-            })
-
-            upserts.append({
-                "code": code, "asof": asof,
-                "score": float(total_score),
-                "signal": derive_signal(total_score),
-                "factors": merged_factors,
-                "value_score": int(value_score),
-                "momentum_score": int(momentum_score),
-                "liquidity_score": int(liquidity_score),
-                "total_score": int(total_score),
-            })
+        frame = build_legacy_score_frame(stocks, indicators, flows, sectors)
+        existing_factors = _load_existing_factors(supabase, asof, frame["code"].tolist())
+        upserts = _score_rows(frame, asof, existing_factors)
 
         if upserts:
             print(f"  -> upserting {len(upserts)} score rows...")
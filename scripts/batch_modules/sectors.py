@@ -9,9 +9,13 @@ import numpy as np
 from datetime import datetime, date, timedelta
 from typing import Dict, List
 from supabase import Client
-from .utils import safe_float, to_iso
+from .utils import safe_float, to_iso, bulk_patch
+from .investor import sector_investor_flow_sums
+from .panel import load_stock_daily_snapshot, load_stock_daily_range
+from .instrument import traced
 
 
+@traced()
 def update_sector_data(supabase: Client, trading_date: str):
     """Aggregate sector change rates from constituent stocks."""
     trading_iso = to_iso(trading_date)
@@ -45,13 +49,11 @@ def update_sector_data(supabase: Client, trading_date: str):
 
         print(f"  Change window: {prev_date} -> {latest}")
 
-        today_res = supabase.table("stock_daily") \
-            .select("ticker, close").eq("date", latest).execute()
-        prev_day_res = supabase.table("stock_daily") \
-            .select("ticker, close").eq("date", prev_date).execute()
+        today_rows = load_stock_daily_snapshot(supabase, latest, "ticker, close")
+        prev_day_rows = load_stock_daily_snapshot(supabase, prev_date, "ticker, close")
 
-        today_map = {r["ticker"]: safe_float(r["close"]) for r in (today_res.data or [])}
-        prev_map = {r["ticker"]: safe_float(r["close"]) for r in (prev_day_res.data or [])}
+        today_map = {r["ticker"]: safe_float(r["close"]) for r in today_rows}
+        prev_map = {r["ticker"]: safe_float(r["close"]) for r in prev_day_rows}
 
         sector_changes: Dict[str, List[float]] = {}
         for ticker in today_map:
@@ -65,9 +67,11 @@ def update_sector_data(supabase: Client, trading_date: str):
 
         res_sectors = supabase.table("sectors") \
             .select("id, name, metrics").execute()
+        sector_rows = res_sectors.data or []
+        stock_counts = sector_factor_frame(sector_rows, stock_sector=stock_sector_map)["stock_count"].to_numpy()
 
         sector_updates = []
-        for sec in (res_sectors.data or []):
+        for sec, stock_count in zip(sector_rows, stock_counts):
             sid = sec["id"]
             sname = sec.get("name", "")
             old_metrics = sec.get("metrics") or {}
@@ -75,7 +79,7 @@ def update_sector_data(supabase: Client, trading_date: str):
             avg_change = sum(changes) / len(changes) if changes else 0.0
 
             new_metrics = dict(old_metrics)
-            new_metrics["stock_count"] = len([t for t, s in stock_sector_map.items() if s == sid])
+            new_metrics["stock_count"] = int(stock_count)
 
             sector_updates.append({
                 "id": sid,
@@ -97,6 +101,58 @@ def update_sector_data(supabase: Client, trading_date: str):
         traceback.print_exc()
 
 
+SECTOR_DAILY_START = "2025-01-01"
+SECTOR_DAILY_BASE_LEVEL = 1000.0
+
+
+@traced()
+def build_sector_daily_frame(prices: pd.DataFrame, stock_sector: Dict[str, str],
+                             start_levels: Dict[str, float], seed_date: str | None = None) -> pd.DataFrame:
+    """Equal-weight sector series from a long (ticker, date, close, value) frame.
+
+    Pivots to (date x ticker) matrices; a stock contributes a return on a
+    date when it has a positive close on both that date and the previous
+    loaded date. Sector returns are the groupby-mean of those returns,
+    levels the cumulative product starting from ``start_levels`` (default
+    1000) and value the sum over all constituents. ``seed_date`` rows only
+    provide previous closes. Dates where a sector has no return are omitted.
+    """
+    columns = ["sector_id", "date", "close", "value"]
+    if prices is None or prices.empty:
+        return pd.DataFrame(columns=columns)
+
+    prices = prices[prices["ticker"].isin(stock_sector.keys())]
+    close = prices.pivot(index="date", columns="ticker", values="close") \
+        .apply(pd.to_numeric, errors="coerce").sort_index()
+    value = prices.pivot(index="date", columns="ticker", values="value") \
+        .apply(pd.to_numeric, errors="coerce").reindex(index=close.index, columns=close.columns)
+
+    prev = close.shift(1)
+    change = ((close - prev) / prev).where((prev > 0) & (close > 0))
+    sectors = close.columns.map(stock_sector)
+
+    sector_change = change.T.groupby(sectors).mean().T
+    sector_value = value.fillna(0.0).T.groupby(sectors).sum().T
+    if seed_date is not None:
+        sector_change = sector_change[sector_change.index > seed_date]
+        sector_value = sector_value.loc[sector_change.index]
+    if sector_change.empty:
+        return pd.DataFrame(columns=columns)
+
+    base = pd.Series({sid: start_levels.get(sid, SECTOR_DAILY_BASE_LEVEL) for sid in sector_change.columns})
+    levels = (1 + sector_change.fillna(0.0)).cumprod() * base
+
+    out = pd.DataFrame({
+        "close": levels.round(2).stack(),
+        "value": sector_value.stack(),
+        "has_change": sector_change.notna().stack(),
+    })
+    out = out[out["has_change"]].drop(columns="has_change")
+    out.index.names = ["date", "sector_id"]
+    return out.reset_index()[columns].sort_values(["date", "sector_id"]).reset_index(drop=True)
+
+
+@traced()
 def populate_sector_daily(supabase: Client):
     """Populate sector_daily time series."""
     print(f"\n[3.5/7] Populating sector_daily time series...")
@@ -106,13 +162,13 @@ def populate_sector_daily(supabase: Client):
             .select("sector_id, date, close, value") \
             .order("date", desc=True).limit(1000).execute()
 
-        last_known: Dict[str, dict] = {}
+        last_known: Dict[str, float] = {}
+        latest_sector_date = SECTOR_DAILY_START
         for r in (existing_res.data or []):
             sid = r["sector_id"]
             if sid not in last_known:
-                last_known[sid] = {"date": r["date"], "close": safe_float(r["close"], 1000), "value": safe_float(r.get("value"), 0)}
-
-        latest_sector_date = max((v["date"] for v in last_known.values()), default="2025-01-01")
+                last_known[sid] = safe_float(r["close"], SECTOR_DAILY_BASE_LEVEL)
+                latest_sector_date = max(latest_sector_date, str(r["date"])[:10])
         print(f"  latest sector_daily date: {latest_sector_date}")
 
         stocks_res = supabase.table("stocks") \
@@ -120,98 +176,33 @@ def populate_sector_daily(supabase: Client):
             .not_.is_("sector_id", "null") \
             .eq("is_active", True).execute()
         stock_sector = {r["code"]: r["sector_id"] for r in (stocks_res.data or [])}
-        all_sector_ids = set(stock_sector.values())
 
-        ref_ticker = "005930"
-        dates_res = supabase.table("stock_daily") \
-            .select("date") \
-            .eq("ticker", ref_ticker) \
-            .gt("date", latest_sector_date) \
-            .order("date", desc=False) \
-            .limit(500).execute()
-
-        unique_dates = sorted(set(r["date"] for r in (dates_res.data or [])))
-        if not unique_dates:
+        # One read for the whole catch-up window; the last known date seeds previous closes
+        seeded = latest_sector_date > SECTOR_DAILY_START
+        prices = load_stock_daily_range(supabase, latest_sector_date, columns="ticker, date, close, value")
+        if not prices.empty and not seeded:
+            prices = prices[prices["date"] > latest_sector_date]
+        new_dates = sorted(d for d in prices["date"].unique() if d > latest_sector_date) if not prices.empty else []
+        if not new_dates:
             print("   No new stock_daily dates found; skipping")
             return
-
-        print(f"  dates to process: {len(unique_dates)} ({unique_dates[0]} ~ {unique_dates[-1]})")
-
-        prev_date_data: Dict[str, dict] = {}
-        if latest_sector_date > "2025-01-01":
-            prev_res = supabase.table("stock_daily") \
-                .select("ticker, close") \
-                .eq("date", latest_sector_date) \
-                .limit(2000).execute()
-            for r in (prev_res.data or []):
-                prev_date_data[r["ticker"]] = {"close": safe_float(r["close"])}
-
-        upsert_buffer: list = []
-
-        for di, dt in enumerate(unique_dates):
-            day_res = supabase.table("stock_daily") \
-                .select("ticker, close, value, volume") \
-                .eq("date", dt) \
-                .limit(2000).execute()
-            day_data = {r["ticker"]: {"close": safe_float(r["close"]), "value": safe_float(r.get("value", 0))} for r in (day_res.data or [])}
-
-            if not day_data:
-                continue
-
-            sector_agg: Dict[str, Dict] = {}
-            for ticker, td in day_data.items():
-                sid = stock_sector.get(ticker)
-                if not sid:
-                    continue
-                if sid not in sector_agg:
-                    sector_agg[sid] = {"changes": [], "values": []}
-
-                prev = prev_date_data.get(ticker, {}).get("close", 0)
-                cur = td["close"]
-                if prev > 0 and cur > 0:
-                    change_pct = (cur - prev) / prev
-                    sector_agg[sid]["changes"].append(change_pct)
-                sector_agg[sid]["values"].append(td["value"])
-
-            for sid in all_sector_ids:
-                agg = sector_agg.get(sid)
-                if not agg or not agg["changes"]:
-                    continue
-
-                avg_change = sum(agg["changes"]) / len(agg["changes"])
-                total_value = sum(agg["values"])
-
-                prev_close = last_known.get(sid, {}).get("close", 1000.0)
-                new_close = round(prev_close * (1 + avg_change), 2)
-
-                upsert_buffer.append({
-                    "sector_id": sid,
-                    "date": dt,
-                    "close": new_close,
-                    "value": total_value,
-                    "updated_at": datetime.now().isoformat(),
-                })
-
-                last_known[sid] = {"date": dt, "close": new_close, "value": total_value}
-
-            prev_date_data = {t: {"close": d["close"]} for t, d in day_data.items()}
-
-            if len(upsert_buffer) >= 500:
-                try:
-                    supabase.table("sector_daily").upsert(upsert_buffer).execute()
-                except Exception as e:
-                    print(f"     sector_daily upsert error: {e}")
-                upsert_buffer = []
-
-            if (di + 1) % 20 == 0:
-                print(f"  -> progress: {di + 1}/{len(unique_dates)}")
-
-        if upsert_buffer:
+        print(f"  dates to process: {len(new_dates)} ({new_dates[0]} ~ {new_dates[-1]}), rows: {len(prices)}")
+
+        frame = build_sector_daily_frame(prices, stock_sector, last_known,
+                                         seed_date=latest_sector_date if seeded else None)
+        now = datetime.now().isoformat()
+        rows = [
+            {"sector_id": r["sector_id"], "date": r["date"], "close": float(r["close"]),
+             "value": float(r["value"]), "updated_at": now}
+            for r in frame.to_dict("records")
+        ]
+
+        for i in range(0, len(rows), 500):
             try:
-                supabase.table("sector_daily").upsert(upsert_buffer).execute()
+                supabase.table("sector_daily").upsert(rows[i:i + 500]).execute()
             except Exception as e:
                 print(f"     sector_daily upsert error: {e}")
-            print(f"   sector_daily population complete ({len(unique_dates)} dates)")
+        print(f"   sector_daily population complete ({len(new_dates)} dates, {len(rows)} rows)")
 
     except Exception as e:
         print(f"  sector_daily population failed: {e}")
@@ -219,6 +210,7 @@ def populate_sector_daily(supabase: Client):
         traceback.print_exc()
 
 
+@traced()
 def aggregate_sector_investor_flows(supabase: Client, lookback_days: int = 5):
     """investor_daily 최근 N일 합계를 섹터별로 집계 → sectors.metrics 업데이트."""
     print(f"\n[2.8/7] Aggregating sector investor flows (last {lookback_days}d)...")
@@ -226,36 +218,9 @@ def aggregate_sector_investor_flows(supabase: Client, lookback_days: int = 5):
         from datetime import date, timedelta
         cutoff = (date.today() - timedelta(days=lookback_days + 3)).isoformat()
 
-        # 최근 investor_daily 로딩
-        inv_res = supabase.table("investor_daily") \
-            .select("ticker, date, institution_amount, foreign_amount") \
-            .gte("date", cutoff) \
-            .execute()
-        inv_rows = inv_res.data or []
-        if not inv_rows:
-            print("   investor_daily 데이터 없음, 스킵")
-            return
-
-        # 종목 → 섹터 매핑
-        stocks_res = supabase.table("stocks") \
-            .select("code, sector_id") \
-            .not_.is_("sector_id", "null") \
-            .eq("is_active", True).execute()
-        code_to_sector = {r["code"]: r["sector_id"] for r in (stocks_res.data or [])}
-
-        # 섹터별 최근 N일 수급 합산
-        from collections import defaultdict
-        sector_inst: dict[str, float] = defaultdict(float)
-        sector_frgn: dict[str, float] = defaultdict(float)
-
-        for r in inv_rows:
-            sid = code_to_sector.get(r["ticker"])
-            if not sid:
-                continue
-            sector_inst[sid] += float(r.get("institution_amount") or 0)
-            sector_frgn[sid] += float(r.get("foreign_amount") or 0)
-
-        if not sector_inst:
+        # 섹터별 최근 N일 수급 합산 (서버 집계)
+        flows = sector_investor_flow_sums(supabase, cutoff, date.today().isoformat())
+        if not flows:
             print("   집계 결과 없음, 스킵")
             return
 
@@ -264,20 +229,14 @@ def aggregate_sector_investor_flows(supabase: Client, lookback_days: int = 5):
         updates = []
         for sec in (sectors_res.data or []):
             sid = sec["id"]
-            if sid not in sector_inst and sid not in sector_frgn:
+            if sid not in flows:
                 continue
             metrics = dict(sec.get("metrics") or {})
-            metrics["flow_inst_5d"] = int(sector_inst.get(sid, 0))
-            metrics["flow_foreign_5d"] = int(sector_frgn.get(sid, 0))
+            metrics["flow_inst_5d"] = int(flows[sid]["institution"])
+            metrics["flow_foreign_5d"] = int(flows[sid]["foreign"])
             updates.append({"id": sid, "metrics": metrics})
 
-        updated_count = 0
-        for row in updates:
-            sid = row["id"]
-            metrics = row["metrics"]
-            res = supabase.table("sectors").update({"metrics": metrics}).eq("id", sid).execute()
-            if res.data:
-                updated_count += 1
+        updated_count = bulk_patch(supabase, "sectors", "id", updates)
 
         print(f"   {updated_count}개 섹터 수급 집계 완료")
     except Exception as e:
@@ -286,6 +245,7 @@ def aggregate_sector_investor_flows(supabase: Client, lookback_days: int = 5):
         traceback.print_exc()
 
 
+@traced()
 def mark_sector_leaders(supabase: Client, top_n: int = 3):
     """각 섹터 내 시총 상위 top_n 종목을 is_sector_leader=true 로 마킹."""
     print(f"\n[3.8/7] Marking sector leaders (top {top_n} by market_cap per sector)...")
@@ -344,6 +304,68 @@ def mark_sector_leaders(supabase: Client, top_n: int = 3):
         traceback.print_exc()
 
 
+SECTOR_DAILY_PAGE_SIZE = 1000
+
+
+def _load_sector_daily(supabase: Client, from_date: str) -> pd.DataFrame:
+    rows: list = []
+    offset = 0
+    while True:
+        page = supabase.table("sector_daily") \
+            .select("sector_id, date, close, value") \
+            .gte("date", from_date) \
+            .order("sector_id").order("date") \
+            .range(offset, offset + SECTOR_DAILY_PAGE_SIZE - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < SECTOR_DAILY_PAGE_SIZE:
+            return pd.DataFrame(rows)
+        offset += SECTOR_DAILY_PAGE_SIZE
+
+
+def _nth_from_end_return(closes: pd.Series, pos: pd.Series, ids: pd.Series, n: int) -> pd.Series:
+    """(close[-1] - close[-n]) / close[-n] per sector; NaN when short or non-positive."""
+    last = closes[pos == 0].set_axis(ids[pos == 0])
+    base = closes[pos == n - 1].set_axis(ids[pos == n - 1])
+    last = last.reindex(base.index)
+    ret = ((last - base) / base).where((base > 0) & (last > 0))
+    return ret.replace([np.inf, -np.inf], np.nan)
+
+
+@traced()
+def sector_factor_frame(sectors: list, sector_daily: pd.DataFrame | None = None,
+                        stock_sector: Dict[str, str] | None = None) -> pd.DataFrame:
+    """Per-sector factors in one pass, indexed by sector id.
+
+    Columns: change_rate, flow_total (5d foreign + institution, 1e8 KRW),
+    stock_count (active constituents in ``stock_sector``) and ret_5d /
+    ret_20d from the ``sector_daily`` closes (NaN when unavailable).
+    """
+    ids = [s["id"] for s in sectors]
+    metrics = [s.get("metrics") or {} for s in sectors]
+    frame = pd.DataFrame({
+        "change_rate": [safe_float(s.get("change_rate"), 0) for s in sectors],
+        "flow_total": [
+            (safe_float(m.get("flow_foreign_5d", 0), 0) + safe_float(m.get("flow_inst_5d", 0), 0)) / 1e8
+            for m in metrics
+        ],
+    }, index=pd.Index(ids, name="sector_id"))
+
+    counts = pd.Series(list((stock_sector or {}).values()), dtype=object).value_counts()
+    frame["stock_count"] = counts.reindex(frame.index).fillna(0).astype(int).to_numpy()
+
+    frame["ret_5d"] = np.nan
+    frame["ret_20d"] = np.nan
+    if sector_daily is not None and not sector_daily.empty:
+        sd = sector_daily.sort_values(["sector_id", "date"], kind="stable")
+        closes = pd.to_numeric(sd["close"], errors="coerce").astype(float)
+        pos = sd.groupby("sector_id", sort=False).cumcount(ascending=False)
+        for col, n in (("ret_5d", 5), ("ret_20d", 20)):
+            ret = _nth_from_end_return(closes, pos, sd["sector_id"], n)
+            frame[col] = ret.reindex(frame.index).to_numpy()
+    return frame
+
+
+@traced()
 def calculate_sector_scores(supabase: Client):
     """Calculate sector scores from flow/momentum/series factors."""
     print(f"\n[4/7] Calculating sector scores...")
@@ -356,40 +378,20 @@ def calculate_sector_scores(supabase: Client):
             return
 
         from_date = (date.today() - timedelta(days=90)).isoformat()
-        sd_res = supabase.table("sector_daily") \
-            .select("sector_id, date, close, value") \
-            .gte("date", from_date) \
-            .order("date", desc=False).execute()
-        sd_df = pd.DataFrame(sd_res.data or [])
+        factors = sector_factor_frame(sectors, _load_sector_daily(supabase, from_date))
 
         updates = []
         nan_count = 0
-        for sec in sectors:
-            sid = sec["id"]
-            sname = sec.get("name", "")
-            metrics = sec.get("metrics") or {}
-            change_rate = safe_float(sec.get("change_rate"), 0)
-
-            flow_f = safe_float(metrics.get("flow_foreign_5d", 0), 0)
-            flow_i = safe_float(metrics.get("flow_inst_5d", 0), 0)
-            flow_total = (flow_f + flow_i) / 1e8
-            flow_score = min(30, max(0, safe_float(flow_total * 0.5, 0)))
-
-            momentum_score = min(40, max(0, safe_float((change_rate + 3) * 6.67, 0)))
+        now = datetime.now().isoformat()
+        for sec, f in zip(sectors, factors.itertuples(index=False)):
+            flow_score = min(30, max(0, safe_float(f.flow_total * 0.5, 0)))
+            momentum_score = min(40, max(0, safe_float((f.change_rate + 3) * 6.67, 0)))
 
             series_score = 15
-            if not sd_df.empty:
-                sec_series = sd_df[sd_df["sector_id"] == sid].sort_values("date")
-                if len(sec_series) >= 5:
-                    closes = sec_series["close"].astype(float).tolist()
-                    if len(closes) >= 5 and closes[-5] > 0 and closes[-1] > 0:
-                        ret_5d = (closes[-1] - closes[-5]) / closes[-5]
-                        if np.isfinite(ret_5d):
-                            series_score = min(30, max(0, safe_float((ret_5d + 0.05) * 300, 15)))
-                    if len(closes) >= 20 and closes[-20] > 0 and closes[-1] > 0:
-                        ret_20d = (closes[-1] - closes[-20]) / closes[-20]
-                        if np.isfinite(ret_20d) and ret_20d > 0:
-                            series_score = min(30, series_score + safe_float(5 * min(1, ret_20d), 0))
+            if np.isfinite(f.ret_5d):
+                series_score = min(30, max(0, safe_float((f.ret_5d + 0.05) * 300, 15)))
+            if np.isfinite(f.ret_20d) and f.ret_20d > 0:
+                series_score = min(30, series_score + safe_float(5 * min(1, f.ret_20d), 0))
 
             total_score = int(round(safe_float(flow_score + momentum_score + series_score, 50)))
             total_score = min(100, max(0, total_score))
@@ -399,8 +401,8 @@ def calculate_sector_scores(supabase: Client):
                 total_score = 50
             
             updates.append({
-                "id": sid, "name": sname, "score": total_score,
-                "updated_at": datetime.now().isoformat(),
+                "id": sec["id"], "name": sec.get("name", ""), "score": total_score,
+                "updated_at": now,
             })
 
         if updates:
@@ -9,7 +9,9 @@ import numpy as np
 from datetime import datetime, date, timedelta
 from typing import Optional, Dict
 from supabase import Client
-from .utils import safe_float, calculate_rsi, to_iso
+from .utils import safe_float, calculate_rsi, to_iso, last_atr, window_mean
+from .panel import build_bar_panel, load_stock_daily_frame
+from .instrument import traced
 
 
 def compute_pullback_signal(rows: list) -> dict:
@@ -44,32 +46,9 @@ def compute_pullback_signal(rows: list) -> dict:
     # Volume baseline
     vol_sma20 = np.mean(volumes[-20:]) if n >= 20 else volumes[-1]
 
-    # ATR14
-    trs = []
-    for i in range(max(1, n - 14), n):
-        tr = max(
-            highs[i] - lows[i],
-            abs(highs[i] - closes[i - 1]),
-            abs(lows[i] - closes[i - 1])
-        )
-        trs.append(tr)
-    atr14 = np.mean(trs) if trs else 0.0
-
-    # ATR SMA20 baseline
-    if n >= 34:
-        atr_series = []
-        for j in range(max(14, n - 20), n):
-            local_trs = []
-            for k in range(max(1, j - 13), j + 1):
-                tr = max(
-                    highs[k] - lows[k],
-                    abs(highs[k] - closes[k - 1]),
-                    abs(lows[k] - closes[k - 1])
-                )
-                local_trs.append(tr)
-            atr_series.append(np.mean(local_trs))
-        atr_sma20 = np.mean(atr_series)
-    else:
+    # ATR14 and its SMA20 baseline
+    atr14, atr_sma20 = last_atr(highs, lows, closes, 14, 20)
+    if atr_sma20 is None:
         atr_sma20 = atr14
 
     # RSI14
@@ -151,6 +130,132 @@ def compute_pullback_signal(rows: list) -> dict:
     }
 
 
+def _panel_rsi(close: np.ndarray, started: np.ndarray, period: int = 14) -> np.ndarray:
+    """Last-bar ``calculate_rsi`` for every column; rows before a ticker's history are NaN."""
+    delta = pd.DataFrame(close).diff()
+    gain = delta.where(delta > 0, 0.0).fillna(0).where(started)
+    loss = (-delta.where(delta < 0, 0.0)).fillna(0).where(started)
+    avg_gain = gain.ewm(alpha=1/period, min_periods=period, adjust=False).mean()
+    avg_loss = loss.ewm(alpha=1/period, min_periods=period, adjust=False).mean()
+    rs = avg_gain / avg_loss
+    return (100 - (100 / (1 + rs))).to_numpy()[-1]
+
+
+def compute_pullback_signals_panel(panel: dict) -> Dict[str, dict]:
+    """``compute_pullback_signal`` for every ticker of a bar panel at once.
+
+    ``panel`` comes from ``build_bar_panel`` with close/high/low/volume
+    fields. Returns {code: signal} for tickers with at least 21 bars;
+    values match the per-ticker function exactly.
+    """
+    lengths = np.asarray(panel["lengths"])
+    keep = lengths >= 21
+    if not keep.any():
+        return {}
+
+    tickers = [t for t, k in zip(panel["tickers"], keep) if k]
+    lengths = lengths[keep]
+    closes = panel["close"][:, keep]
+    highs = panel["high"][:, keep]
+    lows = panel["low"][:, keep]
+    volumes = panel["volume"][:, keep]
+    depth = closes.shape[0]
+    started = np.arange(depth)[:, None] >= (depth - lengths)[None, :]
+
+    # Moving averages
+    ma21 = window_mean(closes, 21)
+    ma50 = np.where(lengths >= 50, window_mean(closes, min(50, depth)), ma21)
+    c = closes[-1]
+
+    # Distance from MA21
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dist = np.where(ma21 > 0, (c - ma21) / ma21 * 100, 0.0)
+
+    # Pivot/high zones, volume baseline
+    pivot_low_10 = np.min(lows[-10:], axis=0)
+    high_5 = np.max(highs[-5:], axis=0)
+    vol_sma20 = window_mean(volumes, 20)
+
+    # ATR14 and its SMA20 baseline
+    atr14, atr_sma20 = last_atr(highs, lows, closes, 14, 20)
+    atr_sma20 = atr14 if atr_sma20 is None else np.where(lengths >= 34, atr_sma20, atr14)
+
+    # RSI14
+    rsi14 = _panel_rsi(closes, started, 14)
+    rsi14 = np.where(np.isnan(rsi14), 50.0, rsi14)
+
+    with np.errstate(invalid="ignore"):
+        # Entry grading
+        trend_aligned = (ma21 > ma50) & (c > ma21)
+        trend_grade = np.where(trend_aligned, "A", np.where(ma21 > ma50, "B", "C"))
+
+        dist_ok = (-3 < dist) & (dist < 5)
+        dist_grade = np.where((-1 < dist) & (dist < 3), "A", np.where(dist_ok, "B", "C"))
+
+        near_pivot = c <= pivot_low_10 * 1.03
+        below_high = c < high_5
+        pivot_grade = np.where(near_pivot & below_high, "A", np.where(near_pivot | below_high, "B", "C"))
+
+        vol_dry = volumes[-1] < vol_sma20
+        atr_ok = atr14 < atr_sma20
+        vol_atr_grade = np.where(vol_dry & atr_ok, "A", np.where(vol_dry | atr_ok, "B", "C"))
+
+        rsi_entry_ok = (40 <= rsi14) & (rsi14 <= 60)
+        rsi_entry_ok_b = (35 <= rsi14) & (rsi14 <= 68)
+
+        entry_score = (trend_aligned.astype(int) + dist_ok + (near_pivot & below_high) + (vol_dry & atr_ok))
+        entry_grade_base = np.where(entry_score >= 3, "A", np.where(entry_score == 2, "B", "C"))
+        entry_grade = np.select(
+            [
+                (entry_grade_base == "B") & rsi_entry_ok,
+                (entry_grade_base == "C") & rsi_entry_ok_b & (entry_score == 1),
+                (entry_grade_base == "A") & (rsi14 > 72),
+            ],
+            ["A", "B", "B"],
+            default=entry_grade_base,
+        )
+
+        # Warning grading
+        warn_overheat = dist > 7
+        warn_vol_spike = volumes[-1] > vol_sma20 * 2
+        warn_atr_spike = atr14 > atr_sma20 * 1.5
+        warn_rsi_ob = (rsi14 > 70) | (rsi14 < 30)
+        warn_ma_break = c < ma21
+        warn_dead_cross = ma21 < ma50
+
+    warn_score = (warn_overheat.astype(int) + warn_vol_spike + warn_atr_spike
+                  + warn_rsi_ob + warn_ma_break + warn_dead_cross)
+    warn_grade = np.select(
+        [warn_score >= 3, warn_score == 2, warn_score == 1],
+        ["SELL", "WARN", "WATCH"],
+        default="SAFE",
+    )
+
+    signals: Dict[str, dict] = {}
+    for i, code in enumerate(tickers):
+        signals[code] = {
+            "entry_grade": str(entry_grade[i]),
+            "entry_score": int(entry_score[i]),
+            "trend_grade": str(trend_grade[i]),
+            "dist_grade": str(dist_grade[i]),
+            "dist_pct": round(float(dist[i]), 2),
+            "pivot_grade": str(pivot_grade[i]),
+            "vol_atr_grade": str(vol_atr_grade[i]),
+            "warn_grade": str(warn_grade[i]),
+            "warn_score": int(warn_score[i]),
+            "warn_overheat": bool(warn_overheat[i]),
+            "warn_vol_spike": bool(warn_vol_spike[i]),
+            "warn_atr_spike": bool(warn_atr_spike[i]),
+            "warn_rsi_ob": bool(warn_rsi_ob[i]),
+            "warn_ma_break": bool(warn_ma_break[i]),
+            "warn_dead_cross": bool(warn_dead_cross[i]),
+            "ma21": round(float(ma21[i]), 0),
+            "ma50": round(float(ma50[i]), 0),
+        }
+    return signals
+
+
+@traced()
 def save_pullback_signals(supabase: Client, trading_date: str):
     """Generate and store pullback signals."""
     trading_iso = to_iso(trading_date)
@@ -169,27 +274,31 @@ def save_pullback_signals(supabase: Client, trading_date: str):
         upserts = []
         fail_count = 0
 
-        for idx, code in enumerate(codes):
-            try:
-                h_res = supabase.table("stock_daily") \
-                    .select("date, open, high, low, close, volume, value") \
-                    .eq("ticker", code) \
-                    .gte("date", from_date_hist) \
-                    .order("date", desc=False) \
-                    .limit(100).execute()
-                if h_res.data and len(h_res.data) >= 21:
-                    sig = compute_pullback_signal(h_res.data)
+        hist_df = load_stock_daily_frame(
+            supabase, codes, from_date_hist,
+            columns="ticker, date, high, low, close, volume",
+        )
+        if not hist_df.empty:
+            hist_df = hist_df.groupby("ticker", sort=False).head(100)
+        panel = build_bar_panel(hist_df, fields=("close", "high", "low", "volume"))
+
+        try:
+            signals = compute_pullback_signals_panel(panel)
+        except Exception as e:
+            print(f"   panel signal computation failed ({e}), falling back to per-ticker")
+            signals = {}
+            for code, g in hist_df.groupby("ticker", sort=False):
+                try:
+                    sig = compute_pullback_signal(g.to_dict("records"))
                     if sig:
-                        upserts.append({
-                            "code": code,
-                            "trade_date": trading_iso,
-                            **sig,
-                        })
-            except:
-                fail_count += 1
-
-            if (idx + 1) % 100 == 0:
-                print(f"  -> progress: {idx + 1}/{len(codes)}")
+                        signals[code] = sig
+                except Exception:
+                    fail_count += 1
+
+        upserts = [
+            {"code": code, "trade_date": trading_iso, **signals[code]}
+            for code in codes if code in signals
+        ]
 
         print(f"  -> computed {len(upserts)} signals (fail: {fail_count})")
 
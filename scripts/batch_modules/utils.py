@@ -7,11 +7,13 @@ batch_modules/utils.py
 import os
 import sys
 import subprocess
+from collections import deque
 import numpy as np
 import pandas as pd
 from datetime import datetime, date, timedelta
 from zoneinfo import ZoneInfo
 from typing import Optional
+from .instrument import span, traced
 
 
 def safe_float(x, default=0.0):
@@ -90,10 +92,138 @@ def calculate_avwap(df: pd.DataFrame, anchor_idx: int) -> Optional[float]:
     return float((pv / v_cumsum).iloc[-1])
 
 
+def rolling_anchored_avwap(close, low, volume, window: int = 250) -> np.ndarray:
+    """AVWAP anchored at the trailing-``window`` low, for every bar, in O(n).
+
+    Row i equals ``calculate_avwap`` over the last ``window`` bars ending at i,
+    anchored at the first lowest low. A monotonic deque tracks the window
+    minimum and prefix sums of close*volume and volume give each VWAP.
+    """
+    close = np.asarray(close, dtype=float)
+    low = np.asarray(low, dtype=float)
+    volume = np.asarray(volume, dtype=float)
+    n = len(close)
+    out = np.full(n, np.nan)
+    if n == 0:
+        return out
+
+    pv_prefix = np.concatenate(([0.0], np.cumsum(np.nan_to_num(close * volume))))
+    v_prefix = np.concatenate(([0.0], np.cumsum(np.nan_to_num(volume))))
+    mins: deque = deque()
+    for i in range(n):
+        if not np.isnan(low[i]):
+            # keep older equal lows in front: the anchor is the first occurrence
+            while mins and low[mins[-1]] > low[i]:
+                mins.pop()
+            mins.append(i)
+        while mins and mins[0] <= i - window:
+            mins.popleft()
+        if not mins:
+            continue
+        a = mins[0]
+        v_sum = v_prefix[i + 1] - v_prefix[a]
+        if v_sum != 0:
+            out[i] = (pv_prefix[i + 1] - pv_prefix[a]) / v_sum
+    return out
+
+
+def last_anchored_avwap(close: np.ndarray, low: np.ndarray, volume: np.ndarray, window: int = 250) -> tuple:
+    """Last-bar anchored AVWAP for every column of right-aligned (bar x ticker) matrices.
+
+    Returns ``(avwap, anchor_row, sum_pv, sum_v)``; ``anchor_row`` is -1 for
+    columns without a usable low.
+    """
+    depth, n_cols = close.shape
+    out = np.full(n_cols, np.nan)
+    if depth == 0:
+        return out, np.full(n_cols, -1), np.zeros(n_cols), np.zeros(n_cols)
+    w = min(window, depth)
+    lows = np.where(np.isnan(low[-w:]), np.inf, low[-w:])
+    has_low = np.isfinite(lows).any(axis=0)
+    anchor = depth - w + lows.argmin(axis=0)
+
+    pv_suffix = np.cumsum(np.nan_to_num(close * volume)[::-1], axis=0)[::-1]
+    v_suffix = np.cumsum(np.nan_to_num(volume)[::-1], axis=0)[::-1]
+    cols = np.arange(n_cols)
+    sum_pv = np.where(has_low, pv_suffix[anchor, cols], 0.0)
+    sum_v = np.where(has_low, v_suffix[anchor, cols], 0.0)
+    ok = has_low & (sum_v != 0)
+    out[ok] = sum_pv[ok] / sum_v[ok]
+    return out, np.where(has_low, anchor, -1), sum_pv, sum_v
+
+
+def true_range(high, low, close) -> np.ndarray:
+    """True range along axis 0 of 1-D (bars) or 2-D (bars x tickers) arrays.
+
+    The first bar has no previous close and yields high - low. NaN handling
+    matches ``max(hl, abs(h - pc), abs(l - pc))``: a NaN alternative term is
+    ignored, a NaN high - low propagates.
+    """
+    high = np.asarray(high, dtype=float)
+    low = np.asarray(low, dtype=float)
+    close = np.asarray(close, dtype=float)
+    prev_close = np.concatenate([np.full_like(close[:1], np.nan), close[:-1]], axis=0)
+    tr = high - low
+    with np.errstate(invalid="ignore"):
+        for alt in (np.abs(high - prev_close), np.abs(low - prev_close)):
+            tr = np.where(alt > tr, alt, tr)
+    return tr
+
+
+def window_mean(values, width: int, end_offset: int = 0):
+    """Mean of the ``width`` values ending ``end_offset`` bars before the last (axis 0).
+
+    2-D windows are copied into contiguous (ticker x width) rows so each
+    column is summed in the same order as a 1-D ``np.mean`` of its slice.
+    """
+    values = np.asarray(values, dtype=float)
+    stop = values.shape[0] - end_offset
+    block = values[stop - width:stop]
+    if block.ndim == 1:
+        return np.mean(block)
+    return np.ascontiguousarray(block.T).mean(axis=1)
+
+
+def last_atr(high, low, close, period: int = 14, sma_window: int = 20) -> tuple:
+    """ATR(period) at the last bar and the SMA of the last ``sma_window`` ATR values.
+
+    Works on 1-D or 2-D (bars x tickers) arrays; callers mask tickers with
+    fewer than ``period + 1`` (ATR) or ``period + sma_window`` (SMA) bars.
+    Returns ``(atr, atr_sma)``; atr_sma is None when the history is too short.
+    """
+    tr = true_range(high, low, close)
+    depth = tr.shape[0]
+    atr = window_mean(tr, period) if depth >= period else np.full(tr.shape[1:], np.nan)
+    if depth < period + sma_window:
+        return atr, None
+    series = np.stack([window_mean(tr, period, end_offset=k) for k in range(sma_window - 1, -1, -1)], axis=-1)
+    return atr, np.ascontiguousarray(series).mean(axis=-1)
+
+
+def atr_percent(atr, close):
+    """ATR as a percentage of close (NaN where close is not positive)."""
+    atr = np.asarray(atr, dtype=float)
+    close = np.asarray(close, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(close > 0, atr / close * 100.0, np.nan)
+
+
 def get_last_trading_date() -> str:
-    """Detect the most recent trading date in KST."""
+    """Detect the most recent trading date in KST.
+
+    Uses the cached KRX calendar; probes sentinel tickers day by day only
+    when the calendar cannot be built.
+    """
     from pykrx import stock
-    
+    from .calendar import last_trading_day
+
+    try:
+        d_str = last_trading_day()
+        print(f"   Latest trading date (calendar): {d_str}", flush=True)
+        return d_str
+    except Exception as e:
+        print(f"   Trading calendar unavailable ({e}), probing sentinel tickers...", flush=True)
+
     today = datetime.now(ZoneInfo("Asia/Seoul")).date()
     test_tickers = ["005930", "035420", "035720", "000660"]
     print("   Detecting latest trading date...", flush=True)
@@ -105,7 +235,8 @@ def get_last_trading_date() -> str:
         valid_count = 0
         for ticker in test_tickers:
             try:
-                check = stock.get_market_ohlcv(d_str, d_str, ticker)
+                with span("pykrx.ohlcv_probe", requests=1):
+                    check = stock.get_market_ohlcv(d_str, d_str, ticker)
                 # Treat non-empty OHLCV as a valid trading-day signal.
                 # Avoid hardcoded localized column names that can break under encoding issues.
                 if check is not None and not check.empty:
@@ -160,6 +291,49 @@ def run_python_script(script_path: str, args: list[str], label: str) -> bool:
         return False
 
 
+BULK_PATCH_CHUNK = 500
+
+
+@traced()
+def bulk_patch(supabase, table: str, key: str, patches: list, chunk: int = BULK_PATCH_CHUNK) -> int:
+    """Apply sparse per-row patches ``[{key: ..., col: value, ...}]`` to ``table``.
+
+    Sends ``{key, patch}`` arrays to the bulk_patch_rows() RPC, ``chunk`` rows
+    per request; only columns present in a patch are written. Falls back to
+    one ``update().eq()`` per row when the RPC is not deployed. Returns the
+    number of rows updated.
+    """
+    merged: dict = {}
+    for row in patches:
+        patch = {k: v for k, v in row.items() if k != key}
+        if patch:
+            merged.setdefault(str(row[key]), {}).update(patch)
+    payload = [{"key": k, "patch": v} for k, v in merged.items()]
+    if not payload:
+        return 0
+
+    updated = 0
+    use_rpc = True
+    for i in range(0, len(payload), chunk):
+        batch = payload[i:i + chunk]
+        if use_rpc:
+            try:
+                res = supabase.rpc("bulk_patch_rows", {"p_table": table, "p_key": key, "p_rows": batch}).execute()
+                updated += safe_int(res.data)
+                continue
+            except Exception as e:
+                print(f"   bulk_patch_rows rpc unavailable, updating {table} row by row: {e}")
+                use_rpc = False
+        for item in batch:
+            try:
+                res = supabase.table(table).update(item["patch"]).eq(key, item["key"]).execute()
+                if res.data:
+                    updated += 1
+            except Exception:
+                pass
+    return updated
+
+
 def load_env_file(filepath=".env"):
     """?? ?? ??"""
     try:
@@ -5,9 +5,10 @@ scripts/daily_batch.py - Daily batch processor
 
 Orchestrates data collection, processing, and cleanup operations.
 
-Steps:
+Steps (run as a dependency graph; 2, 2.5 and 2.6 overlap once OHLCV is in):
   0. Auto-backfill missing trading dates
   1. Collect OHLCV data (stock_daily table)
+  1.5. Refresh local OHLCV cache (Arrow IPC, read by later stages)
   2. Calculate technical indicators (daily_indicators table)
   2.5. Collect investor flow data
   2.6. Collect credit/short-selling data
@@ -20,6 +21,26 @@ Environment variables:
   SUPABASE_URL                      - Supabase project URL
   SUPABASE_SERVICE_ROLE_KEY         - Supabase service role API key
   DAILY_INDICATORS_RETENTION_DAYS   - Retention days for daily_indicators (default: 400)
+  INDICATOR_MODE                    - incremental (default, uses daily_indicator_state) or full
+  OHLCV_CACHE_ENABLED               - Local Arrow OHLCV cache shared by stages (default: true, needs pyarrow)
+  OHLCV_CACHE_DIR                   - Cache directory (default: .cache/ohlcv)
+  OHLCV_CACHE_MAX_AGE_DAYS          - Cold-rebuild the cache after N days (default: 7, 0 = never)
+  OHLCV_FETCH_WORKERS               - Concurrent pykrx OHLCV requests (default: 4)
+  OHLCV_FETCH_RPS                   - Shared request-rate ceiling in req/s (default: 6)
+  OHLCV_FETCH_TIMEOUT               - Per-request timeout in seconds (default: 20)
+  OHLCV_SNAPSHOT_MAX_DAYS           - Use whole-market snapshots when the gap is <= N weekdays (default: 10)
+  INVESTOR_KIS_WORKERS              - Concurrent KIS investor requests (default: 8)
+  INVESTOR_KIS_RPS                  - KIS request-rate ceiling in req/s (default: 15)
+  INVESTOR_FALLBACK_WORKERS         - Concurrent Naver fallback requests when KIS fails (default: 8)
+  INVESTOR_FALLBACK_RPS             - Naver fallback request-rate ceiling in req/s (default: 10)
+  KRX_WORKERS                       - Concurrent KRX short-selling requests (default: 4)
+  KRX_RPS                           - KRX request-rate ceiling in req/s, halved on LOGOUT (default: 5)
+  KRX_ISIN_TTL_HOURS                - Lifetime of the cached KRX ISIN map (default: 24)
+  KRX_CACHE_DIR                     - ISIN map cache directory (default: .cache/krx)
+  BATCH_STAGE_WORKERS               - Stages allowed to run concurrently (default: 3)
+  BATCH_PROFILER                    - Profiler for --profile: cprofile (default; covers pool threads,
+                                      per-stage files before Python 3.12, one batch.prof from 3.12)
+                                      or pyinstrument (stage threads only)
 """
 
 import os
@@ -39,6 +60,7 @@ sys.path.insert(0, str(Path(__file__).parent))
 from batch_modules.utils import load_env_file, get_last_trading_date
 from batch_modules.backfill import auto_backfill_missing_dates
 from batch_modules.ohlcv import fetch_ohlcv_per_ticker
+from batch_modules.ohlcv_cache import refresh_ohlcv_cache, activate_existing as activate_ohlcv_cache, reset_cache as reset_ohlcv_cache
 from batch_modules.indicators import calculate_indicators
 from batch_modules.investor import fetch_investor_data
 from batch_modules.credit_short import fetch_credit_short_data
@@ -46,6 +68,10 @@ from batch_modules.sectors import update_sector_data, populate_sector_daily, cal
 from batch_modules.scores import calculate_stock_scores
 from batch_modules.signals import save_pullback_signals
 from batch_modules.cleanup import cleanup_old_data
+from batch_modules.scheduler import Stage, run_stages
+from batch_modules.checkpoint import StageCheckpoints
+from batch_modules.instrument import instrument_supabase, snapshot as instrument_snapshot
+from batch_modules.history import TARGET_SECONDS
 
 
 def send_telegram_alert(text: str) -> bool:
@@ -109,29 +135,16 @@ def sync_scan_signal_history_for_date(trading_date: str) -> bool:
         return False
 
 
-def refresh_universe_membership_for_date(trading_date: str) -> bool:
-    """Refresh universe membership before downstream batch stages."""
-    cmd = [
-        sys.executable,
-        "scripts/refresh_universe_membership.py",
-        "--date",
-        trading_date,
-    ]
+def refresh_universe_membership_for_date(supabase, trading_date: str) -> bool:
+    """Refresh universe membership before downstream batch stages (in-process)."""
     print("\n[-1/7] Refreshing universe membership...")
-    print(f"  -> {' '.join(cmd)}")
     try:
-        result = subprocess.run(
-            cmd,
-            check=True,
-            capture_output=True,
-            text=True,
-            encoding="utf-8",
-            errors="replace",
-        )
-        out = (result.stdout or "").strip().splitlines()
-        if out:
-            print(f"   {out[-1]}")
-        return True
+        from refresh_universe_membership import refresh_universe_membership
+
+        status = refresh_universe_membership(supabase, trading_date)
+        summary = status.get("summary") or {}
+        print(f"   universe refresh: {status.get('status')} listed={summary.get('listed_count')} upserted={summary.get('upserted')}")
+        return status.get("status") == "success"
     except Exception as e:
         print(f"  [WARN] universe refresh failed: {e}")
         return False
@@ -142,6 +155,10 @@ def _status_paths() -> tuple[Path, Path]:
     return base / "daily_batch_status.json", base / "daily_batch_history.ndjson"
 
 
+def _checkpoint_path() -> Path:
+    return _status_paths()[0].with_name("daily_batch_checkpoint.json")
+
+
 def _write_batch_status(snapshot: dict):
     status_path, history_path = _status_paths()
     status_path.parent.mkdir(parents=True, exist_ok=True)
@@ -170,7 +187,7 @@ def main():
     
     from supabase import create_client
     print("[DEBUG] Creating Supabase client...", flush=True)
-    supabase = create_client(supabase_url, supabase_key)
+    supabase = instrument_supabase(create_client(supabase_url, supabase_key))
     print("[DEBUG] Supabase client initialized", flush=True)
     sys.stdout.flush()
     
@@ -181,16 +198,21 @@ def main():
     print(f"      --date YYYYMMDD      : Specify trading date (e.g., --date 20260515)", flush=True)
     print(f"      --skip-ohlcv         : Skip OHLCV collection (start from indicators)", flush=True)
     print(f"      --reset-stock-data   : Reinitialize stock_daily table", flush=True)
+    print(f"      --resume             : Skip stages whose checkpoint matches this run's inputs", flush=True)
+    print(f"      --profile            : Write profiler output under logs/profiles/<run_id> (per stage before Python 3.12, one batch.prof after)", flush=True)
 
     # Parse command-line arguments
     skip_ohlcv = "--skip-ohlcv" in sys.argv
     reset_stock_data = "--reset-stock-data" in sys.argv
+    resume = "--resume" in sys.argv
+    profile = "--profile" in sys.argv
     require_investor_data = os.environ.get("BATCH_REQUIRE_INVESTOR_DATA", "false").lower() in ("1", "true", "yes")
     require_score_sync = os.environ.get("BATCH_REQUIRE_SCORE_SYNC", "true").lower() in ("1", "true", "yes")
     require_engine_score = os.environ.get("BATCH_REQUIRE_ENGINE_SCORE", "false").lower() in ("1", "true", "yes")
     auto_refresh_universe = os.environ.get("BATCH_AUTO_REFRESH_UNIVERSE", "false").lower() in ("1", "true", "yes")
     require_universe_refresh = os.environ.get("BATCH_REQUIRE_UNIVERSE_REFRESH", "false").lower() in ("1", "true", "yes")
     investor_max_stale_business_days = int(os.environ.get("INVESTOR_MAX_STALE_BUSINESS_DAYS", "1"))
+    stage_workers = max(1, int(os.environ.get("BATCH_STAGE_WORKERS", "3")))
 
     run_id = f"daily-batch-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
     run_started_at = datetime.now().isoformat()
@@ -211,6 +233,9 @@ def main():
             "auto_refresh_universe": auto_refresh_universe,
             "require_universe_refresh": require_universe_refresh,
             "investor_max_stale_business_days": investor_max_stale_business_days,
+            "stage_workers": stage_workers,
+            "resume": resume,
+            "profile": profile,
         },
         "stages": {},
         "summary": {},
@@ -236,6 +261,7 @@ def main():
         started = datetime.fromisoformat(run_started_at)
         finished = datetime.fromisoformat(finished_at)
         run_status["duration_seconds"] = round((finished - started).total_seconds(), 3)
+        run_status["instrumentation"] = instrument_snapshot()
         _write_batch_status(run_status)
         finalized = True
         return code
@@ -255,17 +281,6 @@ def main():
         print(f"   Trading date (auto-detected): {trading_date}", flush=True)
     run_status["processed_date"] = trading_date
 
-    # Optional universe automation
-    if auto_refresh_universe:
-        step_start = time.time()
-        universe_ok = refresh_universe_membership_for_date(trading_date)
-        elapsed = time.time() - step_start
-        stage_times["UniverseRefresh"] = elapsed
-        mark_stage("UniverseRefresh", bool(universe_ok), elapsed, {"trading_date": trading_date})
-        if not universe_ok and require_universe_refresh:
-            print("[ERROR] BATCH_REQUIRE_UNIVERSE_REFRESH=true and universe refresh failed")
-            return finalize("failed", "universe_refresh_failed", 5)
-
     # Reset stock_daily if requested
     if reset_stock_data:
         print(f"\n[RESET] --reset-stock-data flag detected")
@@ -274,51 +289,71 @@ def main():
             print(f"[OK] stock_daily table reinitialized")
         except Exception as e:
             print(f"[WARN] Reinitialization failed: {e}")
+        # the local cache mirrors the rows just deleted
+        reset_ohlcv_cache("--reset-stock-data")
+
+    if resume and reset_stock_data:
+        print("[WARN] --resume ignored: --reset-stock-data rewrites stage inputs")
+        resume = False
+        run_status["config"]["resume"] = False
+    checkpoint_config = {k: v for k, v in run_status["config"].items() if k not in ("stage_workers", "resume", "profile")}
+    checkpoints = StageCheckpoints(_checkpoint_path(), trading_date, run_id, checkpoint_config, resume=resume)
 
-    # Track execution times
-    stage_times = {}
     start_time = time.time()
 
-    # Step 0: Auto-backfill missing dates
-    print(f"\n[0/7] Auto-backfill missing dates...")
-    step_start = time.time()
-    auto_backfill_done = auto_backfill_missing_dates(supabase, trading_date)
-    mark_stage("AutoBackfill", True, time.time() - step_start, {"auto_backfill_done": bool(auto_backfill_done)})
-    
-    # Step 1: OHLCV collection (skip if auto-backfill already done or --skip-ohlcv)
-    if skip_ohlcv or auto_backfill_done:
-        if auto_backfill_done:
-            print("\n[1/7] OHLCV collection skipped (auto-backfill completed)")
-        else:
-            print("\n[1/7] OHLCV collection skipped (--skip-ohlcv flag)")
-        market_ok = True
-    else:
+    def stage_universe_refresh() -> dict:
+        ok = refresh_universe_membership_for_date(supabase, trading_date)
+        if not ok and require_universe_refresh:
+            print("[ERROR] BATCH_REQUIRE_UNIVERSE_REFRESH=true and universe refresh failed")
+        return {"ok": bool(ok), "detail": {"trading_date": trading_date}}
+
+    def stage_auto_backfill() -> dict:
+        print(f"\n[0/7] Auto-backfill missing dates...")
+        done = bool(auto_backfill_missing_dates(supabase, trading_date))
+        return {"ok": True, "detail": {"auto_backfill_done": done}}
+
+    def stage_ohlcv() -> dict:
+        # Skip OHLCV if auto-backfill already done or --skip-ohlcv
+        # (read from the marked stage so a resumed AutoBackfill still counts)
+        auto_backfill_done = bool(run_status["stages"].get("AutoBackfill", {}).get("detail", {}).get("auto_backfill_done"))
+        if skip_ohlcv or auto_backfill_done:
+            if auto_backfill_done:
+                print("\n[1/7] OHLCV collection skipped (auto-backfill completed)")
+            else:
+                print("\n[1/7] OHLCV collection skipped (--skip-ohlcv flag)")
+            return {"ok": True, "detail": {"skipped": "auto_backfill" if auto_backfill_done else "skip_ohlcv"}}
         print("\n[1/7] OHLCV collection starting...")
-        step_start = time.time()
         market_ok = fetch_ohlcv_per_ticker(supabase, trading_date)
-        stage_times["OHLCV"] = time.time() - step_start
-        print(f"   Completed in {stage_times['OHLCV']:.1f}s")
-        mark_stage("OHLCV", bool(market_ok), stage_times["OHLCV"])
-
-    if market_ok:
-        time.sleep(1)
-        
-        # Step 2: Technical indicators
+        if not market_ok:
+            print("\n[WARN] Market data not available, skipping downstream steps")
+            print("\n[INFO] Troubleshooting:")
+            print("   1. Check pykrx API status (Naver Finance may be blocked)")
+            print("   2. Explicitly specify trading date: --date 20260515")
+            print("   3. Reinit DB and retry: --reset-stock-data --date 20260515")
+            return {"ok": False, "detail": {"reason": "market_not_available"}}
+        return {"ok": True, "detail": {}}
+
+    def stage_ohlcv_cache() -> dict:
+        # Local OHLCV cache shared by the downstream stages
+        print("\n[1.5/7] Refreshing local OHLCV cache...")
+        cache_status = refresh_ohlcv_cache(supabase, trading_date)
+        ok = bool(cache_status.get("ok")) or cache_status.get("reason") == "disabled"
+        return {"ok": ok, "rows": cache_status.get("delta_rows"), "detail": cache_status}
+
+    def resume_ohlcv_cache(detail: dict) -> bool:
+        # a resumed refresh never ran in this process; reactivate the cache on disk
+        if detail.get("reason") == "disabled":
+            return True
+        return activate_ohlcv_cache(detail.get("watermark"), detail.get("rows"))
+
+    def stage_indicators() -> dict:
         print("\n[2/7] Calculating indicators...")
-        step_start = time.time()
         calculate_indicators(supabase, trading_date)
-        stage_times["Indicators"] = time.time() - step_start
-        print(f"   Completed in {stage_times['Indicators']:.1f}s")
-        mark_stage("Indicators", True, stage_times["Indicators"])
-        
-        time.sleep(1)
-        
-        # Step 2.5: Investor flow data
+        return {"ok": True, "detail": {}}
+
+    def stage_investor() -> dict:
         print("\n[2.5/7] Collecting investor data...")
-        step_start = time.time()
         investor_status = fetch_investor_data(supabase, trading_date)
-        stage_times["InvestorData"] = time.time() - step_start
-        print(f"   Completed in {stage_times['InvestorData']:.1f}s")
 
         investor_stage_ok = bool(investor_status.get("ok"))
         stale_days = investor_status.get("stale_business_days")
@@ -328,129 +363,112 @@ def main():
                 "[WARN] Investor freshness gate failed: "
                 f"lag={stale_days} business days (max={investor_max_stale_business_days})"
             )
+        if investor_stage_ok:
+            return {"ok": True, "rows": investor_status.get("stored_count"), "detail": investor_status}
+
+        reason = investor_status.get("reason") or "unknown"
+        stale_info = f" (lag={stale_days}일)" if stale_days is not None else ""
+        print(f"[WARN] Investor data quality gate failed: reason={reason}, status={investor_status}")
+        alert_msg = (
+            f"⚠️ [배치 경보] investor_daily 수집 실패\n"
+            f"날짜: {trading_date}\n"
+            f"사유: {reason}{stale_info}\n"
+            f"영향: 외국인/기관 수급 신호 부정확 → 자동매매 신호 품질 저하\n"
+            f"조치: GitHub Actions 로그 확인 필요"
+        )
+        send_telegram_alert(alert_msg)
+        if require_investor_data:
+            print("[ERROR] BATCH_REQUIRE_INVESTOR_DATA=true and investor data gate failed")
+        return {"ok": False, "reason": reason, "detail": investor_status}
 
-        if not investor_stage_ok:
-            reason = investor_status.get("reason") or "unknown"
-            stale_info = f" (lag={stale_days}일)" if stale_days is not None else ""
-            print(f"[WARN] Investor data quality gate failed: reason={reason}, status={investor_status}")
-            mark_stage("InvestorData", False, stage_times["InvestorData"], investor_status)
-            alert_msg = (
-                f"⚠️ [배치 경보] investor_daily 수집 실패\n"
-                f"날짜: {trading_date}\n"
-                f"사유: {reason}{stale_info}\n"
-                f"영향: 외국인/기관 수급 신호 부정확 → 자동매매 신호 품질 저하\n"
-                f"조치: GitHub Actions 로그 확인 필요"
-            )
-            send_telegram_alert(alert_msg)
-            if require_investor_data:
-                print("[ERROR] BATCH_REQUIRE_INVESTOR_DATA=true and investor data gate failed")
-                return finalize("failed", f"investor_gate_failed:{reason}", 2)
-        else:
-            mark_stage("InvestorData", True, stage_times["InvestorData"], investor_status)
-        
-        time.sleep(1)
-        
-        # Step 2.6: Credit/short-selling data
+    def stage_credit_short() -> dict:
         print("\n[2.6/7] Collecting credit/short data...")
-        step_start = time.time()
         fetch_credit_short_data(supabase, trading_date)
-        stage_times["CreditShortData"] = time.time() - step_start
-        print(f"   Completed in {stage_times['CreditShortData']:.1f}s")
-        mark_stage("CreditShortData", True, stage_times["CreditShortData"])
-        
-        time.sleep(1)
-        
-        # Step 3-4: Sector processing
+        return {"ok": True, "detail": {}}
+
+    def stage_sectors() -> dict:
         print("\n[3/7] Updating sector data...")
-        step_start = time.time()
         update_sector_data(supabase, trading_date)
-        print(f"   Completed in {time.time() - step_start:.1f}s")
-        
-        time.sleep(0.5)
-        
         print("[4/7] Populating sector daily data...")
-        step_start = time.time()
         populate_sector_daily(supabase)
-        print(f"   Completed in {time.time() - step_start:.1f}s")
-        
-        time.sleep(0.5)
-        
-        step_start = time.time()
         aggregate_sector_investor_flows(supabase)
-        print(f"   Completed in {time.time() - step_start:.1f}s")
-
         print("[4.1/7] Calculating sector scores...")
-        step_start = time.time()
         calculate_sector_scores(supabase)
-        print(f"   Completed in {time.time() - step_start:.1f}s")
-        stage_times["SectorData"] = time.time() - step_start
-        mark_stage("SectorData", True, stage_times["SectorData"])
-
-        step_start = time.time()
         mark_sector_leaders(supabase)
-        print(f"   Completed in {time.time() - step_start:.1f}s")
+        return {"ok": True, "detail": {}}
 
-        time.sleep(1)
-
-        # Step 5: Stock scores
+    def stage_scores() -> dict:
         print("\n[5/7] Calculating stock scores...")
-        step_start = time.time()
         score_result = calculate_stock_scores(supabase, trading_date)
-        stage_times["StockScores"] = time.time() - step_start
-        print(f"   Completed in {stage_times['StockScores']:.1f}s")
         score_ok = bool(score_result.get("ok"))
         score_source = str(score_result.get("source") or "unknown")
-        mark_stage("StockScores", score_ok, stage_times["StockScores"], score_result)
-
         if not score_ok:
             print("[WARN] Stock score stage failed (engine and fallback unavailable)")
             if require_score_sync:
                 print("[ERROR] BATCH_REQUIRE_SCORE_SYNC=true and score stage failed")
-                return finalize("failed", "score_stage_failed", 3)
-
+        out = {"ok": score_ok, "rows": score_result.get("rows"), "detail": score_result}
         if score_ok and require_engine_score and score_source != "engine":
             print("[ERROR] BATCH_REQUIRE_ENGINE_SCORE=true but engine sync was not used")
-            return finalize("failed", f"engine_required_but_used_{score_source}", 4)
-        
-        time.sleep(1)
-        
-        # Step 6: Pullback signals
-        if score_ok:
-            print("\n[6/7] Generating pullback signals...")
-            step_start = time.time()
-            save_pullback_signals(supabase, trading_date)
-            stage_times["PullbackSignals"] = time.time() - step_start
-            print(f"   Completed in {stage_times['PullbackSignals']:.1f}s")
-            mark_stage("PullbackSignals", True, stage_times["PullbackSignals"])
-
-            step_start = time.time()
-            scan_sync_ok = sync_scan_signal_history_for_date(trading_date)
-            stage_times["ScanSignalHistorySync"] = time.time() - step_start
-            print(f"   Completed in {stage_times['ScanSignalHistorySync']:.1f}s")
-            mark_stage("ScanSignalHistorySync", bool(scan_sync_ok), stage_times["ScanSignalHistorySync"])
-        else:
-            print("\n[6/7] Pullback signals skipped (score stage failed)")
-            mark_stage("PullbackSignals", False, 0.0, {"reason": "score_stage_failed"})
-        
-        time.sleep(0.5)
-    else:
-        print("\n[WARN] Market data not available, skipping downstream steps")
-        print("\n[INFO] Troubleshooting:")
-        print("   1. Check pykrx API status (Naver Finance may be blocked)")
-        print("   2. Explicitly specify trading date: --date 20260515")
-        print("   3. Reinit DB and retry: --reset-stock-data --date 20260515")
-        mark_stage("OHLCV", False, stage_times.get("OHLCV", 0.0), {"reason": "market_not_available"})
-
-    # Step 7: Cleanup
-    print("\n[7/7] Cleaning up old data...")
-    step_start = time.time()
-    cleanup_old_data(supabase)
-    print(f"   Completed in {time.time() - step_start:.1f}s")
-    stage_times["Cleanup"] = time.time() - step_start
-    mark_stage("Cleanup", True, stage_times["Cleanup"])
+            out["abort"] = (f"engine_required_but_used_{score_source}", 4)
+        return out
+
+    def stage_pullback() -> dict:
+        print("\n[6/7] Generating pullback signals...")
+        save_pullback_signals(supabase, trading_date)
+        return {"ok": True, "detail": {}}
+
+    def stage_scan_sync() -> dict:
+        return {"ok": bool(sync_scan_signal_history_for_date(trading_date)), "detail": {}}
+
+    def stage_cleanup() -> dict:
+        print("\n[7/7] Cleaning up old data...")
+        cleanup_old_data(supabase)
+        return {"ok": True, "detail": {}}
+
+    # Stage graph: investor (KIS), credit/short (KRX) and indicators only need
+    # OHLCV and hit different upstreams, so they overlap on the worker pool.
+    pre = ("UniverseRefresh",) if auto_refresh_universe else ()
+    stages = [
+        Stage("AutoBackfill", stage_auto_backfill, deps=pre, timeout=1200),
+        Stage("OHLCV", stage_ohlcv, deps=("AutoBackfill",), timeout=1200),
+        Stage("OhlcvCache", stage_ohlcv_cache, requires=("OHLCV",), timeout=300, on_resume=resume_ohlcv_cache),
+        Stage("Indicators", stage_indicators, deps=("OhlcvCache",), requires=("OHLCV",), timeout=900),
+        Stage("InvestorData", stage_investor, requires=("OHLCV",), timeout=900,
+              gate="investor_gate_failed" if require_investor_data else None, exit_code=2),
+        Stage("CreditShortData", stage_credit_short, requires=("OHLCV",), timeout=900),
+        Stage("SectorData", stage_sectors, deps=("OhlcvCache", "InvestorData"), requires=("OHLCV",), timeout=600),
+        Stage("StockScores", stage_scores, deps=("Indicators", "SectorData", "CreditShortData"),
+              requires=("OHLCV",), timeout=900,
+              gate="score_stage_failed" if require_score_sync else None, exit_code=3),
+        Stage("PullbackSignals", stage_pullback, requires=("StockScores",), timeout=600),
+        Stage("ScanSignalHistorySync", stage_scan_sync, requires=("PullbackSignals",), timeout=300),
+        Stage("Cleanup", stage_cleanup,
+              deps=("PullbackSignals", "ScanSignalHistorySync", "StockScores", "CreditShortData"), timeout=300),
+    ]
+    if auto_refresh_universe:
+        stages.insert(0, Stage("UniverseRefresh", stage_universe_refresh, timeout=300,
+                               gate="universe_refresh_failed" if require_universe_refresh else None,
+                               exit_code=5))
+
+    print(f"\n   Stage workers: {stage_workers}", flush=True)
+    profile_dir = _status_paths()[0].parent / "profiles" / run_id if profile else None
+    outcome = run_stages(stages, mark_stage, workers=stage_workers, checkpoints=checkpoints, profile_dir=profile_dir)
+    stage_times = outcome["stage_times"]
+    total_time = time.time() - start_time
+    run_status["summary"] = {
+        "total_time_seconds": round(total_time, 3),
+        "stage_times": {k: round(v, 3) for k, v in stage_times.items()},
+        "critical_path": outcome["critical_path"],
+        "critical_path_seconds": outcome["critical_path_seconds"],
+        "resumed_stages": outcome["resumed"],
+    }
+
+    if outcome["aborted"]:
+        reason, code = outcome["aborted"]
+        print(f"[ERROR] Batch aborted by stage gate: {reason}")
+        return finalize("failed", reason, code)
 
     # Summary
-    total_time = time.time() - start_time
     print(f"\n[COMPLETE] Daily batch completed in {total_time:.1f}s")
     print(f"   Date processed: {trading_date}")
     if stage_times:
@@ -458,14 +476,24 @@ def main():
         for stage, elapsed in sorted(stage_times.items(), key=lambda x: x[1], reverse=True):
             pct = (elapsed / total_time * 100) if total_time > 0 else 0
             print(f"      {stage}: {elapsed:.1f}s ({pct:.1f}%)")
+        print(f"   Critical path: {' -> '.join(outcome['critical_path'])} ({outcome['critical_path_seconds']:.1f}s)")
+    if outcome["resumed"]:
+        print(f"   Resumed from checkpoint: {', '.join(outcome['resumed'])}")
+    top_spans = sorted(
+        ((stage, name, agg) for stage, spans in instrument_snapshot()["stages"].items() for name, agg in spans.items()),
+        key=lambda x: x[2]["seconds"], reverse=True,
+    )[:8]
+    if top_spans:
+        print(f"   Hot spans:")
+        for stage, name, agg in top_spans:
+            extra = " ".join(f"{k}={agg[k]}" for k in ("requests", "rows", "bytes", "retries", "errors") if agg.get(k))
+            print(f"      {stage}/{name}: {agg['seconds']:.1f}s calls={agg['calls']} {extra}".rstrip())
+    if profile_dir is not None:
+        print(f"   Profiles: {profile_dir}")
     
-    if total_time > 600:
-        print(f"[WARN] Batch took {total_time/60:.1f}min (target: <10min)")
-
-    run_status["summary"] = {
-        "total_time_seconds": round(total_time, 3),
-        "stage_times": {k: round(v, 3) for k, v in stage_times.items()},
-    }
+    if total_time > TARGET_SECONDS:
+        print(f"[WARN] Batch took {total_time/60:.1f}min (target: <{TARGET_SECONDS/60:.0f}min)")
+        print("   Trend report: python scripts/report_batch_history.py")
 
     print(f"\n[END] Daily Batch End: {datetime.now().isoformat()}")
     return finalize("success", "", 0)
@@ -28,6 +28,9 @@ import requests
 import pandas as pd
 from supabase import Client, create_client
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from batch_modules.krx import get_krx_client
+
 
 def parse_args() -> argparse.Namespace:
     p = argparse.ArgumentParser(description="Generate upload CSV from KRX short trade API")
@@ -150,6 +153,13 @@ def fetch_total_volume_naver(code6: str, iso_date: str) -> int:
 
 
 def resolve_isu_code(session: requests.Session, code6: str) -> str:
+    # Shared, disk-cached finder_stkisu map first; per-code finder lookup otherwise
+    try:
+        isin = get_krx_client().isin_map().get(code6)
+        if isin:
+            return isin
+    except Exception:
+        pass
     url = "https://data.krx.co.kr/comm/bldAttendant/getJsonData.cmd?bld=dbms/comm/finder/get_srtisu"
     try:
         r = session.post(url, data={"isuCd": code6, "locale": "ko_KR"}, timeout=20)
@@ -30,6 +30,8 @@ import requests
 from pykrx import stock
 from supabase import Client, create_client
 
+from batch_modules.instrument import span
+
 
 @dataclass
 class UniverseConfig:
@@ -131,8 +133,9 @@ def resolve_trading_date(explicit: Optional[str]) -> str:
         d = today - timedelta(days=i)
         d_str = d.strftime("%Y%m%d")
         try:
-            kospi = stock.get_market_ticker_list(d_str, market="KOSPI")
-            kosdaq = stock.get_market_ticker_list(d_str, market="KOSDAQ")
+            with span("pykrx.ticker_list", requests=2):
+                kospi = stock.get_market_ticker_list(d_str, market="KOSPI")
+                kosdaq = stock.get_market_ticker_list(d_str, market="KOSDAQ")
             if kospi or kosdaq:
                 return d_str
         except Exception:
@@ -209,10 +212,11 @@ def send_telegram_alert(text: str) -> bool:
 
 
 def load_market_frames(trading_date: str) -> Tuple[pd.DataFrame, Dict[str, str], Dict[str, str]]:
-    market_tickers = {
-        "KOSPI": stock.get_market_ticker_list(trading_date, market="KOSPI"),
-        "KOSDAQ": stock.get_market_ticker_list(trading_date, market="KOSDAQ"),
-    }
+    with span("pykrx.ticker_list", requests=2):
+        market_tickers = {
+            "KOSPI": stock.get_market_ticker_list(trading_date, market="KOSPI"),
+            "KOSDAQ": stock.get_market_ticker_list(trading_date, market="KOSDAQ"),
+        }
 
     name_by_code: Dict[str, str] = {}
     market_by_code: Dict[str, str] = {}
@@ -220,13 +224,15 @@ def load_market_frames(trading_date: str) -> Tuple[pd.DataFrame, Dict[str, str],
         for code in tickers:
             market_by_code[code] = market
             try:
-                name_by_code[code] = stock.get_market_ticker_name(code)
+                with span("pykrx.ticker_name", requests=1):
+                    name_by_code[code] = stock.get_market_ticker_name(code)
             except Exception:
                 name_by_code[code] = code
 
     cap_frames: List[pd.DataFrame] = []
     for market in ("KOSPI", "KOSDAQ"):
-        df = stock.get_market_cap(trading_date, market=market)
+        with span("pykrx.market_cap", requests=1):
+            df = stock.get_market_cap(trading_date, market=market)
         if df is None or df.empty:
             continue
         df = df.copy()
@@ -423,37 +429,35 @@ def apply_inactive_updates(supabase: Client, codes: List[str]) -> int:
     return updated
 
 
-def main() -> int:
-    parser = argparse.ArgumentParser(description="Refresh stocks universe membership")
-    parser.add_argument("--date", type=str, help="Trading date YYYYMMDD")
-    parser.add_argument("--dry-run", action="store_true")
-    parser.add_argument("--mark-missing-inactive", action="store_true")
-    args = parser.parse_args()
-
-    load_env_file()
-
-    supabase_url = os.environ.get("SUPABASE_URL")
-    supabase_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY") or os.environ.get("SUPABASE_SERVICE_KEY")
-    if not supabase_url or not supabase_key:
-        print("[ERROR] SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY missing")
-        return 1
-
-    cfg = UniverseConfig(
+def load_universe_config(mark_missing_inactive: bool = False) -> UniverseConfig:
+    return UniverseConfig(
         core_top_n=env_int("UNIVERSE_CORE_TOP_N", 200),
         extended_top_n=env_int("UNIVERSE_EXTENDED_TOP_N", 500),
         min_price=env_int("UNIVERSE_MIN_PRICE", 1000),
         min_market_cap=env_int("UNIVERSE_MIN_MARKET_CAP", 300_000_000_000),
         min_liquidity=env_int("UNIVERSE_MIN_LIQUIDITY", 5_000_000_000),
         allowed_markets=env_csv_set("UNIVERSE_ALLOWED_MARKETS", "KOSPI,KOSDAQ"),
-        mark_missing_inactive=args.mark_missing_inactive
+        mark_missing_inactive=mark_missing_inactive
         or env_bool("UNIVERSE_MARK_MISSING_INACTIVE", False),
         missing_grace_runs=env_int("UNIVERSE_MISSING_GRACE_RUNS", 3),
         min_listed_count_guard=env_int("UNIVERSE_MIN_LISTED_COUNT_GUARD", 1000),
         notify_always=env_bool("UNIVERSE_ALERT_ALWAYS", False),
     )
 
+
+def refresh_universe_membership(
+    supabase: Client,
+    trading_date: str,
+    dry_run: bool = False,
+    cfg: Optional[UniverseConfig] = None,
+) -> dict:
+    """Refresh universe levels for ``trading_date`` with an existing client.
+
+    Writes the status/history artifacts and returns the status snapshot
+    (``status`` is "success" or "failed").
+    """
+    cfg = cfg or load_universe_config()
     run_id = f"universe-refresh-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-    trading_date = resolve_trading_date(args.date)
 
     status = {
         "run_id": run_id,
@@ -462,7 +466,7 @@ def main() -> int:
         "status": "running",
         "reason": "",
         "trading_date": trading_date,
-        "dry_run": bool(args.dry_run),
+        "dry_run": bool(dry_run),
         "config": {
             "core_top_n": cfg.core_top_n,
             "extended_top_n": cfg.extended_top_n,
@@ -478,7 +482,6 @@ def main() -> int:
     }
 
     try:
-        supabase = create_client(supabase_url, supabase_key)
         try:
             frame, name_by_code, market_by_code = load_market_frames(trading_date)
         except Exception as e:
@@ -488,7 +491,7 @@ def main() -> int:
         if frame.empty:
             status["status"] = "failed"
             status["reason"] = "empty_market_frame"
-            return 1
+            return status
 
         existing = fetch_existing_map(supabase)
         listed_codes = set(frame.index.astype(str).tolist())
@@ -588,9 +591,9 @@ def main() -> int:
                 if inactivation_guard and miss_count > cfg.missing_grace_runs:
                     missing_active_codes.append(code)
 
-        upserted = len(upserts) if args.dry_run else apply_upserts(supabase, upserts)
-        inactivated = len(missing_active_codes) if args.dry_run else apply_inactive_updates(supabase, missing_active_codes)
-        if not args.dry_run:
+        upserted = len(upserts) if dry_run else apply_upserts(supabase, upserts)
+        inactivated = len(missing_active_codes) if dry_run else apply_inactive_updates(supabase, missing_active_codes)
+        if not dry_run:
             save_missing_tracker(next_tracker)
 
         status["status"] = "success"
@@ -611,7 +614,7 @@ def main() -> int:
         }
 
         changed = (promoted_to_core + promoted_to_extended + demoted_to_tail + inactivated) > 0
-        if (cfg.notify_always or changed) and not args.dry_run:
+        if (cfg.notify_always or changed) and not dry_run:
             alert_lines = [
                 f"[유니버스 자동화] {trading_date}",
                 f"listed={len(listed_codes)} core+={promoted_to_core} ext+={promoted_to_extended} tail+={demoted_to_tail}",
@@ -627,17 +630,42 @@ def main() -> int:
             f"  listed={len(listed_codes)} upserted={upserted} inactivated_missing={inactivated} "
             f"core+={promoted_to_core} ext+={promoted_to_extended} tail+={demoted_to_tail}"
         )
-        return 0
+        return status
     except Exception as e:
         status["status"] = "failed"
         status["reason"] = str(e)
         send_telegram_alert(f"[유니버스 자동화 실패] {trading_date}\nreason={e}")
         print(f"[universe-refresh] failed: {e}")
-        return 1
+        return status
     finally:
         status["finished_at"] = datetime.now().isoformat()
         write_status(status)
 
 
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Refresh stocks universe membership")
+    parser.add_argument("--date", type=str, help="Trading date YYYYMMDD")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--mark-missing-inactive", action="store_true")
+    args = parser.parse_args()
+
+    load_env_file()
+
+    supabase_url = os.environ.get("SUPABASE_URL")
+    supabase_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY") or os.environ.get("SUPABASE_SERVICE_KEY")
+    if not supabase_url or not supabase_key:
+        print("[ERROR] SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY missing")
+        return 1
+
+    supabase = create_client(supabase_url, supabase_key)
+    status = refresh_universe_membership(
+        supabase,
+        resolve_trading_date(args.date),
+        dry_run=args.dry_run,
+        cfg=load_universe_config(args.mark_missing_inactive),
+    )
+    return 0 if status["status"] == "success" else 1
+
+
 if __name__ == "__main__":
     raise SystemExit(main())
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Daily batch performance report over logs/daily_batch_history.ndjson.
+
+- per-stage p50/p95 durations and week-over-week regressions
+- correlation with universe size and upstream failure counts
+- stages trending toward the 600s batch target
+
+Usage:
+  python scripts/report_batch_history.py                    # last 28 days, text summary
+  python scripts/report_batch_history.py --json             # full report as JSON
+  python scripts/report_batch_history.py --send-telegram    # send the summary via the batch alert path
+  python scripts/report_batch_history.py --send-telegram --alerts-only
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+from batch_modules.history import TARGET_SECONDS, analyze, format_summary, has_alerts, load_history
+
+DEFAULT_HISTORY = Path(__file__).resolve().parents[1] / "logs" / "daily_batch_history.ndjson"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Daily batch run-history performance report")
+    parser.add_argument("--history", default=str(DEFAULT_HISTORY), help="history ndjson path")
+    parser.add_argument("--days", type=int, default=28, help="look-back window in days (0 = all)")
+    parser.add_argument("--target", type=float, default=TARGET_SECONDS, help="batch time target in seconds")
+    parser.add_argument("--json", action="store_true", help="print the full report as JSON")
+    parser.add_argument("--send-telegram", action="store_true", help="send the summary to the admin chat")
+    parser.add_argument("--alerts-only", action="store_true", help="with --send-telegram, only send when something is flagged")
+    args = parser.parse_args()
+
+    runs = load_history(Path(args.history), days=args.days)
+    report = analyze(runs, target_seconds=args.target)
+    summary = format_summary(report)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(summary)
+
+    if args.send_telegram and (has_alerts(report) or not args.alerts_only):
+        from batch_modules.utils import load_env_file
+        from daily_batch import send_telegram_alert
+
+        load_env_file()
+        if not send_telegram_alert(summary):
+            print("[WARN] Telegram summary not sent (missing TELEGRAM_BOT_TOKEN/chat id or request failed)")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -33,6 +33,9 @@ except ImportError:
 
 from supabase import create_client, Client
 
+sys.path.insert(0, str(Path(__file__).parent))
+from batch_modules.krx import build_isin_fallback, get_krx_client
+
 
 # ── 환경 변수 ──────────────────────────────────────────────
 def load_env_file(filepath: str = ".env"):
@@ -193,7 +196,13 @@ def load_short_map_from_csv(csv_path: str, trading_iso: str) -> dict[str, dict]:
     return out
 
 def get_last_trading_date() -> str:
-    """가장 최근 거래일을 YYYYMMDD 형식으로 반환 (삼성전자 기준)"""
+    """가장 최근 거래일을 YYYYMMDD 형식으로 반환 (KRX 캘린더 캐시, 실패 시 삼성전자 기준 조회)"""
+    if HAS_PYKRX:
+        try:
+            from batch_modules.calendar import last_trading_day
+            return last_trading_day()
+        except Exception:
+            pass
     today = datetime.now(ZoneInfo("Asia/Seoul"))
     for delta in range(0, 8):
         d = today - timedelta(days=delta)
@@ -277,7 +286,11 @@ def _patch_pykrx_session(session: "requests.Session") -> None:
         print(f"  [PyKRX] patch 실패 (무시): {e}")
 
 def _build_isin(code6: str) -> str:
-    return f"KR7{code6.zfill(6)}0003"
+    """Cached finder_stkisu ISIN (shared with the batch), else the KR7xxxxxx0003 pattern."""
+    try:
+        return get_krx_client().resolve_isin(code6)[0]
+    except Exception:
+        return build_isin_fallback(code6)
 
 def _parse_krx_num(s) -> Optional[float]:
     return safe_float(str(s).replace(",", "").strip())
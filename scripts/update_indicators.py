@@ -7,6 +7,7 @@ from supabase import create_client
 from datetime import datetime, timedelta, date
 
 from _price_adjustment import adjust_ohlcv_for_splits
+from batch_modules.utils import last_atr, atr_percent
 
 # --- .env 로드 ---
 def load_env_file(filepath=".env"):
@@ -65,24 +66,16 @@ def calculate_macd(close, fast=12, slow=26, signal=9):
 
 
 def calculate_atr_pct(df, period=14):
-    high = df["고가"]
-    low = df["저가"]
-    close = df["종가"]
-    prev_close = close.shift(1)
-
-    tr = pd.concat(
-        [
-            (high - low).abs(),
-            (high - prev_close).abs(),
-            (low - prev_close).abs(),
-        ],
-        axis=1,
-    ).max(axis=1)
-    atr = tr.rolling(window=period, min_periods=period).mean()
-    atr14 = atr.iloc[-1] if len(atr) else np.nan
-    last_close = close.iloc[-1] if len(close) else np.nan
-    atr_pct = (atr14 / last_close * 100.0) if last_close and not pd.isna(atr14) else np.nan
-    return atr14, atr_pct
+    if len(df) < period:
+        return np.nan, np.nan
+    atr14, _ = last_atr(
+        df["고가"].to_numpy(dtype=float),
+        df["저가"].to_numpy(dtype=float),
+        df["종가"].to_numpy(dtype=float),
+        period,
+    )
+    atr_pct = float(atr_percent(atr14, df["종가"].iloc[-1]))
+    return float(atr14), atr_pct
 
 
 def calculate_avwap_support(close, volume):
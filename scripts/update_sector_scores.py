@@ -3,6 +3,7 @@
 # 설명: KRX 지수/업종 데이터 및 수급 데이터 수집 -> 섹터 점수 계산 -> Supabase에 upsert
 
 import os
+import sys
 import time
 import json
 import traceback
@@ -12,6 +13,9 @@ from supabase import create_client
 from datetime import datetime, timedelta
 from pykrx import stock
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from batch_modules.calendar import shift_business_days
+
 # ---------------------------
 # 환경 변수 로드 (.env)
 # ---------------------------
@@ -55,14 +59,17 @@ def normalize_name(s):
     return str(s).strip()
 
 def get_biz_days_ago(date_str, n):
-    """단순 영업일 역산 (공휴일 미고려, 주말만 제외)"""
-    dt = datetime.strptime(date_str, "%Y%m%d")
-    cnt = 0
-    while cnt < n:
-        dt -= timedelta(days=1)
-        if dt.weekday() < 5: # 월~금
-            cnt += 1
-    return dt.strftime("%Y%m%d")
+    """n 거래일 전 날짜 (KRX 캘린더 캐시 기준, 실패 시 주말만 제외해 역산)"""
+    try:
+        return shift_business_days(date_str, -n)
+    except Exception:
+        dt = datetime.strptime(date_str, "%Y%m%d")
+        cnt = 0
+        while cnt < n:
+            dt -= timedelta(days=1)
+            if dt.weekday() < 5: # 월~금
+                cnt += 1
+        return dt.strftime("%Y%m%d")
 
 def retry_call(func, attempts=3, wait=0.3, backoff=2.0):
     last_exc = None
@@ -176,18 +183,18 @@ def get_sector_flows(stocks_df, today_str, stock_change_map=None):
                 )
                 
                 # 5일치 합산
-                     if not df_5d.empty:
-                            try:
-                                f5 = int(df_5d.loc['외국인', '순매수거래대금'])
-                                i5 = int(df_5d.loc['기관합계', '순매수거래대금'])
-                                f5_sum += f5
-                                i5_sum += i5
-                                cap = safe_float(row.get('market_cap', 0), 0.0)
-                                if cap > 0:
-                                     weighted_flow_5d_sum += (f5 + i5) * cap
-                                     weight_sum += cap
-                            except KeyError:
-                                pass
+                if df_5d is not None and not df_5d.empty:
+                    try:
+                        f5 = int(df_5d.loc['외국인', '순매수거래대금'])
+                        i5 = int(df_5d.loc['기관합계', '순매수거래대금'])
+                        f5_sum += f5
+                        i5_sum += i5
+                        cap = safe_float(row.get('market_cap', 0), 0.0)
+                        if cap > 0:
+                            weighted_flow_5d_sum += (f5 + i5) * cap
+                            weight_sum += cap
+                    except KeyError:
+                        pass
 
                 # 20일치 합산
                 try: